@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""
+Замеры производительности KeyToFate (без сети, токен не нужен).
+
+  python bench.py                — все секции
+  python bench.py persistence    — только выбранные секции
+  python bench.py micro --json run.json --baseline base.json --threshold 0.25
+                                 — сохранить результаты (µs/op) и упасть, если что-то
+                                   медленнее базового прогона больше чем на threshold
+"""
+import os, sys, json, time, asyncio, tempfile, random, argparse, warnings
+
+os.environ.setdefault("API_TOKEN", "0:bench")
+for _key in ("OUT_CHAT_RATE", "OUT_CHAT_BURST", "OUT_GLOBAL_RATE"):  # лимиты Telegram не замеряем
+    os.environ.setdefault(_key, "1e9")
+os.environ.setdefault("PERSISTENCE_DB", "")  # диалоги бенча не должны попадать в настоящую базу
+import bot  # noqa: E402
+
+RESULTS = {}     # "секция/замер" → µs на операцию (для --json / --baseline)
+_section = ""
+
+def _report(name: str, n: int, seconds: float):
+    RESULTS[f"{_section}/{name}"] = round(1e6 * seconds / n, 3)
+    print(f"  {name:<40} {n:>8} x  {1e6 * seconds / n:>9.2f} µs")
+
+# ---------------------------- Хранилище ------------------------------------
+async def _persistence_run(persistence, n_updates: int, n_users: int) -> float:
+    """Имитация обработчика: пишет дату в user_data, затем сохраняет (как Application)."""
+    user_data = {}
+    t0 = time.perf_counter()
+    for i in range(n_updates):
+        uid = i % n_users
+        data = user_data.setdefault(uid, {})
+        data["dob"] = (1 + i % 28, 1 + i % 12, 1950 + i % 60)
+        data["dob_str"] = "{:02d}.{:02d}.{}".format(*data["dob"])
+        if persistence is not None:
+            await persistence.update_user_data(uid, data)
+    if persistence is not None:
+        await persistence.flush()
+    return time.perf_counter() - t0
+
+def bench_persistence(n_updates: int = 5000, n_users: int = 500):
+    print("persistence (Handler-Latenz pro Update):")
+    _report("ohne Persistenz", n_updates, asyncio.run(_persistence_run(None, n_updates, n_users)))
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, batch, flush_sec in (("SQLite, Schreiben pro Update", 1, 0.0),
+                                        ("SQLite, gebündelt (Standard)", bot.PERSIST_BATCH, bot.PERSIST_FLUSH_SEC)):
+            p = bot.SqlitePersistence(os.path.join(tmp, f"b{batch}.db"), batch=batch, flush_sec=flush_sec)
+            secs = asyncio.run(_persistence_run(p, n_updates, n_users))
+            _report(f"{label} ({p.transactions} Tx)", n_updates, secs)
+
+# --------------------- Параллельность и порядок по чатам ---------------------
+def _fake_update(update_id: int, chat_id: int):
+    from telegram import Update, Message, Chat
+    msg = Message(message_id=update_id, date=None, chat=Chat(chat_id, "private"), text="x")
+    return Update(update_id, message=msg)
+
+async def _concurrency_run(n_chats: int, per_chat: int, limit: int):
+    proc = bot.ChatSerialUpdateProcessor(limit)
+    seen = {c: [] for c in range(n_chats)}
+    active = peak = 0
+
+    async def handler(chat: int, seq: int):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(random.random() / 1000)  # «сеть»
+        seen[chat].append(seq)
+        active -= 1
+
+    # апдейты разных чатов перемешаны, как при реальном потоке
+    order = [(c, i) for i in range(per_chat) for c in random.sample(range(n_chats), n_chats)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*(proc.process_update(_fake_update(n, c), handler(c, i))
+                           for n, (c, i) in enumerate(order)))
+    secs = time.perf_counter() - t0
+    ok = all(seq == list(range(per_chat)) for seq in seen.values())
+    return secs, peak, ok
+
+def bench_concurrency(n_chats: int = 200, per_chat: int = 10):
+    print("concurrency (pro Chat seriell, Chats parallel):")
+    for limit in (1, 8, 64):
+        secs, peak, ok = asyncio.run(_concurrency_run(n_chats, per_chat, limit))
+        _report(f"Limit {limit}: max parallel {peak}, Reihenfolge {'ok' if ok else 'FEHLER'}",
+                n_chats * per_chat, secs)
+        if not ok:
+            raise SystemExit("conversation order broken")
+    secs, chats, bad = asyncio.run(_conversation_run(n_chats))
+    _report(f"Partnerschaft-Dialog: {chats} Chats, Fehler {bad}", chats * 3, secs)
+    if bad:
+        raise SystemExit("conversation states mixed up")
+    secs, chats, bad = asyncio.run(_ki_stream_run(n_chats))
+    _report(f"KI-Streaming: {chats} Chats, ohne Zwischenstand {bad}", chats, secs)
+    if bad:
+        raise SystemExit("KI answers not streamed")
+
+class _OfflineRequest(bot.HTTPXRequest):
+    """Bot API без сети: getMe/sendMessage/answerCallbackQuery отвечают сразу (с «сетевой» паузой),
+    тексты складываются по чатам."""
+
+    def __init__(self):
+        super().__init__()
+        self.sent, self.edits = {}, {}
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        name, params = url.rsplit("/", 1)[-1], (request_data.parameters if request_data else {})
+        await asyncio.sleep(random.random() / 1000)
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif name == "sendMessage":
+            chat = int(params["chat_id"])
+            self.sent.setdefault(chat, []).append(params["text"])
+            result = {"message_id": len(self.sent[chat]), "date": int(time.time()),
+                      "chat": {"id": chat, "type": "private"}, "text": params["text"]}
+        elif name == "editMessageText":
+            self.edits.setdefault(int(params["chat_id"]), []).append(params["text"])
+            result = True
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+async def _offline_app():
+    from telegram.warnings import PTBUserWarning
+    warnings.filterwarnings("ignore", category=PTBUserWarning)  # per_message / timeout без JobQueue — здесь не важны
+    request = _OfflineRequest()
+    app = bot.build_application(request)
+    await app.initialize()
+    return app, request
+
+def _click(app, n: int, chat: int, data: str, user: int = 0):
+    from telegram import Update, Message, Chat, User, CallbackQuery
+    user = user or chat  # user ≠ chat — групповой чат
+    msg = Message(n, None, Chat(chat, "private" if user == chat else "group"), from_user=app.bot.bot, text="Menü")
+    u = Update(n, callback_query=CallbackQuery(str(n), User(user, False, f"U{user}"), str(chat), message=msg, data=data))
+    u.set_bot(app.bot); u.callback_query.set_bot(app.bot); msg.set_bot(app.bot)
+    return u
+
+def _text(app, n: int, chat: int, txt: str, user: int = 0):
+    from telegram import Update, Message, Chat, User
+    user = user or chat
+    msg = Message(n, None, Chat(chat, "private" if user == chat else "group"), from_user=User(user, False, f"U{user}"), text=txt)
+    u = Update(n, message=msg)
+    u.set_bot(app.bot); msg.set_bot(app.bot)
+    return u
+
+async def _process(app, updates):
+    await asyncio.gather(*(app.update_processor.process_update(u, app.process_update(u)) for u in updates))
+
+async def _conversation_run(n_chats: int):
+    """
+    Настоящий ConversationHandler (build_application) за ChatSerialUpdateProcessor:
+    calc_compat → Person 1 → Person 2 у многих чатов вперемешку. Каждый чат должен
+    пройти ASK_COMPAT_1 → ASK_COMPAT_2 → END со своими датами.
+    """
+    app, request = await _offline_app()
+    conv = next(h for h in app.handlers[0] if isinstance(h, bot.ConversationHandler))
+    dates = {c: (f"{1 + c % 28:02d}.{1 + c % 12:02d}.1980", f"{1 + c * 7 % 28:02d}.{1 + c % 11:02d}.1991")
+             for c in range(1, n_chats + 1)}
+    steps = [lambda n, c: _click(app, n, c, "calc_compat"), lambda n, c: _text(app, n, c, dates[c][0]),
+             lambda n, c: _text(app, n, c, dates[c][1])]
+    updates, n = [], 0
+    for step in steps:  # шаг i всех чатов в случайном порядке, следующий шаг не ждёт ответа
+        for chat in random.sample(sorted(dates), n_chats):
+            n += 1
+            updates.append(step(n, chat))
+    t0 = time.perf_counter()
+    await _process(app, updates)
+    secs = time.perf_counter() - t0
+    bad = 0
+    for chat, (d1, d2) in dates.items():
+        texts = request.sent.get(chat, [])
+        g1 = bot.matrix(*bot.parse_date(d1)).g
+        g2 = bot.matrix(*bot.parse_date(d2)).g
+        ok = (len(texts) >= 3 and "Person 1" in texts[0] and "Person 2" in texts[1]
+              and f"{d1} → Geisteszahl {g1}" in texts[2] and f"{d2} → Geisteszahl {g2}" in texts[2]
+              and (chat, chat) not in conv._conversations and app.user_data[chat].dob_str == d1)
+        bad += not ok
+    await app.shutdown()
+    return secs, len(dates), bad
+
+KI_PIECES, KI_PIECE_DELAY = 12, 0.02
+
+@bot.ki_backend("bench")
+async def _ki_bench(question: str, profile):
+    """Бэкенд как у LLM: куски приходят со временем, а не одним махом."""
+    for i in range(KI_PIECES):
+        await asyncio.sleep(KI_PIECE_DELAY)
+        yield f"{question} #{i} "
+
+async def _ki_stream_run(n_chats: int):
+    """
+    KI-Modus с медленным бэкендом: каждый чат должен увидеть промежуточные правки
+    плейсхолдера и итоговый полный текст (вопросы разные — без кэша и склейки).
+    """
+    backend, interval = bot.KI_BACKEND, bot.KI_EDIT_INTERVAL
+    bot.KI_BACKEND, bot.KI_EDIT_INTERVAL = "bench", KI_PIECE_DELAY * 3
+    app, request = await _offline_app()
+    # цифры id → согласные: окончания (-e, -n, -s …) search_term склеил бы разные вопросы в один ключ
+    questions = {c: "Thema kz" + "".join("bcdfghjkmp"[int(d)] for d in str(c)) for c in range(1, n_chats + 1)}
+    await _process(app, [_click(app, c, c, "ki_mode") for c in questions])
+    t0 = time.perf_counter()
+    await _process(app, [_text(app, n_chats + c, c, q) for c, q in questions.items()])
+    secs = time.perf_counter() - t0
+    bad = 0
+    for chat, q in questions.items():
+        edits = request.edits.get(chat, [])
+        final = " ".join(f"{q} #{i}" for i in range(KI_PIECES))
+        bad += not (len(edits) >= 2 and edits[0].endswith("▌") and edits[-1].strip() == final)
+    # один человек спрашивает одновременно в личке и в группе: второй вопрос ждёт отказ (KI_USER_LIMIT)
+    group, n = -4242, 3 * n_chats
+    await _process(app, [_click(app, n + 1, group, "ki_mode", user=1)])
+    rejected = bot.KI_STATS["abgewiesen"]
+    await _process(app, [_text(app, n + 2, 1, "Thema qpx"), _text(app, n + 3, group, "Thema qpy", user=1)])
+    bad += bot.KI_STATS["abgewiesen"] - rejected != 1
+    await app.shutdown()
+    bot.KI_BACKEND, bot.KI_EDIT_INTERVAL = backend, interval
+    return secs, len(questions), bad
+
+# ----------------------------- Нумерология ----------------------------------
+def _all_dates(first: int = 1900, last: int = 2100):
+    from datetime import date, timedelta
+    day, end, one = date(first, 1, 1), date(last, 12, 31), timedelta(days=1)
+    while day <= end:
+        yield day.day, day.month, day.year
+        day += one
+
+def bench_numerology():
+    print("numerology (Batch vs. Skalar, alle Daten 1900–2100):")
+    dates = list(_all_dates())
+    days, months, years = (list(col) for col in zip(*dates))
+    t0 = time.perf_counter()
+    scalar = []
+    for d, m, y in dates:
+        g, h = bot.geisteszahl(d), bot.handlungszahl(d, m, y)
+        v = bot.verwirklichungszahl(g, h)
+        scalar.append((g, h, v, bot.ergebniszahl(g, h, v), bot.geldcode(d, m, y)))
+    t1 = time.perf_counter()
+    bot.numerology_batch(days[:1], months[:1], years[:1])  # таблица строится один раз
+    t2 = time.perf_counter()
+    columns = bot.numerology_batch(days, months, years)
+    t3 = time.perf_counter()
+    batch = list(zip(*columns))  # для сверки со скалярным путём, в замер не входит
+    if batch != scalar:
+        bad = next(i for i, (a, b) in enumerate(zip(batch, scalar)) if a != b)
+        raise SystemExit(f"batch != scalar for {dates[bad]}: {batch[bad]} vs {scalar[bad]}")
+    _report("Skalar", len(dates), t1 - t0)
+    _report(f"Batch (+ Tabelle {1000 * (t2 - t1):.1f} ms)", len(dates), t3 - t2)
+    print(f"  identisch für {len(dates)} Daten, {len(dates) / (t3 - t2) / 1e6:.2f} Mio. Daten/s")
+    bot.matrix.cache_clear()
+    t4 = time.perf_counter()
+    profiles = [bot.matrix(d, m, y) for d, m, y in dates]
+    t5 = time.perf_counter()
+    for (d, m, y), p, row in zip(dates, profiles, scalar):
+        if (p.g, p.h, p.v, p.e, p.geld) != row:
+            raise SystemExit(f"Matrix != scalar for {(d, m, y)}: {p!r} vs {row}")
+    hot = dates[-bot.MATRIX_CACHE_SIZE // 2:]
+    _report("Matrix (kalt)", len(dates), t5 - t4)
+    _report(f"Matrix (LRU, {len(hot)} Daten)", len(hot), _best(lambda: [bot.matrix(d, m, y) for d, m, y in hot], 1))
+    info = bot.matrix.cache_info()
+    print(f"  Matrix-Cache {info.currsize}/{info.maxsize}, ~{sys.getsizeof(profiles[0]) * info.currsize // 1024} KB Profile")
+
+# ------------------------- Горячие пути (микро) -----------------------------
+def _best(fn, n: int, repeat: int = 5) -> float:
+    """Лучшее из repeat прогонов по n вызовов — шум планировщика не попадает в результат."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def _synthetic_corpus(path: str, factor: int = 10) -> str:
+    """Копия книги, где тело каждого раздела повторено factor раз (заголовки те же)."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    heads = list(bot.SECTION_HEADING.finditer(raw))
+    out = [raw[:heads[0].start()]] if heads else [raw]
+    for i, m in enumerate(heads):
+        end = heads[i + 1].start() if i + 1 < len(heads) else len(raw)
+        out.append(raw[m.start():m.end()] + raw[m.end():end] * factor)
+    fd, synth = tempfile.mkstemp(suffix=".txt")
+    with os.fdopen(fd, "wb") as f:
+        f.write(b"".join(out))
+    return synth
+
+def _micro_corpus(label: str, corpus):
+    """Замеры, зависящие от книги: bot.CORPUS временно подменяется на corpus."""
+    saved = bot.CORPUS
+    bot.CORPUS = corpus
+    try:
+        blocks = [corpus.block("geistes", n) for n in sorted(corpus.sections["geistes"])]
+        _report(f"[{label}] split_geistes_block_by_days", len(blocks) * 5,
+                _best(lambda: [bot.split_geistes_block_by_days(b) for b in blocks], 5))
+        days = list(range(1, 32))
+        _report(f"[{label}] Vollanalyse-Fragment (kalt)", len(days),
+                _best(lambda: [bot._render_full_fragment(d) for d in days], 1))
+        texts = [bot._render_full_fragment(d) for d in days]
+        _report(f"[{label}] split_html_chunks (Vollanalyse)", len(texts) * 5,
+                _best(lambda: [bot.split_html_chunks(t) for t in texts], 5))
+        print(f"  [{label}] Vollanalyse: max {max(map(len, texts)) // 1000} Tsd. Zeichen, "
+              f"max {max(len(bot.split_html_chunks(t)) for t in texts)} Nachrichten")
+    finally:
+        bot.CORPUS = saved
+
+async def _wrapper_overhead(n: int) -> float:
+    """Цена METRICS.wrap: обёрнутый пустой обработчик минус голый."""
+    async def handler(update, context):
+        return None
+    timed = bot.Metrics().wrap(handler)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await timed(None, None)
+    t1 = time.perf_counter()
+    for _ in range(n):
+        await handler(None, None)
+    return max(0.0, 2 * t1 - t0 - time.perf_counter())
+
+def bench_micro():
+    print("micro (Hot Paths):")
+    group = "Team: 25.11.1978, 03.02.1985 und 17.07.1990; 01.01.2000 / 29.02.1996"
+    dates = [(1 + i % 28, 1 + i % 12, 1950 + i % 70) for i in range(1000)]
+    it = iter(range(1 << 62))
+    _check_locales()
+    _report("LOCALES.pick", 50000, _best(lambda: bot.LOCALES.pick("ru-RU"), 50000))
+    _report("parse_date", 20000, _best(lambda: bot.parse_date("25.11.1978"), 20000))
+    _report("parse_dates_multi (5 Daten)", 5000, _best(lambda: bot.parse_dates_multi(group), 5000))
+    _report("reduzieren", 50000, _best(lambda: bot.reduzieren(1978 + 25 + 11), 50000))
+    _report("geldcode", 1000 * 10, _best(lambda: [bot.geldcode(d, m, y) for d, m, y in dates], 10))
+    _report("namensenergie", 20000, _best(lambda: bot.namensenergie("Jürgen Müller-Weiß"), 20000))
+    bot._fullanalyse_body.cache_clear()
+    _report("build_fullanalyse_text (LRU)", 1000 * 10,
+            _best(lambda: [bot.build_fullanalyse_text(d, m, y) for d, m, y in dates], 10))
+    _report("build_fullanalyse_text (LRU leer)", 200,
+            _best(lambda: (bot._fullanalyse_body.cache_clear(),
+                           bot.build_fullanalyse_text(1 + next(it) % 31, 11, 1978)), 200))
+    _report("kalender (Jahr, Energie 8)", 20000, _best(lambda: bot.kalender(1 + next(it) % 31, 2026, 0, 8), 20000))
+    _report("build_kalender_text (Jahr)", 1000, _best(lambda: bot.build_kalender_text(1 + next(it) % 31, 2026, 0, 8), 1000))
+    _report("build_kalender_text (Monat)", 1000,
+            _best(lambda: bot.build_kalender_text(1 + next(it) % 31, 2026, 1 + next(it) % 12, 8), 1000))
+    _report("build_kalender_ics (Jahr)", 100, _best(lambda: bot.build_kalender_ics(1 + next(it) % 31, 2026), 100))
+
+    _report("SEARCH.query (BM25 + Snippets)", 1000,
+            _best(lambda: bot.SEARCH.query("Beruf und Beziehungen"), 1000))
+    _report("Metriken: Handler-Wrapper", 100000, asyncio.run(_wrapper_overhead(100000)))
+
+    _micro_corpus("Buch", bot.CORPUS)
+    synth = _synthetic_corpus(bot.CORPUS.path)
+    try:
+        os.environ["K2_INDEX_PATH"] = synth + ".idx.json"
+        t0 = time.perf_counter()
+        corpus = bot.Corpus(synth)
+        _report("[10x] Corpus-Index aufbauen", 1, time.perf_counter() - t0)
+        _micro_corpus("10x", corpus)
+    finally:
+        os.environ.pop("K2_INDEX_PATH", None)
+        for f in (synth, synth + ".idx.json"):
+            if os.path.exists(f):
+                os.remove(f)
+
+def _check_locales():
+    """Языки из locales/ выбираются и без своей книги; подписи — с теми же параметрами, что у DEFAULT_LANG."""
+    from string import Formatter
+    base = bot.LOCALES[bot.DEFAULT_LANG]
+    for code, want in (("ru", "ru"), ("ru-RU", "ru"), ("en", "en"), ("en-GB", "en"), ("xx", bot.DEFAULT_LANG), (None, bot.DEFAULT_LANG)):
+        if bot.LOCALES.pick(code) != want:
+            raise SystemExit(f"LOCALES.pick({code!r}) = {bot.LOCALES.pick(code)!r}, erwartet {want!r}")
+    for lang in sorted(bot.LOCALES.available - {bot.DEFAULT_LANG}):
+        pack = bot.LOCALES[lang]
+        if "text" in pack.missing:
+            raise SystemExit(f"locale {lang}: Texte fehlen: {sorted(base.text.keys() - pack.text.keys())}")
+        for key, text in base.text.items():
+            fields = {f for _, f, _, _ in Formatter().parse(text) if f}
+            if {f for _, f, _, _ in Formatter().parse(pack.text[key]) if f} != fields:
+                raise SystemExit(f"locale {lang}: {key} — andere Platzhalter als {bot.DEFAULT_LANG} {sorted(fields)}")
+    print(f"  Sprachen {', '.join(sorted(bot.LOCALES.available))}: pick und Platzhalter ok")
+
+SECTIONS = {
+    "persistence": bench_persistence,
+    "concurrency": bench_concurrency,
+    "numerology": bench_numerology,
+    "micro": bench_micro,
+}
+
+def _compare(baseline_path: str, threshold: float) -> int:
+    """Сравнение с базовым JSON: число замеров, ставших медленнее порога."""
+    with open(baseline_path, encoding="utf-8") as f:
+        base = json.load(f)["results"]
+    bad = 0
+    print(f"Vergleich mit {baseline_path} (Schwelle +{100 * threshold:.0f} %):")
+    for key in sorted(RESULTS.keys() & base.keys()):
+        old, new = base[key], RESULTS[key]
+        delta = (new - old) / old if old else 0.0
+        flag = "REGRESSION" if delta > threshold else ""
+        bad += bool(flag)
+        print(f"  {key:<56} {old:>9.2f} → {new:>9.2f} µs  {100 * delta:+6.1f} %  {flag}")
+    return bad
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="KeyToFate benchmarks")
+    ap.add_argument("sections", nargs="*", metavar="section", help=", ".join(SECTIONS))
+    ap.add_argument("--json", help="Ergebnisse als JSON speichern")
+    ap.add_argument("--baseline", help="JSON eines früheren Laufs zum Vergleich")
+    ap.add_argument("--threshold", type=float, default=0.25, help="erlaubte Verlangsamung (0.25 = 25 %%)")
+    args = ap.parse_args()
+    unknown = set(args.sections) - SECTIONS.keys()
+    if unknown:
+        ap.error(f"unbekannte Sektion: {', '.join(sorted(unknown))}")
+    for _section in (args.sections or SECTIONS):
+        SECTIONS[_section]()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "time": int(time.time()), "results": RESULTS}, f, indent=1)
+    if args.baseline and _compare(args.baseline, args.threshold):
+        raise SystemExit(1)
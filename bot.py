@@ -1,67 +1,279 @@
 # -*- coding: utf-8 -*-
-import os, re
-from datetime import datetime
-from typing import Tuple, List, Dict, Set
-
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import os, re, io, json, time, hashlib, mmap, pickle, sqlite3, asyncio, hmac, secrets, signal
+import sys, cProfile, marshal, pstats, math, heapq, shutil, tempfile, zlib, queue, threading, multiprocessing
+from collections import deque, OrderedDict
+from collections.abc import Mapping
+from datetime import datetime, time as dtime
+from zoneinfo import ZoneInfo
+from functools import lru_cache, wraps
+from bisect import bisect_left
+from operator import add
+from types import MappingProxyType
+from typing import Tuple, List, Dict, Set, NamedTuple, Callable, Awaitable, AsyncIterator
+
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, Message, InputFile,
+                      InlineQueryResultArticle, InputTextMessageContent, InlineQueryResultsButton)
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application, CommandHandler, ContextTypes, MessageHandler,
-    CallbackQueryHandler, ConversationHandler, filters
+    CallbackQueryHandler, ConversationHandler, InlineQueryHandler, filters,
+    BasePersistence, PersistenceInput, BaseUpdateProcessor, TypeHandler, ApplicationHandlerStop
 )
 from dotenv import load_dotenv
-from urllib.parse import quote_plus
+from urllib.parse import quote, quote_plus
+import httpx
 
 # ======================= Загрузка книги и справочников =======================
 
 K2_PATH = os.getenv("K2_PATH", "KeytoFate_arbeiten.txt")
+INDEX_VERSION = 4
+BLOCK_CACHE_SIZE = int(os.getenv("BLOCK_CACHE_SIZE", "16"))
+CORPUS_WATCH_SEC = int(os.getenv("CORPUS_WATCH_SEC", "30"))  # 0 — без горячей перезагрузки
+
+def _corpus_path() -> str:
+    """Путь к книге: K2_PATH или /app/KeytoFate_arbeiten.txt (Railway/Docker)."""
+    if os.path.exists(K2_PATH):
+        return K2_PATH
+    alt = "/app/KeytoFate_arbeiten.txt"
+    if os.path.exists(alt):
+        return alt
+    return K2_PATH
 
-def _load_corpus() -> str:
-    """Читает текст книги из K2_PATH или /app/KeytoFate_arbeiten.txt (Railway/Docker)."""
-    try:
-        if os.path.exists(K2_PATH):
-            with open(K2_PATH, "r", encoding="utf-8") as f:
-                return f.read()
-        alt = "/app/KeytoFate_arbeiten.txt"
-        if os.path.exists(alt):
-            with open(alt, "r", encoding="utf-8") as f:
-                return f.read()
-    except Exception as e:
-        print(f"[WARN] corpus load error: {e}")
-    return ""
+# -------------------------- Парсер подблоков "по дням" в Geisteszahl --------
+NUM_LINE = re.compile(r'^\s*(?:[-–•]?\s*)?([1-9]|[12]\d|3[01])\s*\.?\s*$', re.M)
+DE_HEADING = re.compile(
+    r'^\s*[-–•]?\s*(?:wenn)\s+(?:sie|du)\s+am\s+([1-9]|[12]\d|3[01])\s*[.,]?\s+geboren\s+(?:sind|bist)\s*[:\-–]?\s*$',
+    re.I | re.M
+)
+
+def _split_day_spans(block: str) -> Tuple[Tuple[int, int], Dict[int, Tuple[int, int]]]:
+    """Как split_geistes_block_by_days, но возвращает смещения (до strip) вместо копий текста."""
+    matches = []
+    matches += [(m.start(), m.end(), int(m.group(1))) for m in NUM_LINE.finditer(block)]
+    matches += [(m.start(), m.end(), int(m.group(1))) for m in DE_HEADING.finditer(block)]
+    matches.sort(key=lambda x: x[0])
 
-CORPUS_TEXT = _load_corpus()
+    if not matches:
+        return (0, len(block)), {}
 
-def _extract_numbered_sections(corpus: str, heading_regex: str) -> dict[int, str]:
+    spans: Dict[int, Tuple[int, int]] = {}
+    for i, (s, e, day) in enumerate(matches):
+        end = matches[i+1][0] if i+1 < len(matches) else len(block)
+        spans[day] = (e, end)
+    return (0, matches[0][0]), spans
+
+def split_geistes_block_by_days(block: str) -> Tuple[str, Dict[int, str]]:
     """
-    Извлекает блоки по заголовкам вида:
-      Geisteszahl 1 / Handlungszahl 8 / Verwirklichungszahl 3 / Ergebniszahl 7 / Gemeinsame Geisteszahl 4
+    Возвращает (общая_часть, {день: текст_раздела}).
+    Поддерживаем два вида подзаголовков: отдельное число в строке и фразу «Wenn Sie am 25. geboren sind:».
     """
-    out: dict[int, str] = {}
-    if not corpus:
-        return out
-    pat = re.compile(heading_regex, re.I | re.M)
-    matches = list(pat.finditer(corpus))
-    if not matches:
-        return out
-    for i, m in enumerate(matches):
+    if not block:
+        return "", {}
+    (gs, ge), spans = _split_day_spans(block)
+    return block[gs:ge].strip(), {day: block[s:e].strip() for day, (s, e) in spans.items()}
+
+# -------------------------- Индекс разделов книги ---------------------------
+# Книга отображается в память (mmap), в индексе храним только байтовые смещения
+# разделов, а текст блока декодируем по запросу (с маленьким LRU). Так в памяти
+# не лежат ни весь текст, ни копии разделов, сколько бы книг/переводов ни было.
+#
+# Один проход по байтам находит все заголовки вида
+#   Geisteszahl 1 / Handlungszahl 8 / Verwirklichungszahl 3 / Ergebniszahl 7 / Gemeinsame Geisteszahl 4
+# (в книге Ergebniszahl озаглавлена «Zahl des Ergebnisses 7» — оба написания равноправны).
+# Блок раздела тянется до следующего заголовка того же вида. Индекс кладём рядом с
+# книгой в sidecar-файл, ключ — хеш файла, поэтому при рестарте парсинг не повторяется.
+SECTION_HEADING = re.compile(
+    rb'^\s*(?:##\s*)?(Gemeinsame\s+Geisteszahl|Geisteszahl|Handlungszahl|Verwirklichungszahl|Ergebniszahl|Zahl\s+des\s+Ergebnisses)\s+([1-9])\s*$',
+    re.I | re.M
+)
+SECTION_KINDS = {
+    "geisteszahl": "geistes", "handlungszahl": "handlungs", "verwirklichungszahl": "verwirk",
+    "ergebniszahl": "ergebnis", "zahl des ergebnisses": "ergebnis", "gemeinsame geisteszahl": "partner",
+}
+
+def _clean_block(raw: bytes) -> str:
+    # чистим только лишние пустые строки
+    return re.sub(r'\n{3,}', '\n\n', raw.decode("utf-8", errors="replace").strip())
+
+class Corpus:
+    """
+    Книга на mmap: {вид: {номер: (start, end)}} + разбивка блоков Geisteszahl по дням.
+    snapshot=True — отображается приватная (безымянная) копия файла: правки исходника,
+    даже на месте, не задевают рендеры, которые ещё читают этот экземпляр.
+    previous — прошлый Corpus: разбивку по дням берём у него для блоков с тем же хешем.
+    """
+
+    def __init__(self, path: str, snapshot: bool = False, previous: "Corpus | None" = None):
+        self.path = path
+        self.size = 0
+        self.stamp: Tuple[int, int] | None = None  # (mtime_ns, size) исходного файла
+        self._mm = None
+        self.sections: Dict[str, Dict[int, Tuple[int, int]]] = {k: {} for k in SECTION_KINDS.values()}
+        self.days: Dict[int, tuple] = {}
+        self.hashes: Dict[Tuple[str, int], str] = {}
+        self.reused = 0
+        self._previous = previous
+        self.block = lru_cache(maxsize=BLOCK_CACHE_SIZE)(self._decode)
+        self.prose = lru_cache(maxsize=BLOCK_CACHE_SIZE)(self._prose)
         try:
-            n = int(m.group(1))
-        except Exception:
-            continue
-        start = m.end()
-        end = matches[i+1].start() if i+1 < len(matches) else len(corpus)
-        block = corpus[start:end].strip()
-        # чистим только лишние пустые строки
-        block = re.sub(r'\n{3,}', '\n\n', block)
-        out[n] = block
-    return out
-
-# Разделы из книги
-GEISTES_FULL   = _extract_numbered_sections(CORPUS_TEXT, r'^\s*(?:##\s*)?Geisteszahl\s+([1-9])\s*$')
-HANDLUNGS_FULL = _extract_numbered_sections(CORPUS_TEXT, r'^\s*(?:##\s*)?Handlungszahl\s+([1-9])\s*$')
-VERWIRK_FULL   = _extract_numbered_sections(CORPUS_TEXT, r'^\s*(?:##\s*)?Verwirklichungszahl\s+([1-9])\s*$')
-ERGEBNIS_FULL  = _extract_numbered_sections(CORPUS_TEXT, r'^\s*(?:##\s*)?Ergebniszahl\s+([1-9])\s*$')
-PARTNER_FULL   = _extract_numbered_sections(CORPUS_TEXT, r'^\s*(?:##\s*)?Gemeinsame\s+Geisteszahl\s+([1-9])\s*$')
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with open(path, "rb") as f:
+                    st = os.fstat(f.fileno())
+                    self.stamp = (st.st_mtime_ns, st.st_size)
+                    if snapshot:
+                        with tempfile.TemporaryFile() as copy:
+                            shutil.copyfileobj(f, copy)
+                            copy.flush()
+                            self._mm = mmap.mmap(copy.fileno(), 0, access=mmap.ACCESS_READ)
+                    else:
+                        self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.size = len(self._mm)
+        except Exception as e:
+            print(f"[WARN] corpus load error: {e}")
+        if self._mm is not None:
+            self._load_index()
+        self._previous = None
+
+    def _load_index(self):
+        t0 = time.perf_counter()
+        key = f"v{INDEX_VERSION}:" + hashlib.sha256(self._mm).hexdigest()
+        t1 = time.perf_counter()
+        side = os.getenv("K2_INDEX_PATH") or self.path + ".idx.json"
+        source = "sidecar"
+        if not self._read_sidecar(side, key):
+            self._build_index()
+            self._write_sidecar(side, key)
+            source = "parse"
+        t2 = time.perf_counter()
+        counts = "/".join(str(len(spans)) for spans in self.sections.values())
+        print(f"[INFO] corpus index ({source}): {self.path}, {self.size // 1024} KB, sections {counts}, "
+              f"hash {1000*(t1-t0):.1f} ms, index {1000*(t2-t1):.1f} ms")
+
+    def _build_index(self):
+        heads: Dict[str, List[Tuple[int, int, int]]] = {k: [] for k in SECTION_KINDS.values()}
+        for m in SECTION_HEADING.finditer(self._mm):
+            kind = SECTION_KINDS[" ".join(m.group(1).decode("ascii").lower().split())]
+            heads[kind].append((m.start(), m.end(), int(m.group(2))))
+        for kind, found in heads.items():
+            for i, (_, start, n) in enumerate(found):
+                end = found[i+1][0] if i+1 < len(found) else self.size
+                self.sections[kind][n] = (start, end)
+        self._hash_sections()
+        # подзаголовки по дням — смещения внутри очищенного блока
+        prev = self._previous
+        for n in self.sections["geistes"]:
+            if prev is not None and n in prev.days and prev.hashes.get(("geistes", n)) == self.hashes[("geistes", n)]:
+                self.days[n] = prev.days[n]
+                self.reused += 1
+            else:
+                self.days[n] = _split_day_spans(self.prose("geistes", n))
+
+    def _hash_sections(self):
+        self.hashes = {(kind, n): hashlib.sha1(self._mm[s:e]).hexdigest()
+                       for kind, spans in self.sections.items() for n, (s, e) in spans.items()}
+
+    def _read_sidecar(self, path: str, key: str) -> bool:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if raw.get("key") != key:
+            return False
+        self.sections = {k: {int(n): tuple(span) for n, span in raw["sections"][k].items()}
+                         for k in SECTION_KINDS.values()}
+        self.days = {int(n): (tuple(general), {int(d): tuple(span) for d, span in spans.items()})
+                     for n, (general, spans) in raw["days"].items()}
+        self._hash_sections()
+        return True
+
+    def _write_sidecar(self, path: str, key: str):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "sections": self.sections, "days": self.days}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[WARN] index sidecar not written: {e}")
+
+    def _decode(self, kind: str, n: int) -> str:
+        span = self.sections.get(kind, {}).get(n)
+        if span is None or self._mm is None:
+            return ""
+        return _clean_block(self._mm[span[0]:span[1]])
+
+    def own_block(self, kind: str, n: int) -> str:
+        """Текст блока до ближайшего заголовка любого вида.
+        Блок тянется до следующего заголовка своего вида, поэтому последние блоки
+        перекрывают разделы других видов — для поиска и Vollanalyse это отрезаем."""
+        span = self.sections.get(kind, {}).get(n)
+        if span is None or self._mm is None:
+            return ""
+        start, end = span
+        nxt = min((s for spans in self.sections.values() for s, _ in spans.values() if start < s < end), default=end)
+        return _clean_block(self._mm[start:nxt])
+
+    def _prose(self, kind: str, n: int) -> str:
+        """
+        own_block без колонтитулов вёрстки: строки-номера страниц и шапка раздела
+        (строка заглавными прямо перед заголовком, повторяется на каждой странице)
+        выбрасываются; другая строка заглавными — начало следующей главы, на ней
+        текст заканчивается.
+        """
+        text = self.own_block(kind, n)
+        if not text:
+            return ""
+        start = self.sections[kind][n][0]
+        before = self._mm[max(0, start - 512):start].decode("utf-8", errors="ignore").split("\n")
+        lines = [l.strip() for l in before if l.strip()]
+        header = lines[-2] if len(lines) > 1 and lines[-2].isupper() else None
+        out = []
+        for line in text.split("\n"):
+            bare = line.strip()
+            if bare.isdigit() or bare == header:
+                continue
+            if bare.isupper() and len(bare) > 3:
+                break
+            out.append(line)
+        return re.sub(r'\n{3,}', '\n\n', "\n".join(out)).strip()
+
+    def geistes_days(self, n: int) -> Tuple[str, Dict[int, str]]:
+        """(общая_часть, {день: текст}) для блока Geisteszahl n — как split_geistes_block_by_days.
+        Режем prose, а не block: последний блок иначе тянется через главы Handlungs-/Verwirklichungs-/
+        Ergebniszahl, а номера страниц в них приняли бы за подзаголовки дней."""
+        if n not in self.days:
+            return "", {}
+        block = self.prose("geistes", n)
+        (gs, ge), spans = self.days[n]
+        return block[gs:ge].strip(), {day: block[s:e].strip() for day, (s, e) in spans.items()}
+
+class _SectionView(Mapping):
+    """Словарь {номер: текст} поверх Corpus — для старого кода вида GEISTES_FULL.get(n)."""
+
+    def __init__(self, corpus: Corpus, kind: str):
+        self._corpus, self._kind = corpus, kind
+
+    def __getitem__(self, n: int) -> str:
+        if n not in self._corpus.sections[self._kind]:
+            raise KeyError(n)
+        return self._corpus.block(self._kind, n)
+
+    def __iter__(self):
+        return iter(self._corpus.sections[self._kind])
+
+    def __len__(self) -> int:
+        return len(self._corpus.sections[self._kind])
+
+# Разделы из книги. Файлы книг правят на ходу (corpus_watch) — тогда и стартовые экземпляры
+# работают с приватной копией: запись в K2_PATH на месте не должна менять (или обрезать) mmap.
+CORPUS_SNAPSHOT = CORPUS_WATCH_SEC > 0
+CORPUS         = Corpus(_corpus_path(), snapshot=CORPUS_SNAPSHOT)
+GEISTES_FULL   = _SectionView(CORPUS, "geistes")
+HANDLUNGS_FULL = _SectionView(CORPUS, "handlungs")
+VERWIRK_FULL   = _SectionView(CORPUS, "verwirk")
+ERGEBNIS_FULL  = _SectionView(CORPUS, "ergebnis")
+PARTNER_FULL   = _SectionView(CORPUS, "partner")
 
 def get_geistes(n: int) -> str:   return (GEISTES_FULL.get(n) or "").strip()
 def get_handlungs(n: int) -> str: return (HANDLUNGS_FULL.get(n) or "").strip()
@@ -69,174 +281,323 @@ def get_verwirk(n: int) -> str:   return (VERWIRK_FULL.get(n) or "").strip()
 def get_ergebnis(n: int) -> str:  return (ERGEBNIS_FULL.get(n) or "").strip()
 def get_partner(n: int) -> str:   return (PARTNER_FULL.get(n) or "").strip()
 
-# Короткие аннотации по Geisteszahl (1–9)
-GEISTES_TXT: Dict[int, str] = {
-    1: "(1., 10., 19., 28.) — Führung, starker Wille, Initiative.",
-    2: "(2., 11., 20., 29.) — Harmonie, Diplomatie, empathisches Verstehen.",
-    3: "(3., 12., 21., 30.) — Wissen, Ausdruck, Kreativität.",
-    4: "(4., 13., 22., 31.) — Struktur, Ordnung, Ausdauer.",
-    5: "(5., 14., 23.) — Bewegung, Kommunikation, Chancen.",
-    6: "(6., 15., 24.) — Liebe, Fürsorge, Verantwortung.",
-    7: "(7., 16., 25.) — Weisheit, Wahrheit, Disziplin.",
-    8: "(8., 17., 26.) — Management, Erfolg, Gerechtigkeit.",
-    9: "(9., 18., 27.) — Dienst, Mitgefühl, Vollendung.",
-}
-
-# Доп. информация (планеты + подходящие сферы)
-PLANET_INFO: Dict[int, str] = {
-    1: "🌞 Planet: Sonne. 💼 Passend: Führung, Unternehmertum, Strategie, Sales.",
-    2: "🌙 Planet: Mond. 🤝 Passend: Diplomatie, HR, Coaching, Partnerschaften.",
-    3: "🪐 Planet: Jupiter. 📚 Passend: Lehre, Schreiben, Medien, Reisen.",
-    4: "🪨 Planet: Rahu/Saturn-Aspekt. 🧩 Passend: Bau/IT/Engineering, Admin, Qualität.",
-    5: "☿ Planet: Merkur. 🔗 Passend: Marketing, Handel, PR, Vertrieb, Netzwerke.",
-    6: "♀️ Planet: Venus. 👜 Passend: Design, Beauty, Pflege/Medizin, People-Management.",
-    7: "🔱 Planet: Ketu/Saturn-Aspekt. 🧪 Passend: Forschung, Analyse, Sport, Security.",
-    8: "♄ Planet: Saturn. 🏛️ Passend: Management, Finanzen, Recht, Behörden.",
-    9: "♂ Planet: Mars. 🎯 Passend: Service/NGO, Militär/Polizei, Sport, Beratung.",
-}
-
-# Tagesenergie 1–9
-TAG_TXT = {
-    1: "Neuer Zyklus, klare Entscheidungen, erste Schritte.",
-    2: "Dialog, Ausgleich, Partnerschaft, ehrliche Gespräche.",
-    3: "Kommunikation, Lernen, Reisen, inspirierender Austausch.",
-    4: "Struktur, Planung, praktische Arbeit, Ordnung schaffen.",
-    5: "Chancen, Bewegung, Netzwerke, flexible Lösungen.",
-    6: "Harmonie, Familie, Schönheit, reife Verantwortung.",
-    7: "Analyse, Spiritualität, Hygiene des Geistes.",
-    8: "Management, Finanzen, Ergebnisse, Leistung.",
-    9: "Abschluss, Dienst, Großzügigkeit, Raum für Neues.",
-}
-
-# Краткие описания для Kollektivenergie
-KOLLEKTIV_TXT = {
-    1: "Initiativen, starke Persönlichkeiten, Führung. Vision bündeln, Rollen klären.",
-    2: "Verbindend, ausgleichend, Wir-Gefühl. Verantwortung verankern, ehrlich sprechen.",
-    3: "Austausch, Ideen, Lernen. Prioritäten & Prozesse halten Fokus.",
-    4: "Strukturiert, ausdauernd, stabil. Innovation zulassen, nicht erstarren.",
-    5: "Beweglich, chancenorientiert, Netzwerke. Innerer Kompass & Ziele.",
-    6: "Sorgend, wertorientiert, ästhetisch. Faire Lasten, Balance Nähe/Freiheit.",
-    7: "Forschend, diszipliniert, tief. Ergebnisse teilen, Wissen anwenden.",
-    8: "Leistungsstark, zielorientiert, Management. Transparenz & Ethik.",
-    9: "Sinnstiftend, humanitär, abschließend. Grenzen wahren, Erholung.",
-}
-
-# Полные тексты дней рождения — ваши тексты остаются как есть
-DAY_BIRTH_TXT: Dict[int, str] = {
-    1: """Bedeutung des Geburtstages 1 Sie besitzen ein absolut reines Bewusstsein, eine junge Seele. Sie haben wenige Zweifel, aber viel Entschlossenheit, zu handeln und voranzugehen. Nutzen Sie unbedingt Ihr Führungspotential!
-Manchmal leiden Menschen, die am 1. Tag geboren sind, unter Pessimismus oder sie sind von anderen enttäuscht. Dies geschieht, weil nicht alle in ihrer Umgebung bereit sind, sich mit ihrer „führenden“ Meinung abzufinden.
-Es wird empfohlen, sich mit Psychologie zu beschäftigen und die Energie des Verstehens anderer Menschen zu entwickeln – also stets nach gegenseitigem Verständnis zu streben. Außerdem wird allen Einsen empfohlen, die Energie des Gebens und der Barmherzigkeit zu kultivieren.""",
-
-    2: """Bedeutung des Geburtstages 2 Sie sind der beste Ratgeber und Helfer in allen Angelegenheiten. Nehmen Sie aktiver an Führungsaufgaben teil, da nur Sie in der Lage sind, schwierige Situationen tief und detailliert zu durchdringen.
-Ihr Bewusstsein ist auf die ständige Suche nach Kontakten und den Aufbau vertrauensvoller Beziehungen ausgerichtet. Doch gerade der Bereich der Beziehungen ist der Punkt, an dem eine ernsthafte innere Arbeit notwendig ist.
-Im negativen Zustand können Sie unter Problemen in Beziehungen, Unentschlossenheit und ständigen Zweifeln leiden. Um Ihr Bewusstsein zu erweitern, sollten Sie mit neuen Menschen in Kontakt treten und Psychologie studieren, um die Struktur anderer Menschen richtig zu verstehen.""",
-
-    3: """Bedeutung des Geburtstages 3 Ihnen steht die Energie des Wissens zur Seite, daher kann es so wirken, als ob Sie alles selbst wissen. Sie neigen dazu, nur Fachleuten auf ihrem Gebiet zu vertrauen und hören nicht auf andere Menschen, da Sie glauben, dass diese schlechter informiert sind als Sie.
-Indem Sie sich durch die Weitergabe von Wissen verwirklichen, werden Sie noch klüger und erfolgreicher. Menschen, die an diesem Tag geboren sind, müssen ständig Neues lernen. Dazu eignen sich Kurse, Bücher, Schulen, Universitäten und andere Formen der Bildung.
-Wenn Sie genügend Wissen angesammelt haben, können Sie der beste Lehrer in Ihrem Fachgebiet werden. Eine Ihrer Aufgaben besteht darin, ein Mentor für andere Menschen zu sein und Ihr Wissen weiterzugeben – genau das macht Sie zu einem erfolgreichen Menschen.
-Darüber hinaus können Sie sich auch in Bereichen verwirklichen, die mit dem Umgang und der Verwaltung von Geldmitteln verbunden sind (Buchhalter, Analyst, Schatzmeister) sowie im Bereich des Reisens.""",
-
-    4: """Bedeutung des Geburtstages 4 Ihre Energie besteht aus maximaler Kreativität und dem Streben nach Gerechtigkeit. Lernen Sie, sich zu erden, und treiben Sie unbedingt Sport, damit die Energie in Ihren Körper gelangt.
-Ihr Bewusstsein schwebt oft in Träumen und Fantasien, und es muss wieder auf die Erde, in den Körper, zurückgeführt werden.
-Oft leben Menschen, die an diesem Datum geboren sind, in einem Zustand eines „unausgeglichenen Mechanismus“ (wie auch andere „Vieren“). Aus diesem Zustand können Sie nur durch die Arbeit mit Ihrem Körper herauskommen.
-Sie sollten Ihre Energie durch Sport oder Yoga steigern und Ihre gesamte Aufmerksamkeit auf Kreativität richten. Wenn Sie diese Empfehlungen befolgen, verbessern Sie schnell alle Lebensbereiche und erreichen jene Harmonie, nach der Ihr träumerischer Geist strebt.""",
-
-    5: """Bedeutung des Geburtstages 5 Sie haben eine feine Wahrnehmung dieser Welt, was Sie angemessener handeln lässt als andere. Dies kann bei Ihnen zu zahlreichen Verletzungen und emotionaler Verspanntheit führen, was Ihren physischen Körper schädigen kann. Die Hauptaufgabe besteht darin, Verständnis zu entwickeln und die effektivste Kommunikation mit Ihren Partnern aufzubauen.
-In einem positiven Geisteszustand erfüllen Sie eine wichtige Aufgabe: Sie sind das Bindeglied zwischen verschiedenen Menschen. Deshalb haben Sie große Erfolge im Business, Marketing und in allen anderen Bereichen, die mit Kommunikation und Expansion zu tun haben. Ihre Energie strebt danach, alles um Sie herum zu erweitern und zu verbreiten, manchmal führt dies jedoch zu negativen Konsequenzen. Diese können sich in der Veränderlichkeit und Leichtfertigkeit zeigen, zu der die Energie der Zahl 5 neigt. Es ist wichtig, zu lernen, Ihre Aufmerksamkeit über längere Zeit auf ein Projekt oder eine Person zu konzentrieren, bis Ihre Arbeit echte Früchte trägt.""",
-
-    6: """Bedeutung des Geburtstages 6 Das Bewusstsein ist darauf ausgerichtet, maximalen Komfort zu erhalten und zu schaffen. Sie werden Glück haben, besonders wenn Sie innere Weisheit und Liebe zu den Menschen entwickeln. Sie haben eine entwickelte Verbindung zum Göttlichen, daher müssen Sie immer auf Ihr Herz hören.
-Die Hauptaufgabe für Sie ist es, zu lernen, alle Ihre Angelegenheiten zu Ende zu bringen. Die Energie der Zahl 6 ist sehr weise, strebt aber gleichzeitig nach Genuss. Deshalb erreichen viele Projekte und Aufgaben die Phase des Abschlusses nicht. Sie müssen Ihre Disziplin und Willenskraft entwickeln, denn jedes abgeschlossene Projekt macht Sie stärker. In diesem Fall werden Sie immer von Glück und Erfolg begleitet.""",
-
-    7: """Bedeutung des Geburtstages 7 Wahrscheinlich lieben Sie Sport seit Ihrer Kindheit und besitzen eine große Energie-Reserve. Es ist sehr wichtig für Sie, zu lernen, sich Ziele zu setzen, denn diese Energie sollte für deren Erreichung aufgewendet werden, nicht für die Schaffung von Chaos in Ihrem Leben.
-Sie müssen Führungsqualitäten entwickeln und unabhängig handeln, indem Sie Ihre einzigartigen Talente zeigen. Tatsache ist, dass Menschen mit der Geisteszahl 7 eine einzigartige Sicht auf die Welt haben und geniale Dinge erschaffen können, aber oft von Zweifeln und Unentschlossenheit geplagt werden. Um alle Zweifel zu zerstreuen, ist es notwendig, Zeit für Sport und Konzentration des Geistes durch Meditation aufzuwenden.""",
-
-    8: """Bedeutung des Geburtstages 8 Sie haben die produktivste Energie, die Sie ständig zur Arbeit motiviert. Sie müssen lernen, sich richtig auszuruhen und sich Ziele zu setzen, damit Ihre Arbeit auf Ergebnisse ausgerichtet ist. Ihr Streben, alles an sich zu reißen, kann Sie zu Gesetzesverstößen führen, daher lenken Sie Ihre Energie auf das Schaffen, nicht auf das Zerstören.
-Geborene am 8. geboren sind, kommen ins Leben anderer Menschen, um deren Karma zu verändern. Deshalb durchlaufen sie in der ersten Hälfte ihres Lebens schwierige Prüfungen. Die gewonnene Erfahrung wird es Ihnen in Zukunft ermöglichen, die materielle Welt zu kontrollieren und andere Menschen zu lenken (durch sanfte Transformation oder durch Krisen). Für Sie ist es sehr wichtig, zu lernen, in Partnerschaft zu arbeiten und Ihre Aufgaben an andere Menschen zu delegieren, denn dadurch erweitern sich Ihre Ressourcen.""",
-
-    9: """Bedeutung des Geburtstages 9 Ihre Hilfe kennt keine Grenzen, aber Sie müssen lernen, diese Grenzen zu setzen, um in Zukunft nicht auf Menschen beleidigt zu sein, weil man Sie unterschätzt hat. Lernen Sie, alle Kooperationsbedingungen "an Land" zu besprechen, weil andere Menschen nicht immer in der Lage sind, Ihre Arbeit angemessen zu würdigen.
-Es ist sehr wichtig für Sie, ständig Neues zu lernen, weil Lernen Sie immer zum Erfolg führt und Ihre Energie beruhigt. Auch wird Ihnen empfohlen, sich mit Kreativität zu beschäftigen, damit Sie Ihre starke psychische Energie ausdrücken können. Wenn diese Energie keinen Ausdruck findet, können bei Ihnen innere Spannungen oder seelische Schwierigkeiten entstehen. Für Männer, die am 9. geboren sind, wird empfohlen, Sport zu treiben, insbesondere Kampfkunst, weil Sie mit der Energie des Mars im Bewusstsein geboren wurden.""",
-
-    10: """Bedeutung des Geburtstages 10 Von Geburt an befindet sich in Ihrer Psyche ein Zustand der Unzufriedenheit mit sich selbst und mit Ihrer Umgebung. Sie müssen unbedingt an Ihrer Einstellung zum Leben arbeiten und eine positive Denkweise entwickeln. In diesem Fall werden Sie außergewöhnliche Ergebnisse erzielen und Ihre volle Verwirklichung erreichen!
-Menschen, die am 10. Tag geboren sind, gelten als die energiereichsten Führungspersönlichkeiten. Nicht alle in ihrer Umgebung können ein so hohes Energieniveau richtig wahrnehmen – oft sind Sie viel zielstrebiger als andere, sind aber zugleich stärker von der Energie der Abwertung betroffen. Das bedeutet, dass Sie zwar schnell neue Projekte beginnen können, diese jedoch häufig nicht bis zum Ende durchziehen. Sie müssen unbedingt lernen, alle Ihre Vorhaben zu Ende zu bringen, um Ihr eigenes Ergebnis nicht zu entwerten.""",
-
-    11: """Bedeutung des Geburtstages 11 Obwohl Sie ein guter Ratgeber und Helfer sind, sind Ihre Führungsqualitäten sehr stark ausgeprägt. Sie müssen ein Gleichgewicht finden zwischen dem Wunsch zu helfen und dem Drang, Ihre eigene Meinung durchzusetzen.
-Im positiven Zustand können Sie in sich die Eigenschaften eines Führers und eines verständnisvollen Diplomaten vereinen. Das bedeutet, dass Sie in der Lage sind, große Gruppen von Menschen zu einen – und das hilft Ihnen, schneller zum Erfolg zu gelangen.
-Doch oft leiden Menschen mit zwei Einsen unter dem Wunsch, Beziehungen aufzubauen, und der Unfähigkeit, dies zu verwirklichen, da ihr Bewusstsein zur Einsamkeit neigt. Lernen Sie, andere Menschen zu beschützen und zu unterstützen, indem Sie Ihre Initiative einsetzen.""",
-
-    12: """Bedeutung des Geburtstages 12 Sie teilen die Welt in Dumme und Kluge ein und sind überzeugt, dass Sie viel mehr wissen als andere. Das hindert Sie daran, andere Menschen zu verstehen, was zu Konflikten und Streitigkeiten führt.
-Befindet sich Ihr Bewusstsein im Positiven, können Sie ein hervorragender Manager werden, der durch Verständnis handelt.
-Für Menschen, die am 12. Tag geboren sind, erweist sich dies oft als zu schmerzhaft und „krisenhaft“, was ihre Kommunikation mit anderen Menschen erschwert. Sie müssen Ihre Fähigkeiten zur Empathie und zum Verständnis anderer entwickeln, um nicht ins Negative abzurutschen.
-Sie sollen ein Leitstern für andere Menschen werden, dabei aber ein einfühlsamer und verständnisvoller Freund für alle bleiben. Das ist möglich durch die Analyse Ihrer eigenen Absichten und die Entwicklung von Kommunikationsfähigkeiten, wobei Ihr Bewusstsein stets auf Hilfe und Dienst am Menschen ausgerichtet sein sollte.""",
-
-    13: """Bedeutung des Geburtstages 13 Ihr häufigster Satz lautet: „Ich weiß!“ Sie wollen andere Menschen nicht anhören oder verstehen, weil Sie sich für den Klügsten halten. Gleichzeitig kann Ihr Bewusstsein unter ständiger Unzufriedenheit mit sich selbst und anderen Menschen leiden.
-Entwickeln Sie Ihr Verständnis: Hören Sie anderen Menschen mehr zu und beraten Sie sich mit ihnen in wichtigen Fragen. Bemühen Sie sich, keine kritischen Urteile über andere zu fällen, bevor Sie die Situation vollständig verstanden haben.
-Sie müssen lernen, Liebe und Fürsorge gegenüber anderen Menschen zu zeigen. Selbst wenn es Ihnen so vorkommt, dass Ihr Herz enttäuscht ist und andere Menschen Ihrer Liebe nicht würdig sind, werden Sie wahres Glück erfahren, wenn Sie in die positive Phase der Kreativität und der Liebe übergehen.""",
-
-    14: """Bedeutung des Geburtstages 14 Sie sind ein autonomer Mensch, der in der Lage ist, selbst Initiative zu ergreifen und Neues zu schaffen und das eigene Produkt zu erweitern. Sie sind ein sehr effektiver Mensch, solange Sie nicht anfangen, sich über andere Menschen zu ärgern. Wir empfehlen Ihnen, aus dem Zustand der emotionalen Zerstörung herauszukommen, indem Sie positives Denken entwickeln.
-Für Sie ist es wichtig, Anerkennung für Ihre Bemühungen zu erhalten und ständig positive Bestätigung für Ihre Handlungen zu finden. Am besten verwirklichen Sie sich in kreativen Bereichen. Um Ihren mentalen Zustand zu verbessern, wird Ihnen empfohlen, viel Zeit für Sport und körperliche Disziplin aufzuwenden, da diese Praktiken Ihren Geist schnell in einen Zustand der Genialität und Inspiration versetzen. Wenn Sie Ihrem Körper keine Aufmerksamkeit schenken, werden Sie häufiger auf Trübsinn, Enttäuschungen und emotionale Zusammenbrüche in Ihrem Leben stoßen.""",
-
-    15: """Bedeutung des Geburtstages 15 Sie erreichen Ihre Ziele durch Initiative und Kommunikation. Sie können sehr hohe Ergebnisse im Business erzielen, indem Sie Ihre Weisheit nutzen und Angemessenheit. Ihre Schwäche ist die Neigung zu Verletzungen und übermäßigem Egoismus. Entwickeln Sie Verständnis für andere Menschen und bauen Sie effektive Kommunikation auf.
-Sie können ein hervorragender Manager und Unternehmer werden, weil Sie in der Lage sind, mit verschiedenen Menschen eine gemeinsame Basis zu finden. Gleichzeitig besitzen Sie ein hohes Maß an Initiative. Probleme können entstehen, wenn Sie sich von augenblicklichen Begierden leiten lassen. Die Energie der Geisteszahl 6 prüft Sie ständig auf Ihre Beständigkeit gegenüber Versuchungen, daher müssen Sie in Reinheit bleiben, um Ihren Erfolg zu bewahren.""",
-
-    16: """Bedeutung des Geburtstages 16 Die wichtigste Aufgabe für Sie ist es, zu lernen, Ihre Angelegenheiten durch Disziplin zu kontrollieren und nicht in die ständige Suche nach Vergnügungen abzugleiten. Das Leben wird Ihnen Liebe, Geld und Wohlstand schenken, wenn Sie alle Ihre Angelegenheiten in Ordnung bringen und lernen, Ihre Zeit zu kontrollieren.
-Geborene am 16. geboren sind, wird die Energie ihres Bewusstseins immer durch Versuchungen und schädliche Neigungen prüfen. Jede Askese stärkt Sie, aber Sie müssen Willenskraft und Unverwundbarkeit gegenüber Ihren eigenen Wünschen entwickeln. Auch ist es sehr wichtig für Sie, zu lernen, jeden Ihrer Tage zu planen, langfristige Ziele zu setzen und alle Ihre Angelegenheiten zu Ende zu bringen. Dies wird Ihre Persönlichkeit stärker und größer machen.""",
-
-    17: """Bedeutung des Geburtstages 17 Der beste Weg zur Verwirklichung für Sie ist die Bühne oder das Showbusiness. Sie sind in der Lage, sehr viel zu arbeiten, und dabei sucht Ihr Ego nach Anerkennung. Je tiefer Sie in den Prozess eintauchen, desto mehr Ruhm, Geld und Möglichkeiten werden Sie täglich erhalten.
-Regelmäßiger Sport und die richtige Zielsetzung machen Sie stärker. Ihre chaotische Energie konzentriert sich, wodurch Sie Ergebnisse schneller erreichen. Hüten Sie sich vor extremem Verhalten (schnelles Fahren, Bewusstseinsveränderung), denn Ihre starke Energie kann Krisen in Ihrem Leben verursachen. Es ist wichtig, das Thema Beziehungen und Partnerschaft zu bearbeiten, denn Ihre Energie verwirklicht sich in der gemeinsamen Arbeit mit anderen Menschen.""",
-
-    18: """Bedeutung des Geburtstages 18 Obwohl Sie ein sehr fleißiger Mensch sind (und oft ein Einzelgänger), müssen Sie lernen, sich Ziele zu setzen und Energie durch Sport zu generieren, damit all Ihre Handlungen sinnvoll sind und Sie zum Ergebnis führen. Nutzen Sie Ihre hohe Arbeitsfähigkeit mit Verstand und beschäftigen Sie sich nicht mit überflüssigen Dingen.
-Als ausgezeichneter Helfer und sehr produktiver Mensch streben Sie danach, alles selbst zu machen. Ihre wahre Aufgabe ist es, zu lernen, durch Partnerschaft zu arbeiten und überhaupt das Thema Beziehungen in Ihrem Leben zu bearbeiten. Nur durch Beziehungen und Teamarbeit wachsen Sie wirklich und erreichen hohe Ergebnisse.""",
-
-    19: """Bedeutung des Geburtstages 19 Sie sind ein feuriger Führer. In Ihrem Bewusstsein sind die stärksten Führungsqualitäten ausgeprägt. Sie sind fähig, Unglaubliches zu erschaffen, haben jedoch auch eine Neigung zur Zerstörung. Es ist für Sie unbedingt notwendig, sich durch Hilfe für andere zu verwirklichen und Ihr Ziel unbeirrt zu verfolgen.
-Um aus einem Zustand der Streitlust herauszukommen, wird Ihnen empfohlen, sich ständig mit neuen Dingen zu beschäftigen. Lernen macht Ihre Energie harmonischer und nimmt Ihnen jene Naivität, die durch die Energie der Zahl 9 entsteht.
-Zugleich streben Sie ständig danach, anderen Menschen zu dienen und ihnen Hilfe zu leisten, geraten dadurch jedoch selbst oft in problematische Situationen. Sie sollten Ihre Führungsenergie richtig einsetzen – immer durch kühlen Kopf, Analyse.""",
-
-    20: """Bedeutung des Geburtstages 20 Nicht selten wird Ihnen ein „zerstörerischer Heiratscode“ zugeschrieben. Möglicherweise hatten Sie bereits mehrere Scheidungen.
-Ihr Bewusstsein driftet sehr oft ins Negative ab, wenn Sie aufhören, Ihren Partner, eine Situation oder einen Arbeitsprozess zu verstehen. Sie müssen unbedingt ein positives Denken entwickeln und in jeder Situation nur die positiven Seiten sehen.
-Im positiven Zustand können Sie ein sehr energiereicher Mensch mit offenem Herzen sein. In diesem Fall sind Sie bereit, an Ihren Beziehungen zu arbeiten und mehr Kraft in deren Stärkung zu investieren.
-Wenn Sie Ihre Kommunikationsfähigkeiten entwickeln und lernen, die Prozesse, mit denen Sie sich beschäftigen, im Detail zu verstehen, werden Sie zum besten Umsetzer. Gleichzeitig ist es für Sie wichtig, sich in jeder Aufgabe in Partnerschaft mit anderen Menschen weiterzuentwickeln.""",
-
-    21: """Bedeutung des Geburtstages 21 Obwohl Sie ein Mensch des Wissens sind, neigen Sie dazu, Ihre Fähigkeiten und Möglichkeiten zu unterschätzen und die Verantwortung auf andere Menschen – auf Mentoren – zu übertragen. Gleichzeitig haben Sie ein inneres Verständnis davon, was Sie erreichen möchten, handeln jedoch über andere, indem Sie diese durch Ihr Wissen beeinflussen.
-Entwickeln Sie Zielstrebigkeit und lernen Sie, Verantwortung selbst zu übernehmen – unter Berücksichtigung Ihres Wissens über die Welt.
-Sie sind ein einfühlsamer und sanfter Mensch, für den das Thema Beziehungen von großer Bedeutung ist. Wenn Ihre Beziehungen in Ordnung sind, fühlen auch Sie sich wohl. Sie sind ausdauernder und lernfähiger, was ebenfalls ein wichtiger Wachstumspunkt für Sie ist.
-Durch Ihre sanfte und gütige Energie sind Sie in der Lage, Menschen richtig anzuleiten und ihnen mit Ihrem Wissen zu helfen.""",
-
-    22: """Bedeutung des Geburtstages 22 Ihr Bewusstsein strebt ständig danach, Neues zu erschaffen, doch Sie führen begonnene Aufgaben oft nicht zu Ende. Sie neigen dazu, Verantwortung auf andere Menschen abzuwälzen.
-Ihre optimale Verwirklichung liegt in Beziehungen. Wenn Sie Ihren Partner vollständig verstehen, können Sie ein hervorragender Helfer und Diplomat sein – vorausgesetzt, Sie verlassen den negativen Geisteszustand.
-Oft werden Menschen mit diesem Geburtsdatum zu den besten Psychologen und Unterstützern in schwierigen Angelegenheiten. Ihre fleißige Energie ist in der Lage, die kreativsten Lösungen zu finden, insbesondere in Bereichen, die mit Beziehungen zu tun haben.""",
+# -------------------------- Полнотекстовый поиск (/suche) -------------------
+# Инвертированный индекс по абзацам разделов книги, ранжирование BM25. Абзац хранится
+# как смещения внутри блока Corpus (сам текст не копируем), блоки Geisteszahl (по prose) дополнительно
+# размечены по дням. Нормализация: нижний регистр, ä/ö/ü → a/o/u, ß → ss (как в
+# normalize_latin), стоп-слова и простое отсечение окончаний.
+SECTION_TITLES = {"geistes": "Geisteszahl", "handlungs": "Handlungszahl", "verwirk": "Verwirklichungszahl",
+                  "ergebnis": "Ergebniszahl", "partner": "Gemeinsame Geisteszahl"}
+WORD_RE      = re.compile(r"[A-Za-zÄÖÜäöüß]+")
+PARAGRAPH_RE = re.compile(r"(?:[^\n]|\n(?![ \t]*\n))+")
+_FOLD        = str.maketrans({"ä": "a", "ö": "o", "ü": "u", "ß": "ss"})
+_SUFFIXES    = ("ungen", "lichen", "liche", "lich", "heit", "keit", "isch", "ung", "en", "er", "es", "em", "e", "n", "s")
+STOPWORDS = frozenset(
+    "der die das den dem des ein eine einer eines einem einen und oder aber nicht kein keine ist sind war "
+    "wird werden sein seine ihr ihre ihren sie er es wir ich du mit von zu zum zur im in am an auf aus bei "
+    "fur uber unter durch als wie auch noch nur sehr so dass wenn man sich was wer diese dieser dieses "
+    "hat haben kann konnen mehr alle oft immer welche welcher welches mir mich mein meine meiner meinem "
+    "dir dich dein deine bin habe soll sollte gibt passt warum wo wann".split())
+BM25_K1, BM25_B = 1.2, 0.75
+
+@lru_cache(maxsize=8192)
+def search_term(word: str) -> str:
+    """Нормальная форма слова для индекса и запроса ('' — стоп-слово)."""
+    w = word.lower().translate(_FOLD)
+    if w in STOPWORDS or len(w) < 3:
+        return ""
+    for suf in _SUFFIXES:
+        if w.endswith(suf) and len(w) - len(suf) >= 4:
+            return w[:-len(suf)]
+    return w
+
+class SearchHit(NamedTuple):
+    score: float
+    kind: str
+    n: int
+    day: int
+    snippet: str
+
+class SearchIndex:
+    def __init__(self, corpus: Corpus):
+        self.corpus = corpus
+        self.docs: List[Tuple[str, int, int, int, int]] = []  # (вид, номер, день|0, start, end)
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}  # термин → [(doc, tf)]
+        t0 = time.perf_counter()
+        self._build()
+        self.build_ms = 1000 * (time.perf_counter() - t0)
+        self.memory_kb = self._memory() // 1024
+        self.avgdl = sum(self.lengths) / max(1, len(self.lengths))
+        print(f"[INFO] search index: {len(self.docs)} Absätze, {len(self.postings)} Terme, "
+              f"{self.build_ms:.1f} ms, ~{self.memory_kb} KB")
+
+    def _memory(self) -> int:
+        """Оценка памяти индекса (байты): списки, кортежи, строки терминов."""
+        size = sys.getsizeof(self.docs) + sys.getsizeof(self.lengths) + sys.getsizeof(self.postings)
+        size += sum(sys.getsizeof(d) for d in self.docs[:1]) * len(self.docs)
+        for term, plist in self.postings.items():
+            size += sys.getsizeof(term) + sys.getsizeof(plist) + 64 * len(plist)  # кортеж (doc, tf)
+        return size
+
+    def text(self, kind: str, n: int) -> str:
+        """Текст, в котором лежат смещения абзацев: у Geisteszahl — prose (по нему размечены дни),
+        у остальных — блок целиком (до own_block)."""
+        return self.corpus.prose(kind, n) if kind == "geistes" else self.corpus.block(kind, n)
+
+    def _regions(self, kind: str, n: int):
+        limit = len(self.corpus.prose(kind, n) if kind == "geistes" else self.corpus.own_block(kind, n))
+        if kind == "geistes" and n in self.corpus.days:
+            (gs, ge), spans = self.corpus.days[n]
+            yield 0, gs, min(ge, limit)
+            for day, (s, e) in spans.items():
+                if s < limit:
+                    yield day, s, min(e, limit)
+        else:
+            yield 0, 0, limit
+
+    def _build(self):
+        for kind in SECTION_TITLES:
+            for n in sorted(self.corpus.sections[kind]):
+                block = self.text(kind, n)
+                for day, rs, re_ in self._regions(kind, n):
+                    for m in PARAGRAPH_RE.finditer(block, rs, re_):
+                        tf: Dict[str, int] = {}
+                        for w in WORD_RE.findall(m.group()):
+                            t = search_term(w)
+                            if t:
+                                tf[t] = tf.get(t, 0) + 1
+                        if len(tf) < 3:
+                            continue  # заголовки и номера дней
+                        doc = len(self.docs)
+                        self.docs.append((kind, n, day, m.start(), m.end()))
+                        self.lengths.append(sum(tf.values()))
+                        for t, c in tf.items():
+                            self.postings.setdefault(t, []).append((doc, c))
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[float, int]]:
+        """[(score, doc)] по убыванию BM25."""
+        terms = {t for t in map(search_term, WORD_RE.findall(query)) if t}
+        scores: Dict[int, float] = {}
+        total = len(self.docs)
+        for t in terms:
+            plist = self.postings.get(t)
+            if not plist:
+                continue
+            idf = math.log(1 + (total - len(plist) + 0.5) / (len(plist) + 0.5))
+            for doc, tf in plist:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / self.avgdl)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, ((sc, doc) for doc, sc in scores.items()))
+
+    def snippet(self, doc: int, query: str, width: int = 220) -> str:
+        """Фрагмент абзаца вокруг первого совпадения, совпадения — в <b>."""
+        kind, n, _, start, end = self.docs[doc]
+        text = self.text(kind, n)[start:end]
+        terms = {t for t in map(search_term, WORD_RE.findall(query)) if t}
+        hits = [m.span() for m in WORD_RE.finditer(text) if search_term(m.group()) in terms]
+        first = hits[0][0] if hits else 0
+        lo = max(0, first - width // 3)
+        if lo:
+            lo = text.find(" ", lo) + 1 or lo
+        hi = min(len(text), lo + width)
+        if hi < len(text):
+            hi = text.rfind(" ", lo, hi) if text.rfind(" ", lo, hi) > lo else hi
+        out, pos = [], lo
+        for s, e in hits:
+            if s < lo or e > hi:
+                continue
+            out.append(html_escape(text[pos:s]) + "<b>" + html_escape(text[s:e]) + "</b>")
+            pos = e
+        out.append(html_escape(text[pos:hi]))
+        body = " ".join("".join(out).split())
+        return ("… " if lo else "") + body + (" …" if hi < len(text) else "")
+
+    def query(self, query: str, limit: int = 5) -> List[SearchHit]:
+        return [SearchHit(score, *self.docs[doc][:3], self.snippet(doc, query))
+                for score, doc in self.search(query, limit)]
+
+def section_ref(kind: str, n: int, day: int = 0) -> str:
+    return f"{SECTION_TITLES[kind]} {n}" + (f", Tag {day}" if day else "")
+
+def corpus_gaps(corpus: Corpus) -> List[str]:
+    """Числа 1–9 без своего раздела в книге (Vollanalyse покажет для них текст no_section).
+    Не ошибка загрузки: в KeytoFate_arbeiten.txt, например, нет Verwirklichungszahl 9."""
+    gaps = []
+    for kind in ("geistes", "handlungs", "verwirk", "ergebnis"):
+        missing = sorted(set(range(1, 10)) - set(corpus.sections[kind]))
+        if missing:
+            gaps.append(f"{SECTION_TITLES[kind]} ohne Abschnitt: {missing}")
+    return gaps
+
+SEARCH = SearchIndex(CORPUS)
+for _gap in corpus_gaps(CORPUS):
+    print(f"[WARN] corpus: {_gap}")
+
+# ============================ Языковые пакеты ================================
+# Короткие таблицы (Geisteszahl, Planeten, Tagesenergie, Kollektiv, Namensenergie,
+# Entwicklungspfad), тексты дней рождения, подписи, меню и подсказки лежат в locales/<lang>.json. При
+# первом обращении к языку JSON компилируется в marshal-файл (<lang>.pack в LOCALES_PACK_DIR,
+# ключ — mtime и размер JSON), дальше грузится он. На старте читается только список файлов,
+# в памяти — лишь пакеты языков, о которых уже спрашивали. Язык — по language_code. Пакет может
+# быть неполным: недостающие таблицы, подписи и книга (K2_PATH — на DEFAULT_LANG) берутся из
+# DEFAULT_LANG по отдельности — меню и подсказки переведены, проза книги остаётся на DEFAULT_LANG.
+LOCALES_DIR  = os.getenv("LOCALES_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales")
+LOCALES_PACK_DIR = os.getenv("LOCALES_PACK_DIR") or LOCALES_DIR
+DEFAULT_LANG = os.getenv("DEFAULT_LANG", "de").strip().lower()
+PACK_FORMAT  = 1
+
+def _compile_pack(path: str) -> dict:
+    """JSON пакета → dict для marshal: ключи таблиц — int, проверка типов."""
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    tables = {name: {int(k): str(v) for k, v in table.items()} for name, table in raw.get("tables", {}).items()}
+    text = {str(k): str(v) for k, v in raw.get("text", {}).items()}
+    return {"name": str(raw.get("name", "")), "book": raw.get("book") or None, "tables": tables, "text": text}
+
+class LocalePack:
+    """Таблицы одного языка, только для чтения; общий объект для всех запросов."""
+    __slots__ = ("lang", "name", "stamp", "tables", "text", "book", "missing", "_corpus")
+
+    def __init__(self, lang: str, raw: dict, stamp: tuple, fallback: "LocalePack | None" = None):
+        self.lang, self.name, self.stamp = lang, raw["name"] or lang, stamp
+        base_tables = fallback.tables if fallback else {}
+        base_text = fallback.text if fallback else {}
+        self.tables = MappingProxyType({
+            name: MappingProxyType({**base_tables.get(name, {}), **raw["tables"].get(name, {})})
+            for name in set(base_tables) | set(raw["tables"])})
+        self.text = MappingProxyType({**base_text, **raw["text"]})
+        self.book = raw["book"] or (fallback.book if fallback else None)
+        # чего не хватает до полного пакета (у DEFAULT_LANG — ничего)
+        self.missing: Tuple[str, ...] = () if fallback is None else tuple(
+            [name for name, table in fallback.tables.items() if table.keys() - raw["tables"].get(name, {}).keys()]
+            + (["text"] if fallback.text.keys() - raw["text"].keys() else [])
+            + ([] if raw["book"] else ["book"]))
+        self._corpus = None
+
+    def t(self, key: str, **kw) -> str:
+        text = self.text[key]
+        return text.format(**kw) if kw else text
+
+    @property
+    def corpus(self) -> Corpus:
+        """Своя книга пакета (разметка разделов как в K2_PATH) или общий CORPUS."""
+        if not self.book:
+            return CORPUS
+        if self._corpus is None:
+            self._corpus = Corpus(os.path.join(LOCALES_DIR, self.book), snapshot=CORPUS_SNAPSHOT)
+        return self._corpus
+
+class Locales:
+    def __init__(self, path: str = LOCALES_DIR, default: str = DEFAULT_LANG):
+        self.path, self.default = path, default
+        self.available = self._scan()
+        self._packs: Dict[str, LocalePack] = {}
+        self._rejected: Dict[str, tuple] = {}
+        self._broken: Dict[str, tuple] = {}  # не загрузился — отдаём DEFAULT_LANG до правки файла
+        self.loads = 0
+
+    def _scan(self) -> frozenset:
+        try:
+            return frozenset(n[:-5] for n in os.listdir(self.path) if n.endswith(".json"))
+        except OSError:
+            return frozenset()
 
-    23: """Bedeutung des Geburtstages 23 Sie verwirklichen sich hervorragend im Bereich Finanzen und Management. Durch ein tiefes Verständnis von Prozessen können Sie auch wichtiges Wissen über Business und Beziehungen an andere Menschen weitergeben und so Ihre Kommunikation entwickeln. Denken Sie daran, dass Ihnen in allen Angelegenheiten Glück beschieden ist, wenn Ihr Geist positiv und diszipliniert ist.
-Indem Sie anderen Menschen Hilfe und Fürsorge entgegenbringen, verwirklichen Sie Ihre Energie optimal. Sie können der beste Mitarbeiter und Lehrer sein. Ihre Angemessenheit und kühle Berechnung helfen dabei, komplexe Aufgaben zu lösen, die einen klaren Verstand erfordern. Die Kehrseite dieser Energie ist Empfindsamkeit (aufgrund ständiger Zweifel) und List. Indem Sie Wärme und Hilfsbereitschaft gegenüber anderen Menschen zeigen, wachsen Sie als Persönlichkeit.""",
+    def _stamp(self, lang: str) -> tuple | None:
+        try:
+            st = os.stat(os.path.join(self.path, lang + ".json"))
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def pick(self, language_code: str | None) -> str:
+        code = (language_code or "").split("-")[0].lower()
+        return code if code in self.available and self[code].lang == code else self.default
+
+    def __getitem__(self, lang: str) -> LocalePack:
+        pack = self._packs.get(lang)
+        if pack is None:
+            if lang != self.default and (lang not in self.available or lang in self._broken):
+                return self[self.default]
+            try:
+                pack = self._packs[lang] = self._load(lang)
+            except (OSError, ValueError, TypeError, AttributeError) as e:
+                if lang == self.default:
+                    raise
+                print(f"[WARN] locale {lang} unusable, using {self.default}: {e}")
+                self._broken[lang] = self._stamp(lang)
+                return self[self.default]
+        return pack
+
+    def _load(self, lang: str) -> LocalePack:
+        t0 = time.perf_counter()
+        fallback = self[self.default] if lang != self.default else None
+        stamp = self._stamp(lang)
+        key = f"v{PACK_FORMAT}:{stamp}"
+        compiled = os.path.join(LOCALES_PACK_DIR, lang + ".pack")
+        raw, source = self._read_compiled(compiled, key), "pack"
+        if raw is None:
+            raw, source = _compile_pack(os.path.join(self.path, lang + ".json")), "json"
+            self._write_compiled(compiled, key, raw)
+        self.loads += 1
+        pack = LocalePack(lang, raw, stamp, fallback)
+        print(f"[INFO] locale {lang} ({source}): {sum(len(t) for t in raw['tables'].values())} Einträge, "
+              f"{1000 * (time.perf_counter() - t0):.1f} ms")
+        if pack.missing:
+            print(f"[INFO] locale {lang}: aus {self.default} ergänzt: {', '.join(pack.missing)}")
+        return pack
+
+    @staticmethod
+    def _read_compiled(path: str, key: str) -> dict | None:
+        try:
+            with open(path, "rb") as f:
+                data = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return data.get("pack") if isinstance(data, dict) and data.get("key") == key else None
+
+    @staticmethod
+    def _write_compiled(path: str, key: str, raw: dict):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                marshal.dump({"key": key, "pack": raw}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[WARN] locale pack not written: {e}")
 
-    24: """Bedeutung des Geburtstages 24 Durch ein tiefes Verständnis der Prozesse und den Drang, Neues zu schaffen, sind Sie in der Lage, ein Produkt zu erschaffen, das die Welt verändern wird. Es ist wichtig, sich nicht über andere Menschen zu ärgern, wenn Sie die Motivation ihrer Handlungen nicht verstehen können. Konzentrieren Sie sich auf Ihre Projekte und Aufgaben, die Ihnen vom Schöpfer gegeben wurden.
-Es ist wichtig, die Fähigkeit zur Planung und Zielsetzung zu entwickeln, obwohl Sie diese Fähigkeit bereits von Geburt an besitzen. Auch das Steigern der Energie durch Sport und Meditation hilft Ihnen, gute Laune zu bewahren und auftretende Probleme schnell zu lösen. Wenn in Ihrem Leben regelmäßiger Sport fehlt, wird Ihr Bewusstsein in Negativität und Zerstörung abgleiten.""",
+    def stale(self) -> List[str]:
+        """Загруженные пакеты, чей JSON изменился (кроме уже отклонённых), и новые/удалённые файлы."""
+        out = [lang for lang, pack in self._packs.items()
+               if self._stamp(lang) not in (pack.stamp, self._rejected.get(lang))]
+        out += [lang for lang, stamp in self._broken.items() if self._stamp(lang) != stamp]
+        return out + sorted(self._scan() ^ self.available)
 
-    25: """Bedeutung des Geburtstages 25 Ihre Stärken sind die Geschäftsentwicklung und Kommunikation durch das Verständnis von Menschen. Sie streben ständig danach, andere zu verstehen, und verwirklichen sich hervorragend in der Kommunikation. Täglicher Sport und die richtige Zielsetzung werden Ihnen in allen Angelegenheiten überragende Ergebnisse bringen.
-Solche Menschen können zu List und Lügen neigen, und manchmal zwingt die Energie der 7 sie, sich ohne besonderen Grund so zu verhalten. Es ist wichtig, innere Ehrlichkeit zu entwickeln und zu lernen, Verpflichtungen und Verantwortung zu übernehmen. In diesem Fall werden Sie ein genialer Führer, der andere Menschen versteht. Sie haben ausgezeichnete Verhandlungsfähigkeiten, aber es ist wichtig für Sie, Ihre Aufmerksamkeit auf das Ergebnis zu konzentrieren.""",
+    def reject(self, langs: List[str]):
+        for lang in langs:
+            self._rejected[lang] = self._stamp(lang)
 
-    26: """Bedeutung des Geburtstages 26 Obwohl Ihre Bestimmung Arbeit, Kontrolle und Ergebnis ist, sucht Ihr Ego ständig nach Genuss. Man kann sagen, dass Sie innerlich sehr reich sind, auch wenn Sie überhaupt kein Geld haben. Lernen Sie, finanzielle Ziele durch Verständnis und Streben nach Erfolg zu setzen, entwickeln Sie Disziplin des Geistes und treiben Sie Sport.
-Am 26. werden kreative Menschen mit einer reichen spirituellen Welt geboren. Manchmal erschafft diese Energie der Liebe und Weisheit Schwierigkeiten, weil Ihr Ego in allem nach Genuss sucht. Es ist notwendig, Selbstkontrolle und Disziplin zu entwickeln, damit Ihr reales Niveau Ihren hohen inneren Standards entspricht. In diesem Fall beherrschen Sie die materielle Welt, erreichen aber gleichzeitig Harmonie auf der spirituellen Ebene.""",
+    def reset(self):
+        self.available, self._packs, self._rejected, self._broken = self._scan(), {}, {}, {}
 
-    27: """Bedeutung des Geburtstages 27 Ihre Stärke ist das tiefe Verständnis anderer Menschen und die Energie in Ihren Handlungen. Dabei wollen Sie ständig Anerkennung erhalten und leiden, wenn jemand Ihre Hilfe und Ihre Qualitäten nicht angemessen gewürdigt hat. Richten Sie Ihre Energie auf die Hilfe für Menschen, entwickeln Sie in sich Aufrichtigkeit und lernen Sie, selbstständig zu handeln, ohne Verantwortung auf andere Menschen abzuwälzen.
-Geborene am 27. haben eine Leidenschaft für spirituelle Suche. Oft verneinen solche Menschen einfach die materielle Welt oder leben im Chaos, da die Energie der Zahlen 2 und 7 viele Zweifel und eine Loslösung von der realen Welt schafft. Ihre wirkliche Aufgabe ist es, sich in Partnerschaft mit anderen Menschen weiterzuentwickeln und komplexe Aufgaben zu lösen. Das ist Ihre Art, der Welt zu dienen.""",
+    def stats_line(self) -> str:
+        return f"geladen {', '.join(sorted(self._packs)) or '–'} von {len(self.available)}, Ladevorgänge {self.loads}"
 
-    28: """Bedeutung des Geburtstages 28 Ihr Bewusstsein verwirklicht sich durch ein tiefes Verständnis von Managementprozessen. Sie sind fähig, sehr viel zu arbeiten und geniale Systeme zu erschaffen, indem Sie den gesamten Prozess steuern und kontrollieren. Sie sollten sich nicht von Kränkungen oder Erwartungen anderer Menschen leiten lassen – handeln Sie selbständig. Das ist der Schlüssel zu Ihrem Erfolg!
-Menschen, die am 28. Tag geboren sind, werden oft Eigentümer großer Unternehmen (z. B. Bill Gates, Elon Musk) oder talentierte Fachkräfte in anderen Bereichen. Doch um dieses geniale Potential voll zu entfalten, ist es notwendig, die Fähigkeit zum Verständnis und Zuhören mit dem Wunsch nach Kontrolle zu verbinden.
-Durch den Aufbau großer Strukturen und Teams gelangen Menschen mit diesem Geburtsdatum zum größten Erfolg.""",
+LOCALES = Locales()
 
-    29: """Bedeutung des Geburtstages 29 Menschen, die an diesem Datum geboren sind, besitzen ein großes energetisches Potential von Mond und Mars. Sie können Ihre Bestimmung in der Hilfe für andere Menschen finden. Niemand kann diese Aufgabe besser erfüllen als Sie. Solche Menschen sind fähig, sich im spirituellen Bereich zu entwickeln und richten ihre Aufmerksamkeit auf den Dienst an der Menschheit – sofern sie sich in einem positiven Geisteszustand befinden.
-Befinden Sie sich jedoch in einer „negativen Phase“, neigen Sie zu Intrigen und geheimen Verbindungen, die zur Zerstörung führen. Diese Zerstörung wirkt sich in erster Linie negativ auf Ihr Schicksal aus. Genau deshalb sollte Ihre gesamte Aufmerksamkeit auf die Hilfe und das Verständnis für andere Menschen gerichtet sein. Darin liegt Ihre maximale Verwirklichung.""",
+def user_lang(update: Update) -> str:
+    user = update.effective_user
+    return LOCALES.pick(user.language_code if user else None)
 
-    30: """Bedeutung des Geburtstages 30 Sie sind ein "ziemlich" listiger Mensch, der das Wissen anderer Menschen zunichtemacht. Dabei können Sie selbst sehr oft dumme oder unüberlegte Handlungen begehen, die negative Reaktionen anderer Menschen hervorrufen. Sie müssen unbedingt positives Denken entwickeln und Ihr eigenes Wissen über die Welt festigen, das Ihnen die Möglichkeit gibt, Ihre Ziele sehr schnell zu erreichen.
-Oft faulenzen Menschen, die am 30. geboren sind, bei ihrer Selbstbildung und sind nicht zum Lesen von Literatur geneigt. Aber tatsächlich ist die Steigerung Ihrer Allgemeinbildung der beste Weg, um schnell Erfolg zu haben. Im Idealfall sollten Sie Spezialist in mehreren Bereichen gleichzeitig werden. Dann werden Sie den Gegenstand viel besser verstehen als andere Menschen, und Ihre stürmische Energie wird Ihnen helfen, Ziele schneller zu erreichen.""",
-
-    31: """Bedeutung des Geburtstages 31 Sie sind ein Mensch mit großem Verstand und hervorragenden Führungsqualitäten. Diese Eigenschaft kann Ihnen sehr schnell Resultate bringen, kann jedoch auch zur Ursache von Zerstörung werden. Über Sie sagt man: „Unglück durch zu viel Verstand“. Sie wissen alles, wollen jedoch andere Menschen nicht verstehen – und genau dieses Hindernis müssen Sie in sich überwinden.
-Menschen, die an diesem Tag geboren sind, haben eine globale Bestimmung, die manchmal schwer zu begreifen und zu erkennen ist. Mit Hilfe Ihres Intellekts und Ihrer Führungsqualitäten müssen Sie globale und kreative Projekte erschaffen. Doch Ihr Bewusstsein sollte dabei auf Liebe und Dienst an den Menschen ausgerichtet sein. Nur in diesem Fall können sich Ihre genialen Ideen wirklich verwirklichen und der ganzen Welt großen Nutzen bringen.""" 
-}
+def user_pack(update: Update) -> LocalePack:
+    return LOCALES[user_lang(update)]
 
 # ============================== Конфиг токена/PayPal ===============================
 load_dotenv()
 API_TOKEN = os.getenv("API_TOKEN")
+# Другой адрес Bot API (локальный telegram-bot-api или заглушка из loadtest.py)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").strip().rstrip("/")
 PAYPAL_URL = (os.getenv("PAYPAL_URL", "") or "").strip()
 if not PAYPAL_URL:
     PAYPAL_EMAIL = os.getenv("PAYPAL_EMAIL", "manzera@mail.ru").strip()
@@ -252,16 +613,31 @@ ADMIN_ID = 6480688287
 def html_escape(s: str) -> str:
     return s.replace("&","&amp;").replace("<","&lt;").replace(">","&gt;")
 
+class UserError(ValueError):
+    """Ошибка ввода, которую показываем пользователю: ключ подписи пакета (+ параметры).
+    str() — текст на DEFAULT_LANG (для логов), на языке пользователя — error_text()."""
+    def __init__(self, key: str, **kw):
+        super().__init__(LOCALES[DEFAULT_LANG].t(key, **kw))
+        self.key, self.kw = key, kw
+
+def error_text(ex: Exception, pack: "LocalePack") -> str:
+    return pack.t(ex.key, **ex.kw) if isinstance(ex, UserError) else str(ex)
+
 def parse_date(text: str) -> Tuple[int,int,int]:
     m = re.search(r'(\d{1,2})[.\s](\d{1,2})[.\s](\d{4})', text)
     if not m:
-        raise ValueError("Bitte Datum im Format TT.MM.JJJJ, z. B. 25.11.1978.")
+        raise UserError("err_date")
     d, mth, yr = int(m.group(1)), int(m.group(2)), int(m.group(3))
-    datetime(year=yr, month=mth, day=d)  # validate
+    try:
+        datetime(year=yr, month=mth, day=d)  # validate
+    except ValueError:
+        raise UserError("err_date_invalid") from None
     return d, mth, yr
 
+DATE_RE = re.compile(r'(\d{1,2})[.\s](\d{1,2})[.\s](\d{4})')
+
 def parse_dates_multi(text: str) -> List[Tuple[int,int,int]]:
-    found = re.findall(r'(\d{1,2})[.\s](\d{1,2})[.\s](\d{4})', text)
+    found = DATE_RE.findall(text)
     result = []
     for d, mth, yr in found:
         day, month, year = int(d), int(mth), int(yr)
@@ -295,274 +671,794 @@ def geldcode(day: int, month: int, year: int) -> str:
 def tagesenergie(bday_day: int, today_day: int) -> int:
     return reduzieren_1_9(sum(int(d) for d in f"{bday_day:02d}{today_day:02d}"))
 
+# ---- Пакетный расчёт (аналитика, выгрузки) ----
+# Для массивов дат всё сводится к табличным выборкам: сумма цифр года берётся из
+# _DIGIT_SUM, а готовый профиль — из таблицы [день][месяц][сумма цифр года].
+# Таблицы строятся из тех же скалярных функций, поэтому результат совпадает с ними
+# один в один (включая мастер-числа 11/22/33). Даты не валидируются.
+# Пакетный путь не собирает кортеж на дату: ключ (день, месяц, сумма цифр года) —
+# плоский индекс, а каждая колонка — отдельная выборка map(колонка.__getitem__, ключи),
+# т. е. весь цикл идёт в C.
+_DIGIT_SUM = [sum(int(c) for c in str(n)) for n in range(10000)]
+
+@lru_cache(maxsize=1)
+def _numerology_table() -> List[List[List[Tuple[int, int, int, int, str]]]]:
+    table = [[[] for _ in range(13)] for _ in range(32)]
+    for d in range(1, 32):
+        g = geisteszahl(d)
+        for m in range(1, 13):
+            row = table[d][m]
+            for ys in range(37):  # сумма цифр года 0..9999 — максимум 36
+                h = reduzieren(_DIGIT_SUM[d] + _DIGIT_SUM[m] + ys)
+                v = verwirklichungszahl(g, h)
+                d1, d2, d3 = reduzieren(d), reduzieren(m), reduzieren(ys)
+                row.append((g, h, v, ergebniszahl(g, h, v), f"{d1}{d2}{d3}{reduzieren(d1 + d2 + d3)}"))
+    return table
+
+_KEY_DAY   = [d * 13 * 37 for d in range(32)]
+_KEY_MONTH = [m * 37 for m in range(13)]
+
+@lru_cache(maxsize=1)
+def _numerology_columns() -> Tuple[tuple, tuple, tuple, tuple, tuple]:
+    """Пять колонок таблицы, плоский индекс (день·13 + месяц)·37 + сумма цифр года."""
+    table, empty = _numerology_table(), (0, 0, 0, 0, "")
+    flat = [table[d][m][ys] if d and m else empty for d in range(32) for m in range(13) for ys in range(37)]
+    return tuple(tuple(col) for col in zip(*flat))
+
+def numerology_batch(days, months, years) -> Tuple[List[int], List[int], List[int], List[int], List[str]]:
+    """
+    Geistes-, Handlungs-, Verwirklichungs-, Ergebniszahl и Geldcode для массивов дат
+    (любые последовательности одинаковой длины). Возвращает пять списков-колонок.
+    """
+    keys = list(map(add, map(add, map(_KEY_DAY.__getitem__, days), map(_KEY_MONTH.__getitem__, months)),
+                    map(_DIGIT_SUM.__getitem__, years)))
+    g, h, v, e, geld = (list(map(col.__getitem__, keys)) for col in _numerology_columns())
+    return g, h, v, e, geld
+
+# ---- Профиль даты (Matrix) ----
+# Все числа одной даты рождения считаются один раз — выборкой из той же таблицы
+# [день][месяц][сумма цифр года] — и дальше только читаются. Профили мемоизируем в
+# ограниченном LRU: различных дат 1900–2100 около 73k, объект со __slots__ занимает
+# ~100 байт, так что даже кэш на все даты — единицы МБ. Обработчики берут числа
+# только отсюда (Partnerschaft, KI, Vollanalyse, Dokument, Inline), групповые
+# выгрузки — через numerology_batch, чтобы не вытеснять кэш разовыми датами.
+MATRIX_CACHE_SIZE = int(os.getenv("MATRIX_CACHE_SIZE", "16384"))
+
+class Matrix:
+    """Geistes-, Handlungs-, Verwirklichungs-, Ergebniszahl и Geldcode одной даты.
+    Tagesenergie сюда не входит: она зависит только от дня рождения (tagesenergie, _TAGES_TABLE)."""
+    __slots__ = ("day", "month", "year", "g", "h", "v", "e", "geld")
+
+    def __init__(self, day: int, month: int, year: int):
+        self.day, self.month, self.year = day, month, year
+        self.g, self.h, self.v, self.e, self.geld = _numerology_table()[day][month][_DIGIT_SUM[year]]
+
+    @property
+    def date_str(self) -> str:
+        return f"{self.day:02d}.{self.month:02d}.{self.year}"
+
+    def __repr__(self) -> str:
+        return f"Matrix({self.date_str}: g={self.g} h={self.h} v={self.v} e={self.e} geld={self.geld})"
+
+@lru_cache(maxsize=MATRIX_CACHE_SIZE)
+def matrix(day: int, month: int, year: int) -> Matrix:
+    """Общий (только для чтения) профиль даты; дата должна быть валидной (parse_date)."""
+    return Matrix(day, month, year)
+
+# ================================ Метрики =====================================
+# Счётчики и гистограммы в памяти процесса: обработчики оборачиваются при регистрации
+# (instrument_handlers), вызовы Bot API считает CountingRequest. Запись — пара
+# инкрементов и bisect по 13 границам, ~1 µs на апдейт. Смотреть: «📊 Statistik»
+# у админа или Prometheus-текст на METRICS_PORT (и /metrics вебхук-сервера с METRICS_TOKEN).
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CHUNK_BUCKETS   = (1, 2, 3, 5, 8, 13, 21)
+# Vollanalyse по сохранённой дате этап «datum» не проходит — у неё своя воронка
+# (full_saved), иначе «geliefert» обгоняет «datum» и конверсия теряет смысл. В
+# Partnerschaft сохранённая дата засчитывается как «person1» в момент клика.
+FUNNELS = {
+    "full":       ("klick", "datum", "geliefert"),
+    "full_saved": ("klick", "geliefert"),
+    "compat":     ("klick", "person1", "geliefert"),
+    "group":      ("klick", "geliefert"),
+}
+FUNNEL_TITLES = {"full": "Vollanalyse", "full_saved": "Vollanalyse (gespeichertes Datum)",
+                 "compat": "Partnerschaft", "group": "Gruppenenergie"}
+METRICS_PORT   = int(os.getenv("METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1").strip()
+METRICS_TOKEN  = os.getenv("METRICS_TOKEN", "").strip()
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "total", "max", "errors")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последний — +Inf
+        self.count = self.errors = 0
+        self.total = self.max = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Оценка сверху: граница корзины, в которую попадает q-квантиль."""
+        need, seen = q * self.count, 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= need:
+                return bound
+        return self.max
+
+class Metrics:
+    def __init__(self):
+        self.handlers: Dict[str, Histogram] = {}
+        self.api_calls: Dict[str, int] = {}
+        self.chunks = Histogram(CHUNK_BUCKETS)
+        # трафик: длинные тексты (send_long_html) и документы Vollanalyse (загрузка / file_id)
+        self.traffic: Dict[str, int] = dict.fromkeys(
+            ("text_msgs", "text_bytes", "doc_uploads", "doc_upload_bytes", "doc_file_id", "doc_saved_bytes"), 0)
+        self.funnel_counts: Dict[Tuple[str, str], int] = {(f, st): 0 for f, stages in FUNNELS.items() for st in stages}
+
+    def wrap(self, fn: Callable) -> Callable:
+        """Обёртка обработчика: число вызовов, ошибки, гистограмма длительности."""
+        hist = self.handlers.setdefault(fn.__name__, Histogram(LATENCY_BUCKETS))
+
+        @wraps(fn)
+        async def timed(update, context):
+            t0 = time.perf_counter()
+            try:
+                return await fn(update, context)
+            except ApplicationHandlerStop:
+                raise  # штатная остановка цепочки (FLOOD), не ошибка
+            except Exception:
+                hist.errors += 1
+                raise
+            finally:
+                hist.observe(time.perf_counter() - t0)
+        return timed
+
+    def api_call(self, method: str):
+        self.api_calls[method] = self.api_calls.get(method, 0) + 1
+
+    def funnel(self, name: str, stage: str):
+        self.funnel_counts[(name, stage)] += 1
+
+    def summary_html(self) -> str:
+        lines = ["⏱ <b>Handler</b> (Aufrufe / Fehler / p50 / p95 ms):"]
+        for name, h in sorted(self.handlers.items(), key=lambda kv: -kv[1].count)[:10]:
+            if h.count:
+                lines.append(f"  • {name}: {h.count} / {h.errors} / "
+                             f"{1000 * h.quantile(0.5):g} / {1000 * h.quantile(0.95):g}")
+        total = sum(self.api_calls.values())
+        top = ", ".join(f"{m} {n}" for m, n in sorted(self.api_calls.items(), key=lambda kv: -kv[1])[:4])
+        lines.append(f"🔌 API-Aufrufe: {total}" + (f" ({top})" if top else ""))
+        if self.chunks.count:
+            lines.append(f"✂️ Teile pro Antwort: Ø {self.chunks.total / self.chunks.count:.1f}, max {self.chunks.max}")
+        tr = self.traffic
+        lines.append(f"📦 Langtexte: {tr['text_msgs']} Nachrichten, {tr['text_bytes'] // 1024} KB; "
+                     f"Dokumente: {tr['doc_uploads']} Uploads ({tr['doc_upload_bytes'] // 1024} KB), "
+                     f"{tr['doc_file_id']} per file_id ({tr['doc_saved_bytes'] // 1024} KB gespart)")
+        for name, stages in FUNNELS.items():
+            counts = [self.funnel_counts[(name, st)] for st in stages]
+            rate = f" ({100 * counts[-1] / counts[0]:.0f} %)" if counts[0] else ""
+            lines.append(f"🔻 {FUNNEL_TITLES[name]}: " + " → ".join(f"{st} {n}" for st, n in zip(stages, counts)) + rate)
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        out = []
+
+        def hist(metric: str, label: str, h: Histogram):
+            acc = 0
+            for bound, n in zip(h.bounds + ("+Inf",), h.counts):
+                acc += n
+                out.append(f'{metric}_bucket{{{label}le="{bound}"}} {acc}')
+            out.append(f"{metric}_sum{{{label.rstrip(',')}}} {h.total}")
+            out.append(f"{metric}_count{{{label.rstrip(',')}}} {h.count}")
+
+        out.append("# TYPE keytofate_handler_seconds histogram")
+        for name, h in self.handlers.items():
+            hist("keytofate_handler_seconds", f'handler="{name}",', h)
+        out.append("# TYPE keytofate_handler_errors_total counter")
+        out += [f'keytofate_handler_errors_total{{handler="{n}"}} {h.errors}' for n, h in self.handlers.items()]
+        out.append("# TYPE keytofate_api_calls_total counter")
+        out += [f'keytofate_api_calls_total{{method="{m}"}} {n}' for m, n in self.api_calls.items()]
+        out.append("# TYPE keytofate_reply_chunks histogram")
+        hist("keytofate_reply_chunks", "", self.chunks)
+        out.append("# TYPE keytofate_dropped_total counter")
+        out += [f'keytofate_dropped_total{{reason="{k}"}} {n}' for k, n in FLOOD.drops.items()]
+        out.append("# TYPE keytofate_traffic_total counter")
+        out += [f'keytofate_traffic_total{{kind="{k}"}} {n}' for k, n in self.traffic.items()]
+        out.append("# TYPE keytofate_funnel_total counter")
+        out += [f'keytofate_funnel_total{{funnel="{f}",stage="{st}"}} {n}' for (f, st), n in self.funnel_counts.items()]
+        out.append("# TYPE keytofate_users gauge")
+        out.append(f"keytofate_users {user_total()}")
+        out.append("# TYPE keytofate_outbound_total counter")
+        out += [f'keytofate_outbound_total{{result="{k}"}} {OUTBOUND.stats[k]}' for k in ("sent", "retries", "failed")]
+        return "\n".join(out) + "\n"
+
+METRICS = Metrics()
+
+class CountingRequest(HTTPXRequest):
+    """HTTPXRequest, считающий вызовы Bot API по имени метода."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        METRICS.api_call(url.rsplit("/", 1)[-1])
+        return await super().do_request(url, method, *args, **kwargs)
+
+def instrument_handlers(app: Application):
+    """Оборачивает callback всех зарегистрированных обработчиков (и внутри ConversationHandler)."""
+    def walk(handlers):
+        for h in handlers:
+            if isinstance(h, ConversationHandler):
+                walk(h.entry_points)
+                for state_handlers in h.states.values():
+                    walk(state_handlers)
+                walk(h.fallbacks)
+            elif getattr(h, "callback", None) is not None:
+                h.callback = METRICS.wrap(h.callback)
+    for group in app.handlers.values():
+        walk(group)
+
+# ===================== Исходящие сообщения: лимиты Telegram ===================
+# Telegram пускает ~1 сообщение/с в один чат и ~30/с на бота, при превышении — RetryAfter.
+# Все ответы идут через OUTBOUND: токен-бакеты на чат и общий, интерактивные ответы
+# имеют приоритет над рассылками (bulk), RetryAfter повторяется после паузы.
+OUT_CHAT_RATE   = float(os.getenv("OUT_CHAT_RATE", "1"))
+OUT_CHAT_BURST  = float(os.getenv("OUT_CHAT_BURST", "3"))
+OUT_GLOBAL_RATE = float(os.getenv("OUT_GLOBAL_RATE", "30"))
+OUT_MAX_RETRIES = int(os.getenv("OUT_MAX_RETRIES", "3"))
+
+class TokenBucket:
+    """Бакет с резервированием: reserve() сразу списывает токен и говорит, сколько ждать."""
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate, self.capacity = rate, capacity
+        self.tokens, self.stamp = capacity, time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def reserve(self) -> float:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_take(self) -> bool:
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def pause(self, seconds: float):
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    @property
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+class OutboundScheduler:
+    def __init__(self, chat_rate: float = OUT_CHAT_RATE, chat_burst: float = OUT_CHAT_BURST,
+                 global_rate: float = OUT_GLOBAL_RATE, max_retries: int = OUT_MAX_RETRIES):
+        self.chat_rate, self.chat_burst, self.max_retries = chat_rate, chat_burst, max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self.waiting = {"interactive": 0, "bulk": 0}
+        self.stats = {"sent": 0, "retries": 0, "failed": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            if len(self._chats) > 10000:
+                self._chats = {k: v for k, v in self._chats.items() if not v.idle}
+            b = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return b
+
+    async def _acquire(self, chat_id: int, bulk: bool):
+        delay = self._chat_bucket(chat_id).reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        # в waiting — только те, кто ждёт общий токен: пауза своего чата (длинный ответ
+        # частями по 1/с) рассылку не тормозит
+        kind = "bulk" if bulk else "interactive"
+        self.waiting[kind] += 1
+        try:
+            if not bulk:
+                delay = self._global.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                return
+            # рассылка берёт общий токен, только если он свободен прямо сейчас и никто
+            # из интерактивных не ждёт — так ответы пользователям всегда идут первыми
+            while self.waiting["interactive"] or not self._global.try_take():
+                await asyncio.sleep(1.0 / self._global.rate)
+        finally:
+            self.waiting[kind] -= 1
+
+    async def call(self, chat_id: int, send: Callable[[], Awaitable], bulk: bool = False):
+        for attempt in range(self.max_retries + 1):
+            t0 = time.monotonic()
+            await self._acquire(chat_id, bulk)
+            waited = time.monotonic() - t0
+            self.stats["wait_total"] += waited
+            self.stats["wait_max"] = max(self.stats["wait_max"], waited)
+            try:
+                result = await send()
+                self.stats["sent"] += 1
+                return result
+            except RetryAfter as e:
+                ra = e.retry_after
+                secs = ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+                # flood-wait действует на весь бот — стоят и чат, и общий бакет
+                self._chat_bucket(chat_id).pause(secs)
+                self._global.pause(secs)
+                self.stats["retries"] += 1
+                if attempt == self.max_retries:
+                    self.stats["failed"] += 1
+                    raise
+            except Exception:
+                self.stats["failed"] += 1
+                raise
+
+    def stats_line(self) -> str:
+        st = self.stats
+        avg = 1000 * st["wait_total"] / max(1, st["sent"] + st["failed"])
+        return (f"gesendet {st['sent']}, Retries {st['retries']}, Fehler {st['failed']}, "
+                f"Warteschlange {self.waiting['interactive']}+{self.waiting['bulk']}, "
+                f"Wartezeit Ø {avg:.0f} ms / max {1000*st['wait_max']:.0f} ms")
+
+OUTBOUND = OutboundScheduler()
+
+async def reply_html(message: Message, text: str, bulk: bool = False, **kwargs) -> Message:
+    """message.reply_html через OUTBOUND (лимиты, приоритет, повтор при RetryAfter)."""
+    return await OUTBOUND.call(message.chat_id, lambda: message.reply_html(text, **kwargs), bulk=bulk)
+
+async def reply_document(message: Message, document, bulk: bool = False, **kwargs) -> Message:
+    """message.reply_document через OUTBOUND."""
+    return await OUTBOUND.call(message.chat_id, lambda: message.reply_document(document, **kwargs), bulk=bulk)
+
 # Отправка длинных сообщений + кнопка «Назад»
-def back_kb() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Zurück zum Menü", callback_data="open_menu")]])
+def back_kb(lang: str = DEFAULT_LANG) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(LOCALES[lang].t("btn_back"), callback_data="open_menu")]])
 
-async def send_long_html(update: Update, text: str, with_back: bool = True):
-    """Бьём на части ≤4000 символов. Кнопка «Назад» — на последней части."""
-    MAX = 4000
+def split_html_chunks(text: str, limit: int = 4000) -> List[str]:
+    """Части ≤limit символов, режем по абзацу, затем по строке, иначе жёстко."""
     chunks = []
     src = text
-    while len(src) > MAX:
-        cut = src.rfind("\n\n", 0, MAX)
-        if cut == -1: cut = src.rfind("\n", 0, MAX)
-        if cut == -1: cut = MAX
+    while len(src) > limit:
+        cut = src.rfind("\n\n", 0, limit)
+        if cut == -1: cut = src.rfind("\n", 0, limit)
+        if cut == -1: cut = limit
         chunks.append(src[:cut])
         src = src[cut:]
     if src: chunks.append(src)
+    return chunks
+
+async def send_long_html(update: Update, text: str, with_back: bool = True,
+                         reply_markup: InlineKeyboardMarkup | None = None, lang: str | None = None):
+    """Бьём на части ≤4000 символов. Кнопка «Назад» (или reply_markup) — на последней части.
+    lang — если update собран из сообщения бота (от пользователя в нём ничего нет)."""
+    chunks = split_html_chunks(text)
     if not chunks: return
+    METRICS.chunks.observe(len(chunks))
+    METRICS.traffic["text_msgs"] += len(chunks)
+    METRICS.traffic["text_bytes"] += len(text.encode("utf-8"))
     for c in chunks[:-1]:
-        await update.message.reply_html(c)
-    await update.message.reply_html(chunks[-1], reply_markup=(back_kb() if with_back else None))
+        await reply_html(update.message, c)
+    back = back_kb(lang or user_lang(update)) if with_back else None
+    await reply_html(update.message, chunks[-1], reply_markup=reply_markup or back)
+
+# ======================= Входящие: защита от флуда ===========================
+# TypeHandler в группе -1 видит каждый апдейт раньше меню и диалогов. Лишнее
+# отбрасывается через ApplicationHandlerStop до любого рендера: бакет на пользователя
+# (FLOOD_RATE апдейтов/с, запас FLOOD_BURST) и повтор того же текста/кнопки/файла
+# в пределах DEDUP_WINDOW_SEC. О торможении пользователь узнаёт один раз за эпизод.
+# Inline-запросы не трогаем — у них свой debounce.
+FLOOD_RATE       = float(os.getenv("FLOOD_RATE", "1"))
+FLOOD_BURST      = float(os.getenv("FLOOD_BURST", "8"))
+DEDUP_WINDOW_SEC = float(os.getenv("DEDUP_WINDOW_SEC", "3"))
+
+class FloodGuard:
+    def __init__(self, rate: float = FLOOD_RATE, burst: float = FLOOD_BURST, window: float = DEDUP_WINDOW_SEC):
+        self.rate, self.burst, self.window = rate, burst, window
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._last: Dict[int, Tuple[str, float]] = {}  # user → (отпечаток, время)
+        self._noticed: Set[int] = set()
+        self.drops = {"rate": 0, "dup": 0, "group_dup": 0}
+
+    @staticmethod
+    def fingerprint(update: Update) -> str | None:
+        if update.callback_query:
+            return "cb:" + (update.callback_query.data or "")
+        msg = update.message
+        if msg is None:
+            return None
+        if msg.text:
+            return "t:" + msg.text.strip()
+        if msg.document:
+            return "d:" + msg.document.file_unique_id
+        return None
+
+    def check(self, update: Update) -> str | None:
+        """None — пропустить, иначе причина отказа ("rate" / "dup")."""
+        user = update.effective_user
+        if user is None or update.inline_query is not None:
+            return None
+        uid, now = user.id, time.monotonic()
+        fp = self.fingerprint(update)
+        last = self._last.get(uid)
+        if fp is not None:
+            self._last[uid] = (fp, now)
+            if last is not None and last[0] == fp and now - last[1] < self.window:
+                self.drops["dup"] += 1
+                return "dup"
+        bucket = self._buckets.get(uid)
+        if bucket is None:
+            bucket = self._buckets[uid] = TokenBucket(self.rate, self.burst)
+        if not bucket.try_take():
+            self.drops["rate"] += 1
+            return "rate"
+        self._noticed.discard(uid)
+        return None
+
+    def first_notice(self, uid: int) -> bool:
+        if uid in self._noticed:
+            return False
+        self._noticed.add(uid)
+        return True
+
+    def sweep(self):
+        now = time.monotonic()
+        self._last = {u: v for u, v in self._last.items() if now - v[1] < self.window}
+        self._buckets = {u: b for u, b in self._buckets.items() if not b.idle}
+        self._noticed &= self._buckets.keys()
+
+    def stats_line(self) -> str:
+        d = self.drops
+        return f"gedrosselt {d['rate']}, Duplikate {d['dup']}, doppelte Gruppendaten {d['group_dup']}"
+
+FLOOD = FloodGuard()
+
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reason = FLOOD.check(update)
+    if reason is None:
+        return
+    notice = user_pack(update).t("flood")
+    first = reason == "rate" and FLOOD.first_notice(update.effective_user.id)
+    if update.callback_query:
+        # отброшенный клик всё равно подтверждаем, иначе у клиента крутится индикатор
+        try:
+            await update.callback_query.answer(notice if first else None)
+        except BadRequest:
+            pass  # запрос уже устарел
+    elif first and update.effective_message is not None:
+        await reply_html(update.effective_message, notice)
+    raise ApplicationHandlerStop
 
 # =========================== Состояния, меню, учёт пользователей ============
-ASK_DAY_BIRTH, ASK_COMPAT_1, ASK_COMPAT_2, ASK_NAME, ASK_GROUP, ASK_FULL, ASK_PATH = range(7)
-
-WELCOME = (
-"🌟 <b>Liebe Freunde!</b>\n\n"
-"Vor Ihnen liegt ein einzigartiges Wissen: <b>KeyToFate</b>.\n"
-"🔑 <i>KeyToFate – der Schlüssel zu sich selbst und zu allem.</i>\n"
-"Es wird Ihr wahres Potenzial entfalten und Ihnen helfen, Harmonie mit sich selbst und der Welt um Sie herum zu finden.\n\n"
+ASK_DAY_BIRTH, ASK_COMPAT_1, ASK_COMPAT_2, ASK_NAME, ASK_GROUP, ASK_FULL, ASK_PATH, ASK_KI, ASK_CAL = range(9)
 
-"📖 In diesem Wissen sind erstaunliche Erkenntnisse über die Kraft der menschlichen Persönlichkeit und ihre Bestimmung gesammelt, "
-"die in Ihrem Geburtsdatum verborgen sind. Wenn Sie diese Gesetze des Universums studieren, können Sie Ihre Seele erkennen, "
-"alle Talente entfalten und Ihr wahres Potenzial verwirklichen.\n\n"
 
-"✨ Dieses Werk stellt eine einzigartige Methode zur Analyse der <b>„Matrix des Menschen“</b> dar, "
-"die Ihnen hilft, Ihren Lebensweg zu klären und Antworten auf die wichtigsten Fragen zu finden.\n\n"
+# Тексты приветствия, меню и подсказок — в языковых пакетах (welcome, menu_header, btn_*).
+MENU_ITEMS = (("btn_full", "calc_full"), ("btn_day", "calc_day"), ("btn_cal", "calc_cal"),
+              ("btn_compat", "calc_compat"), ("btn_name", "calc_name"), ("btn_group", "calc_group"),
+              ("btn_path", "calc_path"), ("btn_ki", "ki_mode"), ("btn_donate", "donate"))
 
-"💞 Darüber hinaus enthält dieses Werk weitere wertvolle Informationen:\n"
-"– die <b>Kompatibilität</b> zwischen Menschen,\n"
-"– die richtige <b>Entwicklung der Energiezyklen</b>,\n"
-"– eine detaillierte Beschreibung aller <b>Anlagen des Menschen</b>,\n"
-"– sowie des Weges, den Ihre Seele in dieser Inkarnation geht.\n\n"
-
-"🌈 Wenn Sie dieses Wissen anwenden, werden Sie Harmonie finden, stabile Beziehungen zu Ihren Liebsten aufbauen "
-"und Erfolg in Ihren Unternehmungen sowie Ihrer Karriere erzielen. So erkennen Sie Ihre Stärken, entfalten Ihre Talente "
-"und finden zu innerer Ruhe und Selbstvertrauen.\n\n"
-
-"🌌 <b>Lüften Sie den Schleier des Geheimnisses um Ihr Schicksal!</b>\n"
-"Und lassen Sie dieses Wissen zu Ihrem weisen Wegweiser auf dem Pfad zum Glück werden! ✨"
-)
-MENU_HEADER = "🔽 <b>Hauptmenü</b>\nBitte wählen Sie:"
-
-def main_menu(user_id: int) -> InlineKeyboardMarkup:
-    buttons = [
-        [InlineKeyboardButton("🧮 VOLLANALYSE – Start hier ⬅️⬅️", callback_data="calc_full")],
-        [InlineKeyboardButton("☀️ Tagesenergie", callback_data="calc_day")],
-        [InlineKeyboardButton("💞 Partnerschaft", callback_data="calc_compat")],
-        [InlineKeyboardButton("🔤 Namensenergie", callback_data="calc_name")],
-        [InlineKeyboardButton("👥 Gruppenenergie", callback_data="calc_group")],
-        [InlineKeyboardButton("🧭 Entwicklungspfad", callback_data="calc_path")],
-        [InlineKeyboardButton("🤖 KI-Modus (Beta)", callback_data="ki_mode")],
-        [InlineKeyboardButton("💖 Spende (PayPal) ↗", callback_data="donate")],
-    ]
+def main_menu(user_id: int, lang: str = DEFAULT_LANG) -> InlineKeyboardMarkup:
+    pack = LOCALES[lang]
+    buttons = [[InlineKeyboardButton(pack.t(key), callback_data=data)] for key, data in MENU_ITEMS]
     # кнопку Statistik добавляем только админу
     if user_id == ADMIN_ID:
         buttons.append([InlineKeyboardButton("📊 Statistik", callback_data="stats")])
     return InlineKeyboardMarkup(buttons)
 
 USERS: Set[int] = set()
-def _touch_user(update: Update):
+def _touch_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         USERS.add(update.effective_user.id)
+        context.user_data.seen = int(time.time())
     except Exception:
         pass
 
-# -------------------------- Парсер подблоков "по дням" в Geisteszahl --------
-NUM_LINE = re.compile(r'^\s*(?:[-–•]?\s*)?([1-9]|[12]\d|3[01])\s*\.?\s*$', re.M)
-DE_HEADING = re.compile(
-    r'^\s*[-–•]?\s*(?:wenn)\s+(?:sie|du)\s+am\s+([1-9]|[12]\d|3[01])\s*[.,]?\s+geboren\s+(?:sind|bist)\s*[:\-–]?\s*$',
-    re.I | re.M
-)
-
-def split_geistes_block_by_days(block: str) -> Tuple[str, Dict[int, str]]:
+class UserProfile:
     """
-    Возвращает (общая_часть, {день: текст_раздела}).
-    Поддерживаем два вида подзаголовков: отдельное число в строке и фразу «Wenn Sie am 25. geboren sind:».
+    user_data одного пользователя (ContextTypes.user_data) — вместо свободного dict.
+    dob: дата рождения, упакованная в ГГГГММДД (0 = нет); seen: последний визит (unix);
+    pending: незавершённый ввод — (d, m, y, "исходный текст") для Partnerschaft
+    или список дат для Gruppenenergie.
     """
-    if not block:
-        return "", {}
+    __slots__ = ("dob", "seen", "pending")
 
-    matches = []
-    matches += [(m.start(), m.end(), int(m.group(1))) for m in NUM_LINE.finditer(block)]
-    matches += [(m.start(), m.end(), int(m.group(1))) for m in DE_HEADING.finditer(block)]
-    matches.sort(key=lambda x: x[0])
+    def __init__(self):
+        self.dob = 0
+        self.seen = 0
+        self.pending = None
 
-    if not matches:
-        return block.strip(), {}
+    def set_dob(self, d: int, m: int, y: int):
+        self.dob = y * 10000 + m * 100 + d
 
-    general = block[:matches[0][0]].strip()
-    parts: Dict[int, str] = {}
-    for i, (s, e, day) in enumerate(matches):
-        end = matches[i+1][0] if i+1 < len(matches) else len(block)
-        parts[day] = block[e:end].strip()
-    return general, parts
+    @property
+    def dob_tuple(self) -> Tuple[int, int, int] | None:
+        if not self.dob:
+            return None
+        return self.dob % 100, self.dob // 100 % 100, self.dob // 10000
+
+    @property
+    def matrix(self) -> "Matrix | None":
+        dob = self.dob_tuple
+        return matrix(*dob) if dob else None
+
+    @property
+    def dob_str(self) -> str:
+        d, m, y = self.dob_tuple or (0, 0, 0)
+        return f"{d:02d}.{m:02d}.{y}"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserProfile":
+        """Старый формат user_data (dict с dob/compat1/group_birthdays)."""
+        p = cls()
+        if data.get("dob"):
+            p.set_dob(*data["dob"])
+        return p
+
+    def __getstate__(self):
+        return self.dob, self.seen, self.pending
+
+    def __setstate__(self, state):
+        self.dob, self.seen, self.pending = state
+
+CONTEXT_TYPES = ContextTypes(user_data=UserProfile)
 
 # -------------------------- Хелперы сборки текстов ---------------------------
-def build_fullanalyse_text(d: int, m: int, y: int) -> str:
+def _render_full_fragment(d: int, corpus: Corpus | None = None, lang: str = DEFAULT_LANG) -> str:
+    """Статичная часть Vollanalyse для дня рождения d (всё, кроме заголовка с датой и Geldcode)."""
+    pack = LOCALES[lang]
     g = geisteszahl(d)
-    geist_short = GEISTES_TXT.get(g, "")
-    geist_full  = get_geistes(g)
-    day_text    = (DAY_BIRTH_TXT.get(d) or "").strip()
-    planet_info = PLANET_INFO.get(g, "")
-    geld        = geldcode(d, m, y)
+    geist_short = pack.tables["geistes"].get(g, "")
+    day_text    = (pack.tables["day_birth"].get(d) or "").strip()
+    planet_info = pack.tables["planet"].get(g, "")
 
-    general_g, day_parts = split_geistes_block_by_days(geist_full)
+    general_g, day_parts = (corpus or pack.corpus).geistes_days(g)
     specific_day_part = (day_parts.get(d) or "").strip()
 
-    parts = [
-        f"<b>Vollanalyse für {d:02d}.{m:02d}.{y}</b>",
-        f"🧠 <b>Geisteszahl {g}</b>\n{html_escape(geist_short)}",
-    ]
+    parts = [f"🧠 <b>{pack.t('geisteszahl')} {g}</b>\n{html_escape(geist_short)}"]
     if general_g:
         parts.append(html_escape(general_g))  # общий текст по Geisteszahl (например, 7)
 
     # Сразу после общего — ТОЛЬКО подблок для введённого дня (например, 25)
     if specific_day_part:
-        parts.append(f"\n📌 <b>Spezifisch für Geburtstag {d}</b>\n{html_escape(specific_day_part)}")
+        parts.append(f"\n📌 <b>{pack.t('specific', d=d)}</b>\n{html_escape(specific_day_part)}")
 
     if day_text:
-        parts.append(f"\n📅 <b>Bedeutung des Geburtstagstages {d}</b>\n{html_escape(day_text)}")
+        parts.append(f"\n📅 <b>{pack.t('day_meaning', d=d)}</b>\n{html_escape(day_text)}")
     if planet_info:
-        parts.append(f"\n➕ <b>Zusätzliche Info</b>\n{html_escape(planet_info)}")
-    parts.append(f"\n💰 <b>Geldcode:</b> <code>{geld}</code>")
+        parts.append(f"\n➕ <b>{pack.t('extra')}</b>\n{html_escape(planet_info)}")
     return "\n\n".join(parts)
 
-def build_tagesenergie_text(d: int) -> str:
-    today = datetime.now()
-    val = tagesenergie(d, today.day)
-    body = TAG_TXT.get(val, "Energie im Fluss.")
-    return f"📅 <b>Tagesenergie {today.day:02d}.{today.month:02d}.{today.year}</b>\n\n{html_escape(body)}"
+def _render_matrix_sections(g: int, h: int, lang: str = DEFAULT_LANG) -> str:
+    """Handlungs-/Verwirklichungs-/Ergebniszahl из книги; зависят только от (g, h).
+    Мастер-числа 11/22/33 показываем как есть, текст — по их сумме цифр."""
+    pack = LOCALES[lang]
+    v = verwirklichungszahl(g, h)
+    e = ergebniszahl(g, h, v)
+    corpus = pack.corpus
+    parts = [f"🔢 <b>{pack.t('matrix')}:</b> {g} · {h} · {v} · {e}"]
+    for icon, key, kind, n in (("🎯", "handlungszahl", "handlungs", h), ("🌱", "verwirklichungszahl", "verwirk", v),
+                               ("🏁", "ergebniszahl", "ergebnis", e)):
+        text = corpus.prose(kind, reduzieren_1_9(n)) or pack.t("no_section")
+        parts.append(f"{icon} <b>{pack.t(key)} {n}</b>\n{html_escape(text)}")
+    return "\n\n".join(parts)
 
-# ---- Entwicklungspfad ----
-ENTWICKLUNGSPFAD = {
-    1: "Die 1 reift zur 4 — über Beziehung (2) und Ausdruck (3): aus Impuls werden Disziplin und Struktur.",
-    2: "Die 2 strebt zur 5 — über Wissen/Kommunikation (3) und Ordnung (4): Harmonie wird zu bewusster Freiheit.",
-    3: "Die 3 entfaltet sich zur 6 — über Struktur (4) und Wandel (5): Kreativität wird zu reifer Verantwortung.",
-    4: "Die 4 wächst zur 7 — über Freiheit (5) und Liebe/Verantwortung (6): Ordnung wird zu innerer Weisheit.",
-    5: "Die 5 strebt zur 8 — über 6 und 7: Liebe/Verantwortung → Wahrheit/Disziplin → gerechter Erfolg.",
-    6: "Die 6 geht zur 9 — über Tiefgang (7) und Macht/Erfolg (8): zur universellen Liebe und zum Dienst.",
-    7: "Die 7 geht zur 1 — über 8 und 9: Disziplin & Macht, dann Abschluss & Dienst hin zur reifen Führung.",
-    8: "Die 8 strebt zur 2 — über 9 und 1: von Macht zu Kooperation und Diplomatie.",
-    9: "Die 9 findet zur 3 — über 1 und 2: Dienst & Vollendung führen zu schöpferischem Ausdruck.",
-}
-ZU_VERMEIDEN = {
-    1: "Ego-Alleingänge, Ungeduld, Dominanz.",
-    2: "Unentschlossenheit, konfliktscheues Schweigen, Selbstverleugnung.",
-    3: "Zerstreuung, zu viele Projekte, Oberflächlichkeit.",
-    4: "Überstrenge Routinen, Dogmatismus, Detailkontrolle.",
-    5: "Reizjagd, Hektik, Flucht in Abwechslung, Bindungsangst.",
-    6: "Überverantwortung, Einmischung, subtile Schuldgefühle.",
-    7: "Isolation, endloses Zweifeln, Theorie ohne Praxis.",
-    8: "Machtspiele, Mikromanagement, Erfolgsfixierung.",
-    9: "Selbstaufopferung, diffuse Ziele, Grenzenlosigkeit.",
-}
+def build_fullanalyse_text(d: int, m: int, y: int, lang: str = DEFAULT_LANG) -> str:
+    mx = matrix(d, m, y)
+    title = LOCALES[lang].t("full_title", date=mx.date_str)
+    return f"<b>{title}</b>\n\n" + _fullanalyse_body(lang, mx.day, mx.h, mx.geld)
 
-def build_entwicklungspfad_text(d: int) -> str:
+def build_tagesenergie_text(d: int, today: datetime | None = None, lang: str = DEFAULT_LANG) -> str:
+    today = today or datetime.now(TAGES_TZ)  # тот же «сегодня», что у inline, рассылки и календаря
+    return _tagesenergie_text(d, today.day, today.month, today.year, lang)
+
+# ---- Entwicklungspfad ----
+def _render_entwicklungspfad(d: int, lang: str = DEFAULT_LANG) -> str:
+    pack = LOCALES[lang]
     g = geisteszahl(d)
-    return (f"🧭 <b>Entwicklungspfad (aus Geisteszahl {g})</b>\n\n"
-            f"{ENTWICKLUNGSPFAD.get(g,'')}\n\n"
-            f"⚠️ <b>Zu vermeiden:</b> {ZU_VERMEIDEN.get(g,'')}")
+    return (f"🧭 <b>{pack.t('pfad_title', g=g)}</b>\n\n"
+            f"{pack.tables['pfad'].get(g,'')}\n\n"
+            f"⚠️ <b>{pack.t('avoid')}</b> {pack.tables['vermeiden'].get(g,'')}")
+
+def build_entwicklungspfad_text(d: int, lang: str = DEFAULT_LANG) -> str:
+    if lang != DEFAULT_LANG:
+        return _lang_fragment("pfad", lang, d)
+    txt = _PFAD_FRAGMENTS.get(d)
+    if txt is None:
+        RENDER_STATS["pfad_miss"] += 1
+        return _render_entwicklungspfad(d)
+    RENDER_STATS["pfad_hit"] += 1
+    return txt
+
+# -------------------------- Кэш рендеринга -----------------------------------
+# Тексты зависят только от языка, дня рождения (1–31), Handlungszahl и Geldcode
+# (Verwirklichungs-/Ergebniszahl выводятся из дня и Handlungszahl), поэтому статичные
+# куски DEFAULT_LANG собираем один раз при старте (остальных языков — при первом
+# запросе), а готовые сообщения держим в ограниченном LRU с языком в ключе.
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "2048"))
+RENDER_STATS: Dict[str, int] = {"pfad_hit": 0, "pfad_miss": 0}
+
+_FULL_FRAGMENTS: Dict[int, str] = {d: _render_full_fragment(d) for d in range(1, 32)}
+_PFAD_FRAGMENTS: Dict[int, str] = {d: _render_entwicklungspfad(d) for d in range(1, 32)}
+
+@lru_cache(maxsize=256)
+def _lang_fragment(kind: str, lang: str, d: int) -> str:
+    """Статичные куски (Vollanalyse / Entwicklungspfad) не-default языков."""
+    return _render_full_fragment(d, lang=lang) if kind == "full" else _render_entwicklungspfad(d, lang)
+
+@lru_cache(maxsize=512)
+def _matrix_sections(lang: str, g: int, h: int) -> str:
+    return _render_matrix_sections(g, h, lang)
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _fullanalyse_body(lang: str, d: int, h: int, geld: str) -> str:
+    frag = _FULL_FRAGMENTS.get(d) if lang == DEFAULT_LANG else _lang_fragment("full", lang, d)
+    if frag is None:
+        frag = _render_full_fragment(d)
+    return (f"{frag}\n\n\n{_matrix_sections(lang, geisteszahl(d), h)}"
+            f"\n\n\n💰 <b>{LOCALES[lang].t('geldcode')}:</b> <code>{geld}</code>")
+
+@lru_cache(maxsize=64)
+def _tagesenergie_text(d: int, day: int, month: int, year: int, lang: str = DEFAULT_LANG) -> str:
+    pack = LOCALES[lang]
+    body = pack.tables["tag"].get(tagesenergie(d, day), pack.t("tages_default"))
+    return f"📅 <b>{pack.t('tages_title', date=f'{day:02d}.{month:02d}.{year}')}</b>\n\n{html_escape(body)}"
+
+def render_cache_stats() -> str:
+    """Строка для админской статистики: попадания/промахи кэшей рендеринга."""
+    full, tag = _fullanalyse_body.cache_info(), _tagesenergie_text.cache_info()
+    inline, mx = _inline_results.cache_info(), matrix.cache_info()
+    return (f"Matrix {mx.hits}/{mx.misses} ({mx.currsize}/{mx.maxsize}), "
+            f"Vollanalyse {full.hits}/{full.misses} ({full.currsize}/{full.maxsize}), "
+            f"Tagesenergie {tag.hits}/{tag.misses}, "
+            f"Entwicklungspfad {RENDER_STATS['pfad_hit']}/{RENDER_STATS['pfad_miss']}, "
+            f"Inline {inline.hits}/{inline.misses}; Sprachen: {LOCALES.stats_line()}")
 
 # ================================ Handlers ==================================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _touch_user(update)
-    kb = InlineKeyboardMarkup([[InlineKeyboardButton("➡️ Zum Menü", callback_data="open_menu")]])
-    await update.message.reply_html(WELCOME, reply_markup=kb)
+    _touch_user(update, context)
+    pack = user_pack(update)
+    kb = InlineKeyboardMarkup([[InlineKeyboardButton(pack.t("btn_menu"), callback_data="open_menu")]])
+    await reply_html(update.message, pack.t("welcome"), reply_markup=kb)
 
 async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    await q.message.reply_html(
-        MENU_HEADER,
-        reply_markup=main_menu(update.effective_user.id)
+    lang = user_lang(update)
+    await reply_html(
+        q.message,
+        LOCALES[lang].t("menu_header"),
+        reply_markup=main_menu(update.effective_user.id, lang)
     )
     return ConversationHandler.END
 
-def full_choice_kb(dob_str: str) -> InlineKeyboardMarkup:
+def full_choice_kb(dob_str: str, lang: str = DEFAULT_LANG) -> InlineKeyboardMarkup:
+    pack = LOCALES[lang]
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton(f"✅ Gespeichertes Datum verwenden ({dob_str})", callback_data="full_use_saved")],
-        [InlineKeyboardButton("✏️ Neues Datum eingeben", callback_data="full_enter_new")],
-        [InlineKeyboardButton("↩️ Zurück zum Menü", callback_data="open_menu")],
+        [InlineKeyboardButton(pack.t("btn_use_saved", date=dob_str), callback_data="full_use_saved")],
+        [InlineKeyboardButton(pack.t("btn_as_doc"), callback_data="full_doc")],
+        [InlineKeyboardButton(pack.t("btn_new_date"), callback_data="full_enter_new")],
+        [InlineKeyboardButton(pack.t("btn_back"), callback_data="open_menu")],
     ])
 
 async def on_menu_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _touch_user(update)
+    _touch_user(update, context)
     q = update.callback_query; data = q.data
     await q.answer()
-    dob = context.user_data.get("dob")
-    dob_str = context.user_data.get("dob_str")
+    profile = context.user_data
+    dob = profile.dob_tuple
+    dob_str = profile.dob_str
+    lang = user_lang(update)
+    pack = LOCALES[lang]
+    saved = Update(update.update_id, message=q.message)  # ответ в тот же чат, язык — lang
 
     # --- Vollanalyse: выбор при наличии сохранённой даты ---
     if data == "calc_full":
         if dob:
-            await q.message.reply_html("🧮 <b>Vollanalyse</b>\nWie sollen wir fortfahren?",
-                                       reply_markup=full_choice_kb(dob_str))
+            METRICS.funnel("full_saved", "klick")
+            await reply_html(q.message, pack.t("full_choose"), reply_markup=full_choice_kb(dob_str, lang))
             return ConversationHandler.END
-        await q.message.reply_html("🧮 Geben Sie Geburtsdatum ein (TT.MM.JJJJ):")
+        METRICS.funnel("full", "klick")
+        await reply_html(q.message, "🧮 " + pack.t("ask_dob"))
         return ASK_FULL
 
     if data == "full_use_saved":
         if dob:
             d,m,y = dob
-            await q.message.reply_html("🧮 Verwende gespeichertes Datum…")
-            await send_long_html(Update(update.update_id, message=q.message), build_fullanalyse_text(d,m,y), with_back=True)
+            await reply_html(q.message, "🧮 " + pack.t("using_saved"))
+            await send_long_html(saved, build_fullanalyse_text(d,m,y, lang), with_back=True, lang=lang)
+            METRICS.funnel("full_saved", "geliefert")
         else:
-            await q.message.reply_html("Kein gespeichertes Datum. Bitte eingeben (TT.MM.JJJJ):")
+            METRICS.funnel("full", "klick")
+            await reply_html(q.message, pack.t("no_saved"))
             return ASK_FULL
         return ConversationHandler.END
 
+    if data == "full_doc":
+        if dob:
+            await send_fullanalyse_document(q.message, context, *dob, lang=lang)
+            METRICS.funnel("full_saved", "geliefert")
+            return ConversationHandler.END
+        METRICS.funnel("full", "klick")
+        await reply_html(q.message, pack.t("no_saved"))
+        return ASK_FULL
+
     if data == "full_enter_new":
-        await q.message.reply_html("🧮 Bitte neues Geburtsdatum eingeben (TT.MM.JJJJ):")
+        METRICS.funnel("full", "klick")
+        await reply_html(q.message, "🧮 " + pack.t("ask_new_dob"))
         return ASK_FULL
 
     # --- Остальные пункты меню ---
     if data=="calc_day":
         if dob:
             d,_,_ = dob
-            await q.message.reply_html("☀️ Verwende gespeichertes Datum…")
-            await send_long_html(Update(update.update_id, message=q.message), build_tagesenergie_text(d), with_back=True)
+            await reply_html(q.message, "☀️ " + pack.t("using_saved"))
+            await send_long_html(saved, build_tagesenergie_text(d, lang=lang),
+                                 reply_markup=tages_kb(q.message.chat_id in context.bot_data.get("tages_abo", {}), lang))
             return ConversationHandler.END
-        await q.message.reply_html("Geben Sie Ihr Geburtsdatum ein (TT.MM.JJJJ):"); return ASK_DAY_BIRTH
+        await reply_html(q.message, pack.t("ask_dob")); return ASK_DAY_BIRTH
+
+    if data=="calc_cal":
+        if dob:
+            await reply_html(q.message, pack.t("cal_prompt"), reply_markup=kalender_start_kb(datetime.now(TAGES_TZ), lang))
+            return ASK_CAL
+        await reply_html(q.message, "📆 " + pack.t("ask_dob")); return ASK_CAL
 
     if data=="calc_compat":
+        METRICS.funnel("compat", "klick")
         if dob:
             d1,m1,y1 = dob
-            context.user_data["compat1"] = (d1,m1,y1, f"{d1:02d}.{m1:02d}.{y1}")
-            await q.message.reply_html("Geben Sie Geburtsdatum <b>Person 2</b> ein (TT.MM.JJJJ):"); return ASK_COMPAT_2
-        await q.message.reply_html("Geben Sie Geburtsdatum Person 1 ein (TT.MM.JJJJ):"); return ASK_COMPAT_1
+            profile.pending = (d1,m1,y1, dob_str)
+            METRICS.funnel("compat", "person1")
+            await reply_html(q.message, pack.t("ask_person2")); return ASK_COMPAT_2
+        await reply_html(q.message, pack.t("ask_person1")); return ASK_COMPAT_1
 
     if data=="calc_name":
-        await q.message.reply_html("Geben Sie den Namen ein (lateinische Schreibweise):"); return ASK_NAME
+        await reply_html(q.message, pack.t("ask_name")); return ASK_NAME
 
     if data=="calc_group":
-        context.user_data["group_birthdays"] = []
-        await q.message.reply_html("👥 Bis zu 5 Geburtstage eingeben. Schreiben Sie <b>fertig</b>, wenn bereit."); return ASK_GROUP
+        METRICS.funnel("group", "klick")
+        profile.pending = []
+        await reply_html(q.message, pack.t("group_prompt", n=GROUP_TEXT_LIMIT, kb=GROUP_FILE_MAX_BYTES // 1024,
+                                           done=pack.t("group_done_word"))); return ASK_GROUP
 
     if data=="calc_path":
         if dob:
             d,_,_ = dob
-            await q.message.reply_html("🧭 Verwende gespeichertes Datum…")
-            await send_long_html(Update(update.update_id, message=q.message), build_entwicklungspfad_text(d), with_back=True)
+            await reply_html(q.message, "🧭 " + pack.t("using_saved"))
+            await send_long_html(saved, build_entwicklungspfad_text(d, lang), with_back=True, lang=lang)
             return ConversationHandler.END
-        await q.message.reply_html("🧭 Bitte Geburtsdatum eingeben (TT.MM.JJJJ):"); return ASK_PATH
+        await reply_html(q.message, "🧭 " + pack.t("ask_dob")); return ASK_PATH
 
     if data=="ki_mode":
-        await q.message.reply_html("🤖 KI-Modus (Beta): Funktion in Entwicklung. Bald verfügbar!", reply_markup=back_kb()); return ConversationHandler.END
+        await reply_html(q.message, pack.t("ki_prompt"), reply_markup=back_kb(lang)); return ASK_KI
 
     if data=="donate":
         if PAYPAL_URL:
-            await q.message.reply_html(
-                f"💖 <b>Spende</b>\nUnterstütze das Projekt via <a href=\"{PAYPAL_URL}\">PayPal</a>. Danke!",
-                reply_markup=back_kb(),
+            await reply_html(
+                q.message,
+                pack.t("donate", url=PAYPAL_URL),
+                reply_markup=back_kb(lang),
                 disable_web_page_preview=True
             )
         else:
-            await q.message.reply_html(
-                "💖 <b>Spende</b>\nSetze bitte ENV <code>PAYPAL_URL</code> oder <code>PAYPAL_EMAIL</code>.",
-                reply_markup=back_kb()
+            await reply_html(
+                q.message,
+                pack.t("donate_unset"),
+                reply_markup=back_kb(lang)
             )
         return ConversationHandler.END
 
@@ -572,80 +1468,487 @@ async def on_menu_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await q.answer("Nur für Admin.", show_alert=True)
             return ConversationHandler.END
 
-        await q.message.reply_html(
-            f"📊 <b>KeyToFate – Statistik</b>\n\n👥 Benutzer gesamt: <b>{len(USERS)}</b>",
+        await reply_html(
+            q.message,
+            f"📊 <b>KeyToFate – Statistik</b>\n\n👥 Benutzer gesamt: <b>{user_total()}</b>\n"
+            + (f"🧩 Worker {SHARD[0] + 1}/{SHARD[1]} — alle Werte unten nur von diesem Worker "
+               f"(Benutzer gesamt: alle Worker)\n" if SHARD[1] > 1 else "") +
+            f"🗂 Render-Cache (Treffer/Fehlgriffe): {render_cache_stats()}\n"
+            f"📤 Versand: {OUTBOUND.stats_line()}\n"
+            f"🛡 Flood: {FLOOD.stats_line()}\n"
+            f"🤖 KI: {ki_stats_line()}\n\n"
+            f"{METRICS.summary_html()}",
             reply_markup=back_kb()
         )
         return ConversationHandler.END
 
 # ---- Vollanalyse ----
+# «Als Dokument»: HTML-файл зависит только от дня, Handlungszahl и Geldcode (в заголовке нет полной
+# даты), поэтому одинаковые файлы загружаются в Telegram один раз, дальше — по file_id.
+# Карта sha256(содержимое) → file_id лежит в bot_data и переживает рестарт.
+DOC_CACHE_MAX = 5000
+_DOC_LOCKS: Dict[str, list] = {}  # digest → [Lock, сколько отправок держат или ждут его]
+
+@lru_cache(maxsize=64)
+def _fullanalyse_document(lang: str, d: int, h: int, geld: str) -> Tuple[str, bytes, str]:
+    """(имя файла, HTML-байты, sha256) — без персональных данных."""
+    title = LOCALES[lang].t("doc_title", d=d, geld=geld)
+    html = (f'<!DOCTYPE html>\n<html lang="{lang}"><head><meta charset="utf-8">'
+            f"<title>{title}</title>\n<style>body{{font-family:sans-serif;max-width:46em;margin:2em auto;"
+            "line-height:1.5;white-space:pre-wrap}</style></head>\n"
+            f"<body><h1>{title}</h1>\n{_fullanalyse_body(lang, d, h, geld)}\n</body></html>\n").encode("utf-8")
+    suffix = "" if lang == DEFAULT_LANG else f"_{lang}"
+    return f"Vollanalyse_Tag{d}_H{h}_Geldcode{geld}{suffix}.html", html, hashlib.sha256(html).hexdigest()
+
+async def send_fullanalyse_document(message: Message, context: ContextTypes.DEFAULT_TYPE, d: int, m: int, y: int,
+                                    lang: str = DEFAULT_LANG):
+    mx = matrix(d, m, y)
+    name, data, digest = _fullanalyse_document(lang, mx.day, mx.h, mx.geld)
+    ids = context.bot_data.setdefault("doc_file_ids", {})
+    caption = "🧮 " + LOCALES[lang].t("full_title", date=mx.date_str)
+    # Запись живёт, пока есть держатель или ждущий: по lock.locked() это не понять — разбуженный,
+    # но ещё не захвативший замок ждущий видит locked() == False.
+    entry = _DOC_LOCKS.setdefault(digest, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:  # один и тот же файл параллельно не грузим дважды
+            file_id = ids.get(digest)
+            if file_id:
+                try:
+                    await reply_document(message, file_id, caption=caption, reply_markup=back_kb(lang))
+                    METRICS.traffic["doc_file_id"] += 1
+                    METRICS.traffic["doc_saved_bytes"] += len(data)
+                    return
+                except BadRequest:
+                    ids.pop(digest, None)  # file_id больше не действителен — загружаем заново
+            sent = await reply_document(message, InputFile(data, filename=name), caption=caption, reply_markup=back_kb(lang))
+            METRICS.traffic["doc_uploads"] += 1
+            METRICS.traffic["doc_upload_bytes"] += len(data)
+            ids[digest] = sent.document.file_id
+            while len(ids) > DOC_CACHE_MAX:
+                ids.pop(next(iter(ids)))
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _DOC_LOCKS[digest]
+
 async def ask_full(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _touch_user(update)
+    _touch_user(update, context)
     try:
         d,m,y = parse_date(update.message.text.strip())
-        context.user_data["dob"] = (d,m,y)
-        context.user_data["dob_str"] = f"{d:02d}.{m:02d}.{y}"
-        await send_long_html(update, build_fullanalyse_text(d,m,y), with_back=True)
+        context.user_data.set_dob(d,m,y)
+        METRICS.funnel("full", "datum")
+        await send_long_html(update, build_fullanalyse_text(d,m,y, user_lang(update)), with_back=True)
+        METRICS.funnel("full", "geliefert")
         return ConversationHandler.END
     except Exception as ex:
-        await update.message.reply_html(f"❌ Fehler: {html_escape(str(ex))}", reply_markup=back_kb()); return ASK_FULL
+        lang = user_lang(update)
+        await reply_html(update.message, f"❌ {html_escape(error_text(ex, LOCALES[lang]))}", reply_markup=back_kb(lang)); return ASK_FULL
 
 # ---- Tagesenergie ----
 async def ask_day_birth(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _touch_user(update)
+    _touch_user(update, context)
     try:
         d,m,y = parse_date(update.message.text.strip())
-        context.user_data["dob"] = (d,m,y)
-        context.user_data["dob_str"] = f"{d:02d}.{m:02d}.{y}"
-        await send_long_html(update, build_tagesenergie_text(d), with_back=True)
+        context.user_data.set_dob(d,m,y)
+        lang = user_lang(update)
+        await send_long_html(update, build_tagesenergie_text(d, lang=lang),
+                             reply_markup=tages_kb(update.message.chat_id in context.bot_data.get("tages_abo", {}), lang))
+        return ConversationHandler.END
+    except Exception as ex:
+        lang = user_lang(update)
+        await reply_html(update.message, f"❌ {html_escape(error_text(ex, LOCALES[lang]))}", reply_markup=back_kb(lang)); return ASK_DAY_BIRTH
+
+# ---- Tagesenergie-Abo ----
+# Подписчики: bot_data["tages_abo"] = {chat_id: (день рождения, язык)} (старые записи — просто
+# день, язык DEFAULT_LANG). Рассылка раз в день: текст зависит только от дня рождения и языка,
+# поэтому рендерим максимум 31 сообщение на язык, группируем подписчиков и отправляем через
+# OUTBOUND как bulk. Прогресс — по чатам:
+# bot_data["tages_push"] = {chat_id: дата последней рассылки}, отметка ставится после каждой
+# пачки только доставленным (и снятым) чатам и сразу пишется в базу. После падения (или смены
+# WORKERS) рассылка продолжается с неотмеченных чатов — подписки/отписки в промежутке её не
+# сдвигают; чаты с временной ошибкой добираются повтором через TAGES_PUSH_RETRY_SEC.
+# Ежедневный запуск, повтор и догонялка после рестарта не идут одновременно.
+TAGES_PUSH_TIME  = os.getenv("TAGES_PUSH_TIME", "07:00").strip()
+TAGES_TZ         = ZoneInfo(os.getenv("TAGES_TZ", "Europe/Berlin").strip())
+TAGES_PUSH_BATCH = int(os.getenv("TAGES_PUSH_BATCH", "30"))
+TAGES_PUSH_RETRY_SEC = int(os.getenv("TAGES_PUSH_RETRY_SEC", "600"))
+_TAGES_PUSH_LOCK = asyncio.Lock()
+
+def tages_kb(subscribed: bool = False, lang: str = DEFAULT_LANG) -> InlineKeyboardMarkup:
+    pack = LOCALES[lang]
+    abo = (InlineKeyboardButton(pack.t("btn_abo_off"), callback_data="abo_off") if subscribed else
+           InlineKeyboardButton(pack.t("btn_abo_on"), callback_data="abo_day"))
+    return InlineKeyboardMarkup([[abo], [InlineKeyboardButton(pack.t("btn_cal"), callback_data="calc_cal")],
+                                 [InlineKeyboardButton(pack.t("btn_back"), callback_data="open_menu")]])
+
+async def on_abo_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _touch_user(update, context)
+    q = update.callback_query
+    await q.answer()
+    lang = user_lang(update)
+    pack = LOCALES[lang]
+    subs = context.bot_data.setdefault("tages_abo", {})
+    if q.data == "abo_off":
+        subs.pop(q.message.chat_id, None)
+        await reply_html(q.message, pack.t("abo_off"), reply_markup=back_kb(lang))
+        return
+    dob = context.user_data.dob_tuple
+    if not dob:
+        await reply_html(q.message, pack.t("abo_need_dob"), reply_markup=back_kb(lang))
+        return
+    subs[q.message.chat_id] = (dob[0], lang)
+    await reply_html(q.message, pack.t("abo_on", time=TAGES_PUSH_TIME), reply_markup=tages_kb(True, lang))
+
+async def _push_one(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str,
+                    markup: InlineKeyboardMarkup) -> "bool | None":
+    """True — доставлено, False — подписка снята, None — временная ошибка (чат не отмечаем)."""
+    try:
+        await OUTBOUND.call(chat_id, lambda: context.bot.send_message(
+            chat_id, text, parse_mode="HTML", reply_markup=markup), bulk=True)
+        return True
+    except (Forbidden, BadRequest):
+        # бот заблокирован / чат удалён — подписку снимаем
+        context.bot_data.get("tages_abo", {}).pop(chat_id, None)
+        return False
+    except Exception as e:
+        print(f"[WARN] tages push to {chat_id} failed: {e!r}")
+        return None
+
+async def tages_push(context: ContextTypes.DEFAULT_TYPE):
+    """Ежедневная рассылка (и продолжение прерванной рассылки при старте)."""
+    if _TAGES_PUSH_LOCK.locked():
+        return  # другой запуск уже идёт по тому же состоянию
+    async with _TAGES_PUSH_LOCK:
+        await _tages_push(context)
+
+async def _tages_push(context: ContextTypes.DEFAULT_TYPE):
+    now = datetime.now(TAGES_TZ)
+    today = now.date().isoformat()
+    hh, mm = map(int, TAGES_PUSH_TIME.split(":"))
+    if (now.hour, now.minute) < (hh, mm):
+        return
+    subs = context.bot_data.get("tages_abo", {})
+    marks = context.bot_data.setdefault("tages_push", {})
+    for chat_id in marks.keys() - subs.keys():
+        del marks[chat_id]  # отписались — отметка больше не нужна
+
+    groups: Dict[Tuple[int, str], List[int]] = {}
+    for chat_id, abo in subs.items():
+        if marks.get(chat_id) != today:
+            bday, lang = abo if isinstance(abo, tuple) else (abo, DEFAULT_LANG)
+            groups.setdefault((bday, LOCALES.pick(lang)), []).append(chat_id)
+    if not groups:
+        return
+    t0 = time.monotonic()
+    sent = failed = retry = 0
+    for bday, lang in sorted(groups):
+        chats = sorted(groups[bday, lang])
+        text = f"☀️ <b>{LOCALES[lang].t('tages_push')}</b>\n\n" + build_tagesenergie_text(bday, now, lang)
+        markup = tages_kb(True, lang)
+        for i in range(0, len(chats), TAGES_PUSH_BATCH):
+            batch = chats[i:i + TAGES_PUSH_BATCH]
+            results = await asyncio.gather(*(_push_one(context, c, text, markup) for c in batch))
+            done = [c for c, r in zip(batch, results) if r is not None]
+            sent += results.count(True)
+            failed += len(batch) - results.count(True)
+            retry += results.count(None)
+            marks.update(dict.fromkeys(done, today))
+            await _persist_now(context)
+    print(f"[INFO] tages push {today}: {sent} sent, {failed} failed ({retry} to retry), "
+          f"{len(groups)} groups, {time.monotonic() - t0:.1f} s")
+    if retry and context.job_queue:
+        context.job_queue.run_once(tages_push, when=TAGES_PUSH_RETRY_SEC, name="tages_push_retry")
+
+async def _persist_now(context: ContextTypes.DEFAULT_TYPE):
+    """Отметки рассылки — сразу в базу: после падения посреди рассылки отмеченные чаты не получат дубль."""
+    app = context.application
+    if app.persistence:
+        await app.update_persistence()
+        if isinstance(app.persistence, SqlitePersistence):
+            await app.persistence.sync()
+
+# ---- Kalender ----
+# Tagesenergie зависит только от дня рождения и числа месяца, поэтому все значения
+# лежат в таблице 31×31 (_TAGES_TABLE[день рождения][число]). При старте для каждого
+# дня рождения склеиваем годовой ряд (обычный и високосный год, bytes по дню года)
+# и позиции каждой энергии в нём. Год — одна выборка из словаря, месяц — срез ряда,
+# лучшие дни — срез кортежа позиций через bisect; циклов по дням нет.
+KALENDER_YEARS = (1900, 2100)
+KAL_RE = re.compile(r'^\s*(?:(\d{1,2})[./\s-]+)?(\d{4})(?:\s+([1-9]))?\s*$')
+
+_TAGES_TABLE = [[0] * 32] + [[0] + [tagesenergie(d, day) for day in range(1, 32)] for d in range(1, 32)]
+_MONTH_DAYS = {leap: (31, 29 if leap else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31) for leap in (False, True)}
+_MONTH_START = {leap: tuple(sum(days[:i]) for i in range(13)) for leap, days in _MONTH_DAYS.items()}
+_TAGES_YEAR: Dict[Tuple[int, bool], bytes] = {
+    (d, leap): b"".join(bytes(_TAGES_TABLE[d][1:n + 1]) for n in _MONTH_DAYS[leap])
+    for d in range(1, 32) for leap in (False, True)}
+_TAGES_HITS: Dict[Tuple[int, bool, int], Tuple[int, ...]] = {
+    (d, leap, e): tuple(i for i, x in enumerate(row) if x == e)
+    for (d, leap), row in _TAGES_YEAR.items() for e in range(1, 10)}
+_ASCII_DIGITS = bytes.maketrans(bytes(range(10)), b"0123456789")
+_YEAR_MMDD = {leap: tuple(f"{m:02d}{day:02d}" for m, n in enumerate(days, 1) for day in range(1, n + 1))
+              for leap, days in _MONTH_DAYS.items()}  # «ММДД» по дню года — для выгрузок
+
+def _is_leap(year: int) -> bool:
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+class KalenderSpan(NamedTuple):
+    year: int
+    month: int       # 0 — весь год
+    start: int       # индекс первого дня в годовом ряду
+    values: bytes    # энергия по дням периода
+    hits: Tuple[int, ...]  # индексы (в годовом ряду) дней с выбранной энергией
+
+def kalender(d: int, year: int, month: int = 0, energy: int = 0) -> KalenderSpan:
+    """Tagesenergie на месяц (month 1–12) или год (month 0) для дня рождения d."""
+    leap = _is_leap(year)
+    row = _TAGES_YEAR[(d, leap)]
+    hits = _TAGES_HITS[(d, leap, energy)] if energy else ()
+    if not month:
+        return KalenderSpan(year, 0, 0, row, hits)
+    lo, hi = _MONTH_START[leap][month - 1], _MONTH_START[leap][month]
+    return KalenderSpan(year, month, lo, row[lo:hi], hits[bisect_left(hits, lo):bisect_left(hits, hi)])
+
+def _kal_period(span: KalenderSpan, pack: "LocalePack") -> str:
+    return f"{pack.tables['monat'][span.month]} {span.year}" if span.month else str(span.year)
+
+def build_kalender_text(d: int, year: int, month: int = 0, energy: int = 0, lang: str = DEFAULT_LANG) -> str:
+    pack = LOCALES[lang]
+    span = kalender(d, year, month, energy)
+    leap = _is_leap(year)
+    parts = [f"📆 <b>{pack.t('cal_title', period=_kal_period(span, pack), d=d)}</b>"]
+    if month:
+        # сетка Пн–Вс: «ДД·Э», выбранная энергия — «ДД*Э»
+        digits = span.values.translate(_ASCII_DIGITS).decode("ascii")
+        marks = ["·"] * len(digits)
+        for i in span.hits:
+            marks[i - span.start] = "*"
+        cells = ["    "] * datetime(year, month, 1).weekday() + [
+            f"{day:2d}{mark}{e}" for day, mark, e in zip(range(1, len(digits) + 1), marks, digits)]
+        weeks = [" ".join(cells[i:i + 7]) for i in range(0, len(cells), 7)]
+        parts.append("<pre>" + " ".join(f"{w:>4}" for w in pack.t("cal_weekdays").split()) + "\n"
+                     + "\n".join(weeks) + "</pre>")
+    else:
+        # год: по строке цифр на месяц (позиция = число месяца)
+        digits = span.values.translate(_ASCII_DIGITS).decode("ascii")
+        starts = _MONTH_START[leap]
+        parts.append("<pre>" + "\n".join(f"{pack.tables['monat'][m][:3]:<4}{digits[starts[m - 1]:starts[m]]}"
+                                         for m in range(1, 13)) + "</pre>")
+    counts = " · ".join(f"{e}×{span.values.count(e)}" for e in range(1, 10))
+    parts.append(f"📊 <b>{pack.t('cal_distribution')}</b> {counts}")
+    if energy:
+        starts = _MONTH_START[leap]
+        if month:
+            days = ", ".join(str(i - span.start + 1) for i in span.hits) or pack.t("cal_none")
+        else:
+            by_month = []
+            for m in range(1, 13):
+                lo, hi = bisect_left(span.hits, starts[m - 1]), bisect_left(span.hits, starts[m])
+                by_month.append(f"{pack.tables['monat'][m][:3]} " + ",".join(str(i - starts[m - 1] + 1) for i in span.hits[lo:hi]))
+            days = " · ".join(by_month)
+        meaning = pack.tables["tag"].get(energy, "")
+        parts.append(f"⭐ <b>{pack.t('cal_best', e=energy)}</b> ({len(span.hits)}): {days}\n<i>{html_escape(meaning)}</i>")
+    else:
+        parts.append(pack.t("cal_choose"))
+    return "\n\n".join(parts)
+
+def build_kalender_csv(d: int, year: int, month: int = 0, energy: int = 0, lang: str = DEFAULT_LANG) -> bytes:
+    """Datum;Tagesenergie;Bedeutung;Hervorgehoben — все дни периода (разделитель «;»)."""
+    pack = LOCALES[lang]
+    span = kalender(d, year, month, energy)
+    mmdd, hits = _YEAR_MMDD[_is_leap(year)], set(span.hits)
+    meaning = {e: pack.tables["tag"].get(e, "").replace(";", ",") for e in range(1, 10)}
+    rows = [f"{year}-{mmdd[i][:2]}-{mmdd[i][2:]};{e};{meaning[e]};{'x' if i in hits else ''}"
+            for i, e in enumerate(span.values, span.start)]
+    return (pack.t("cal_csv_head") + "\n" + "\n".join(rows) + "\n").encode("utf-8-sig")
+
+def _ics_text(s: str) -> str:
+    return s.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def _ics_fold(line: str) -> str:
+    """RFC 5545: строки длиннее 75 октетов переносятся (CRLF + пробел)."""
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line
+    out, cur = [], ""
+    for ch in line:
+        if len((cur + ch).encode("utf-8")) > (75 if not out else 74):
+            out.append(cur)
+            cur = ""
+        cur += ch
+    out.append(cur)
+    return "\r\n ".join(out)
+
+def build_kalender_ics(d: int, year: int, month: int = 0, energy: int = 0, lang: str = DEFAULT_LANG) -> bytes:
+    """События на весь день: только дни выбранной энергии, без неё — каждый день периода."""
+    pack = LOCALES[lang]
+    span = kalender(d, year, month, energy)
+    mmdd = _YEAR_MMDD[_is_leap(year)] + (f"{year + 1}0101",)  # DTEND последнего дня — 1 января
+    stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    index = span.hits if energy else range(span.start, span.start + len(span.values))
+    # текст события зависит только от энергии — складываем 9 хвостов один раз
+    tail = {e: "\r\n".join((_ics_fold("SUMMARY:" + _ics_text(pack.t("cal_event", e=e))),
+                             _ics_fold("DESCRIPTION:" + _ics_text(pack.tables["tag"].get(e, ""))),
+                             "TRANSP:TRANSPARENT", "END:VEVENT")) for e in range(1, 10)}
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//KeyToFate//Tagesenergie//DE", "CALSCALE:GREGORIAN",
+             _ics_fold("X-WR-CALNAME:" + _ics_text(pack.t("cal_title", period=_kal_period(span, pack), d=d)))]
+    for i in index:
+        e, start, end = span.values[i - span.start], f"{year}{mmdd[i]}", mmdd[i + 1]
+        end = end if len(end) == 8 else f"{year}{end}"
+        lines.append(f"BEGIN:VEVENT\r\nUID:{start}-{d}-{e}@keytofate\r\nDTSTAMP:{stamp}\r\n"
+                     f"DTSTART;VALUE=DATE:{start}\r\nDTEND;VALUE=DATE:{end}\r\n{tail[e]}")
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(lines) + "\r\n").encode("utf-8")
+
+def _kal_code(year: int, month: int) -> str:
+    return f"{year}-{month:02d}" if month else str(year)
+
+def _kal_parse_code(code: str) -> Tuple[int, int]:
+    year, _, month = code.partition("-")
+    return int(year), int(month or 0)
+
+def _kal_shift(year: int, month: int, step: int) -> Tuple[int, int]:
+    if not month:
+        return year + step, 0
+    n = year * 12 + month - 1 + step
+    return n // 12, n % 12 + 1
+
+def kalender_kb(year: int, month: int, energy: int, lang: str = DEFAULT_LANG) -> InlineKeyboardMarkup:
+    pack = LOCALES[lang]
+    code = _kal_code(year, month)
+    energies = [InlineKeyboardButton(f"[{e}]" if e == energy else str(e), callback_data=f"cal:{code}:{0 if e == energy else e}")
+                for e in range(1, 10)]
+    nav = []
+    for step, label in ((-1, "◀️"), (1, "▶️")):
+        y, m = _kal_shift(year, month, step)
+        if KALENDER_YEARS[0] <= y <= KALENDER_YEARS[1]:
+            nav.append(InlineKeyboardButton(label, callback_data=f"cal:{_kal_code(y, m)}:{energy}"))
+    if month:
+        nav.insert(len(nav) // 2, InlineKeyboardButton(f"🗓 {year}", callback_data=f"cal:{year}:{energy}"))
+    return InlineKeyboardMarkup([
+        energies, nav,
+        [InlineKeyboardButton("📄 CSV", callback_data=f"calx:csv:{code}:{energy}"),
+         InlineKeyboardButton(pack.t("btn_ics"), callback_data=f"calx:ics:{code}:{energy}")],
+        [InlineKeyboardButton(pack.t("btn_back"), callback_data="open_menu")],
+    ])
+
+def kalender_start_kb(now: datetime, lang: str = DEFAULT_LANG) -> InlineKeyboardMarkup:
+    pack = LOCALES[lang]
+    ny, nm = _kal_shift(now.year, now.month, 1)
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(pack.t("btn_this_month"), callback_data=f"cal:{_kal_code(now.year, now.month)}:0"),
+         InlineKeyboardButton(pack.t("btn_next_month"), callback_data=f"cal:{_kal_code(ny, nm)}:0")],
+        [InlineKeyboardButton(pack.t("btn_year", year=now.year), callback_data=f"cal:{now.year}:0")],
+        [InlineKeyboardButton(pack.t("btn_back"), callback_data="open_menu")],
+    ])
+
+async def send_kalender(message: Message, d: int, year: int, month: int, energy: int, lang: str = DEFAULT_LANG):
+    await reply_html(message, build_kalender_text(d, year, month, energy, lang),
+                     reply_markup=kalender_kb(year, month, energy, lang))
+
+async def ask_cal(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _touch_user(update, context)
+    text = (update.message.text or "").strip()
+    lang = user_lang(update)
+    pack = LOCALES[lang]
+    try:
+        if DATE_RE.search(text):  # сначала (или заново) дата рождения
+            context.user_data.set_dob(*parse_date(text))
+            await reply_html(update.message, pack.t("cal_prompt"), reply_markup=kalender_start_kb(datetime.now(TAGES_TZ), lang))
+            return ASK_CAL
+        mx = context.user_data.matrix
+        if mx is None:
+            await reply_html(update.message, pack.t("cal_need_dob")); return ASK_CAL
+        m = KAL_RE.match(text)
+        if not m:
+            raise UserError("err_cal_format")
+        month, year, energy = int(m.group(1) or 0), int(m.group(2)), int(m.group(3) or 0)
+        if month > 12 or not KALENDER_YEARS[0] <= year <= KALENDER_YEARS[1]:
+            raise UserError("err_cal_range", y0=KALENDER_YEARS[0], y1=KALENDER_YEARS[1])
+        await send_kalender(update.message, mx.day, year, month, energy, lang)
         return ConversationHandler.END
     except Exception as ex:
-        await update.message.reply_html(f"❌ {html_escape(str(ex))}", reply_markup=back_kb()); return ASK_DAY_BIRTH
+        await reply_html(update.message, f"❌ {html_escape(error_text(ex, pack))}", reply_markup=back_kb(lang)); return ASK_CAL
+
+async def on_cal_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """cal:<JJJJ[-MM]>:<Energie> — Ansicht; calx:<csv|ics>:<JJJJ[-MM]>:<Energie> — Export."""
+    _touch_user(update, context)
+    q = update.callback_query
+    await q.answer()
+    lang = user_lang(update)
+    mx = context.user_data.matrix
+    if mx is None:
+        await reply_html(q.message, LOCALES[lang].t("cal_open_first"), reply_markup=back_kb(lang))
+        return
+    parts = q.data.split(":")
+    fmt = parts.pop(1) if parts[0] == "calx" else None
+    try:
+        (year, month), energy = _kal_parse_code(parts[1]), int(parts[2])
+    except (IndexError, ValueError):
+        return
+    if not KALENDER_YEARS[0] <= year <= KALENDER_YEARS[1] or month > 12 or not 0 <= energy <= 9:
+        return
+    if fmt is None:
+        await send_kalender(q.message, mx.day, year, month, energy, lang)
+        return
+    build = build_kalender_csv if fmt == "csv" else build_kalender_ics
+    name = f"Tagesenergie_{_kal_code(year, month)}" + (f"_E{energy}" if energy else "") + f".{fmt}"
+    await reply_document(q.message, InputFile(build(mx.day, year, month, energy, lang), filename=name),
+                         caption=f"📆 {name}", reply_markup=back_kb(lang))
 
 # ---- Partnerschaft ----
 async def ask_compat1(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _touch_user(update)
+    _touch_user(update, context)
     d1,m1,y1 = parse_date(update.message.text.strip())
-    context.user_data["dob"] = (d1,m1,y1)
-    context.user_data["dob_str"] = f"{d1:02d}.{m1:02d}.{y1}"
-    context.user_data["compat1"]=(d1,m1,y1,update.message.text.strip())
-    await update.message.reply_html("Jetzt <b>Geburtsdatum Person 2</b> eingeben (TT.MM.JJJJ):", reply_markup=back_kb()); return ASK_COMPAT_2
+    context.user_data.set_dob(d1,m1,y1)
+    context.user_data.pending = (d1,m1,y1,update.message.text.strip())
+    METRICS.funnel("compat", "person1")
+    lang = user_lang(update)
+    await reply_html(update.message, LOCALES[lang].t("ask_person2"), reply_markup=back_kb(lang)); return ASK_COMPAT_2
 
 async def ask_compat2(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _touch_user(update)
+    _touch_user(update, context)
     d2,m2,y2 = parse_date(update.message.text.strip())
-    d1,m1,y1,s1 = context.user_data.get("compat1")
-    g1,g2 = geisteszahl(d1), geisteszahl(d2)
+    pack = user_pack(update)
+    pending = context.user_data.pending
+    if not isinstance(pending, tuple):
+        # ввод Person 1 устарел (TTL) или потерян — начинаем заново
+        await reply_html(update.message, pack.t("ask_person1")); return ASK_COMPAT_1
+    d1,m1,y1,s1 = pending
+    g1,g2 = matrix(d1,m1,y1).g, matrix(d2,m2,y2).g
     common = reduzieren_1_9(g1 + g2)
     long_txt = get_partner(common)
+    word = pack.t("geisteszahl")
     header = (
-        "💞 <b>Partnerschaft</b>\n\n"
-        f"<b>Person 1:</b> {s1} → Geisteszahl {g1}\n"
-        f"<b>Person 2:</b> {update.message.text.strip()} → Geisteszahl {g2}\n"
-        f"<b>Gemeinsame Geisteszahl:</b> {common}\n\n"
+        f"💞 <b>{pack.t('compat_title')}</b>\n\n"
+        f"<b>{pack.t('compat_person', n=1)}</b> {s1} → {word} {g1}\n"
+        f"<b>{pack.t('compat_person', n=2)}</b> {update.message.text.strip()} → {word} {g2}\n"
+        f"<b>{pack.t('compat_common')}</b> {common}\n\n"
     )
-    await send_long_html(update, header + (html_escape(long_txt) if long_txt else "(Kein Text in der Datei gefunden.)"), with_back=True)
-    context.user_data.pop("compat1", None)
+    await send_long_html(update, header + (html_escape(long_txt) if long_txt else pack.t("no_text")), with_back=True)
+    METRICS.funnel("compat", "geliefert")
+    context.user_data.pending = None
     return ConversationHandler.END
 
+# ---- Entwicklungspfad ----
+async def ask_path(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _touch_user(update, context)
+    try:
+        d,m,y = parse_date(update.message.text.strip())
+        context.user_data.set_dob(d,m,y)
+        await send_long_html(update, build_entwicklungspfad_text(d, user_lang(update)), with_back=True)
+        return ConversationHandler.END
+    except Exception as ex:
+        lang = user_lang(update)
+        await reply_html(update.message, f"❌ {html_escape(error_text(ex, LOCALES[lang]))}", reply_markup=back_kb(lang)); return ASK_PATH
+
 # ---- Namensenergie ----
 NAME_MAP = {
     **{c:1 for c in "AIJQY"}, **{c:2 for c in "BKR"}, **{c:3 for c in "CLSG"},
     **{c:4 for c in "DMT"}, **{c:5 for c in "EHNX"}, **{c:6 for c in "UVW"},
     **{c:7 for c in "OZ"}, **{c:8 for c in "FP"},
 }
-NAME_DESC = {
-    1:"Führung, Eigenständigkeit, Mut; Name betont Initiative und Sichtbarkeit.",
-    2:"Harmonie, Diplomatie, Kooperation; Name fördert Beziehungen und Takt.",
-    3:"Ausdruck, Lernen, Kreativität; Name stärkt Kommunikation & Medien.",
-    4:"Ordnung, System, Verlässlichkeit; Name gibt Struktur & Ausdauer.",
-    5:"Bewegung, Handel, Netzwerke; Name öffnet Chancen & Kontakte.",
-    6:"Liebe, Fürsorge, Verantwortung; Name zieht Schönheit & Service an.",
-    7:"Weisheit, Analyse, Tiefe; Name führt zu Forschung & Perfektion.",
-    8:"Macht, Management, Ergebnis; Name stärkt Autorität & Finanzen.",
-    9:"Dienst, Großzügigkeit, Abschluss; Name расширяет Herz & гуманизм.",
-}
-
 def normalize_latin(s: str) -> str:
     return (s.replace("Ä","A").replace("Ö","O").replace("Ü","U")
               .replace("ä","a").replace("ö","o").replace("ü","u")
@@ -657,37 +1960,1355 @@ def namensenergie(text: str) -> int:
     return reduzieren(s) if s>0 else 0
 
 async def ask_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _touch_user(update)
+    _touch_user(update, context)
     name = update.message.text.strip()
     val = namensenergie(name)
-    desc = NAME_DESC.get(val, "")
-    await send_long_html(update, f"🔤 <b>Namensenergie</b> „{html_escape(name)}“: <b>{val}</b>\n{html_escape(desc)}", with_back=True)
+    pack = LOCALES[user_lang(update)]
+    desc = pack.tables["name_desc"].get(val, "")
+    await send_long_html(update, f"🔤 <b>{pack.t('name_title')}</b> „{html_escape(name)}“: <b>{val}</b>\n{html_escape(desc)}", with_back=True)
     return ConversationHandler.END
 
 # ---- Gruppenenergie ----
+# Текстом — до GROUP_TEXT_LIMIT дат; большие команды присылают CSV/TXT-файл (по дате
+# в строке, перед датой можно указать имя). Для файла считаем Kollektivenergie,
+# распределение Geisteszahl и полную матрицу Partnerschaft (reduzieren_1_9(g1+g2))
+# через таблицу _PAIR — строк матрицы различается не больше, чем значений Geisteszahl.
+# Файл скачивается в SpooledTemporaryFile (больше GROUP_FILE_SPOOL — на диск) и разбирается
+# построчно; размер ограничен GROUP_FILE_MAX_BYTES (по умолчанию 1 МБ), без известного размера
+# файл не скачиваем. Людей берём не больше GROUP_FILE_MAX_ROWS (по умолчанию 2000 — матрица
+# N×N в CSV ≈ 8 МБ) — остаток файла не читаем, в сводке пишем, что список обрезан.
+GROUP_TEXT_LIMIT     = 5
+GROUP_FILE_MAX_BYTES = int(os.getenv("GROUP_FILE_MAX_BYTES", str(1 << 20)))
+GROUP_FILE_MAX_ROWS  = int(os.getenv("GROUP_FILE_MAX_ROWS", "2000"))
+GROUP_FILE_SPOOL     = 64 * 1024
+
+_PAIR = [[reduzieren_1_9(a + b) for b in range(34)] for a in range(34)]
+# Gemeinsame Geisteszahl от «сильной» к «слабой» — по текстам раздела в книге
+# (3, 6, 9 — дружба/гармония; 1 и 4 — высокий риск разрыва)
+PARTNER_RANG = (3, 6, 9, 2, 5, 8, 7, 1, 4)
+
+Person = Tuple[str, int, int, int]  # (имя/метка, день, месяц, год)
+
+def parse_group_stream(lines) -> Tuple[List[Person], int, bool]:
+    """Построчный разбор CSV/TXT: (люди, число пропущенных строк с неверной датой,
+    обрезан ли список на GROUP_FILE_MAX_ROWS)."""
+    persons: List[Person] = []
+    skipped = 0
+    for line in lines:
+        m = DATE_RE.search(line)
+        if not m:
+            continue
+        d, mth, yr = int(m.group(1)), int(m.group(2)), int(m.group(3))
+        try:
+            datetime(year=yr, month=mth, day=d)
+        except ValueError:
+            skipped += 1
+            continue
+        if len(persons) >= GROUP_FILE_MAX_ROWS:
+            return persons, skipped, True
+        label = re.sub(r'[;,"\t]+', " ", line[:m.start()]).strip() or f"P{len(persons) + 1}"
+        persons.append((label[:40], d, mth, yr))
+    return persons, skipped, False
+
+def _group_pairs(geistes: List[int]):
+    """Распределение общих чисел по всем парам и примеры пар для каждого числа."""
+    by_g: Dict[int, List[int]] = {}
+    for i, g in enumerate(geistes):
+        by_g.setdefault(g, []).append(i)
+    dist: Dict[int, int] = {}
+    example: Dict[int, List[Tuple[int, int]]] = {}
+    values = sorted(by_g)
+    for ai, a in enumerate(values):
+        for b in values[ai:]:
+            ca, cb = len(by_g[a]), len(by_g[b])
+            n = ca * (ca - 1) // 2 if a == b else ca * cb
+            if not n:
+                continue
+            c = _PAIR[a][b]
+            dist[c] = dist.get(c, 0) + n
+            ex = example.setdefault(c, [])
+            if len(ex) < 5:
+                ia, ib = by_g[a], by_g[b]
+                pairs = ([(ia[i], ia[j]) for i in range(len(ia)) for j in range(i + 1, min(len(ia), i + 6))]
+                         if a == b else [(x, y) for x in ia[:5] for y in ib[:5]])
+                ex.extend(pairs[:5 - len(ex)])
+    return dist, example
+
+def _person_dates(persons: List[Person]) -> Tuple[List[int], List[int], List[int]]:
+    return [p[1] for p in persons], [p[2] for p in persons], [p[3] for p in persons]
+
+def build_group_text(persons: List[Person], list_persons: bool = True, lang: str = DEFAULT_LANG) -> str:
+    pack = LOCALES[lang]
+    geistes = numerology_batch(*_person_dates(persons))[0]
+    kollektiv = reduzieren_1_9(sum(geistes))
+    txt = pack.tables["kollektiv"].get(kollektiv, pack.t("group_default"))
+    parts = [f"👥 <b>{pack.t('group_title')}</b>" + ("" if list_persons else f" ({pack.t('group_persons', n=len(persons))})")]
+    if list_persons:
+        word = pack.t("geisteszahl")
+        parts.append("\n".join(f"• {d:02d}.{m:02d}.{y} → {word} {g}" for (_, d, m, y), g in zip(persons, geistes)))
+    parts.append(f"<b>{pack.t('group_number')}</b> {kollektiv}")
+    parts.append(html_escape(txt))
+
+    counts: Dict[int, int] = {}
+    for g in geistes:
+        counts[g] = counts.get(g, 0) + 1
+    dist, example = _group_pairs(geistes)
+    if not list_persons:
+        parts.append(f"🧠 <b>{pack.t('group_distribution')}</b> " + " · ".join(f"{g}: {counts[g]}" for g in sorted(counts)))
+    parts.append(f"💞 <b>{pack.t('group_pairs', n=sum(dist.values()))}</b> "
+                 + " · ".join(f"{c}: {dist[c]}" for c in sorted(dist)))
+    present = [c for c in PARTNER_RANG if c in dist]
+    if len(present) > 1:
+        def names(c: int) -> str:
+            return ", ".join(f"{html_escape(persons[i][0])} + {html_escape(persons[j][0])}" for i, j in example[c])
+        parts.append(f"💪 <b>{pack.t('group_strongest')}</b> ({pack.t('partner_geisteszahl', c=present[0])}): {names(present[0])}")
+        parts.append(f"⚠️ <b>{pack.t('group_weakest')}</b> ({pack.t('partner_geisteszahl', c=present[-1])}): {names(present[-1])}")
+    return "\n\n".join(parts)
+
+def _csv_cell(text: str) -> str:
+    """Метка из чужого файла: «=», «+», «-», «@» в начале Excel/LibreOffice приняли бы за формулу."""
+    return "'" + text if text[:1] in ("=", "+", "-", "@") else text
+
+def build_group_matrix_csv(persons: List[Person]) -> bytes:
+    """N×N матрица Gemeinsame Geisteszahl (разделитель «;»)."""
+    geistes = numerology_batch(*_person_dates(persons))[0]
+    rows = {g: ";".join(str(_PAIR[g][x]) for x in geistes) for g in set(geistes)}
+    labels = [_csv_cell(p[0]) for p in persons]
+    out = io.StringIO()
+    out.write("Person;Geburtsdatum;Geisteszahl;" + ";".join(labels) + "\n")
+    for label, (_, d, m, y), g in zip(labels, persons, geistes):
+        out.write(f"{label};{d:02d}.{m:02d}.{y};{g};{rows[g]}\n")
+    return out.getvalue().encode("utf-8-sig")
+
 async def ask_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    _touch_user(update)
+    _touch_user(update, context)
     text = (update.message.text or "").strip()
-    if text.lower() == "fertig":
-        group = context.user_data.get("group_birthdays", [])
+    lang = user_lang(update)
+    pack = LOCALES[lang]
+    done = pack.t("group_done_word")
+    if text.lower() in (done, LOCALES[DEFAULT_LANG].t("group_done_word")):
+        group = context.user_data.pending if isinstance(context.user_data.pending, list) else []
         if len(group) < 2:
-            await update.message.reply_html("❌ Mindestens 2 Personen.", reply_markup=back_kb()); return ASK_GROUP
-        geistes_list = [geisteszahl(d) for d,_,_ in group]
-        kollektiv = reduzieren_1_9(sum(geistes_list))
-        personen = "\n".join(f"• {d:02d}.{m:02d}.{y} → Geisteszahl {g}" for (d,m,y),g in zip(group,geistes_list))
-        txt = KOLLEKTIV_TXT.get(kollektiv, "Dieses Kollektiv entfaltet eine besondere Dynamik und Lernaufgabe.")
-        await send_long_html(update, f"👥 <b>Gruppenenergie</b>\n\n{personen}\n\n<b>Zahl:</b> {kollektiv}\n\n{html_escape(txt)}", with_back=True)
+            await reply_html(update.message, pack.t("group_min"), reply_markup=back_kb(lang)); return ASK_GROUP
+        persons = [(f"{d:02d}.{m:02d}.{y}", d, m, y) for d, m, y in group]
+        await send_long_html(update, build_group_text(persons, lang=lang), with_back=True)
+        METRICS.funnel("group", "geliefert")
+        context.user_data.pending = None
         return ConversationHandler.END
 
-    parsed = parse_dates_multi(text)
-    group = context.user_data.setdefault("group_birthdays", [])
-    group.extend(parsed)
-    await update.message.reply_html(f"✅ Hinzugefügt: {len(parsed)}. Tippen Sie <b>fertig</b>.", reply_markup=back_kb()); return ASK_GROUP
+    if not isinstance(context.user_data.pending, list):
+        context.user_data.pending = []
+    group = context.user_data.pending
+    # повторно присланные даты (в том числе внутри одной вставки) схлопываем
+    raw = parse_dates_multi(text)
+    parsed = list(dict.fromkeys(p for p in raw if p not in group))
+    doubles = len(raw) - len(parsed)
+    FLOOD.drops["group_dup"] += doubles
+    free = GROUP_TEXT_LIMIT - len(group)
+    group.extend(parsed[:max(0, free)])
+    if len(parsed) > free:
+        await reply_html(update.message, pack.t("group_added_max", n=max(0, free), limit=GROUP_TEXT_LIMIT,
+                                                kb=GROUP_FILE_MAX_BYTES // 1024, done=done), reply_markup=back_kb(lang))
+        return ASK_GROUP
+    note = pack.t("group_doubles", n=doubles) if doubles else ""
+    await reply_html(update.message, pack.t("group_added", n=len(parsed), note=note, done=done), reply_markup=back_kb(lang))
+    return ASK_GROUP
+
+async def ask_group_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _touch_user(update, context)
+    doc = update.message.document
+    lang = user_lang(update)
+    pack = LOCALES[lang]
+    too_big = pack.t("file_too_big", kb=GROUP_FILE_MAX_BYTES // 1024)
+    if doc.file_size and doc.file_size > GROUP_FILE_MAX_BYTES:
+        await reply_html(update.message, too_big, reply_markup=back_kb(lang))
+        return ASK_GROUP
+    tg_file = await doc.get_file()
+    if not tg_file.file_size or tg_file.file_size > GROUP_FILE_MAX_BYTES:  # размер неизвестен — не качаем вслепую
+        await reply_html(update.message, too_big, reply_markup=back_kb(lang))
+        return ASK_GROUP
+    with tempfile.SpooledTemporaryFile(max_size=GROUP_FILE_SPOOL) as buf:
+        await tg_file.download_to_memory(buf)
+        buf.seek(0)
+        lines = io.TextIOWrapper(buf, encoding="utf-8-sig", errors="replace")
+        persons, skipped, truncated = parse_group_stream(lines)
+        lines.detach()
+    if len(persons) < 2:
+        await reply_html(update.message, pack.t("file_few"), reply_markup=back_kb(lang))
+        return ASK_GROUP
+    summary = build_group_text(persons, list_persons=False, lang=lang)
+    if skipped:
+        summary += "\n\n" + pack.t("file_skipped", n=skipped)
+    if truncated:
+        summary += "\n\n" + pack.t("file_truncated", n=GROUP_FILE_MAX_ROWS)
+    await send_long_html(update, summary, with_back=False)
+    await reply_document(update.message, InputFile(build_group_matrix_csv(persons), filename="partnerschaft_matrix.csv"),
+                         caption=pack.t("matrix_caption"), reply_markup=back_kb(lang))
+    METRICS.funnel("group", "geliefert")
+    context.user_data.pending = None
+    return ConversationHandler.END
+
+# ---- Inline-Modus ----
+# «@bot 25.11.1978» в любом чате. Запросы приходят на каждое нажатие клавиши, поэтому
+# неполный ввод не отвечаем вовсе (дебаунс), а готовые результаты берём из LRU по
+# (день, Geldcode, сегодня): в заголовке только день и Geldcode, полная дата не нужна.
+# Vollanalyse в inline ограничена 4096 символами — даём начало и кнопку в бот.
+INLINE_MAX_TEXT   = 3800
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "3600"))
+
+def _inline_cut(text: str, limit: int = INLINE_MAX_TEXT) -> str:
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n\n", 0, limit)
+    return text[:cut if cut > 0 else limit].rstrip() + "\n\n…"
+
+_INLINE_FULL_FRAGMENTS: Dict[int, str] = {d: _inline_cut(_FULL_FRAGMENTS[d]) for d in range(1, 32)}
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _inline_results(d: int, geld: str, day: int, month: int, year: int, bot_username: str,
+                    lang: str = DEFAULT_LANG) -> tuple:
+    pack = LOCALES[lang]
+    kb = (InlineKeyboardMarkup([[InlineKeyboardButton("📖 " + pack.t("inline_open_bot"), url=f"https://t.me/{bot_username}")]])
+          if bot_username else None)
+    g = geisteszahl(d)
+    frag = _INLINE_FULL_FRAGMENTS[d] if lang == DEFAULT_LANG else _inline_cut(_lang_fragment("full", lang, d))
+    full = (f"<b>{pack.t('doc_title', d=d, geld=geld)}</b>\n\n"
+            f"💰 <b>{pack.t('geldcode')}:</b> <code>{geld}</code>\n\n{frag}")
+    return (
+        InlineQueryResultArticle(
+            id=f"full-{d}-{geld}", title="🧮 " + pack.t("inline_full", g=g),
+            description=pack.t("inline_full_desc", d=d, geld=geld),
+            input_message_content=InputTextMessageContent(full, parse_mode="HTML"), reply_markup=kb),
+        InlineQueryResultArticle(
+            id=f"tag-{d}-{year}{month:02d}{day:02d}", title="📅 " + pack.t("tages_title", date=f"{day:02d}.{month:02d}.{year}"),
+            description=pack.t("inline_tag_desc", e=tagesenergie(d, day), d=d),
+            input_message_content=InputTextMessageContent(_tagesenergie_text(d, day, month, year, lang), parse_mode="HTML")),
+        InlineQueryResultArticle(
+            id=f"pfad-{d}", title="🧭 " + pack.t("inline_pfad", g=g),
+            description=pack.tables["pfad"].get(g, "")[:60],
+            input_message_content=InputTextMessageContent(build_entwicklungspfad_text(d, lang), parse_mode="HTML")),
+    )
+
+def _inline_cache_time(now: datetime) -> int:
+    """Результаты меняются только в полночь (Tagesenergie) — кэшируем до неё."""
+    left = 86400 - (now.hour * 3600 + now.minute * 60 + now.second)
+    return max(1, min(INLINE_CACHE_TIME, left))
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.inline_query
+    text = q.query.strip()
+    if not text:
+        await q.answer([], cache_time=INLINE_CACHE_TIME, button=InlineQueryResultsButton(
+            "Geburtsdatum eingeben: TT.MM.JJJJ", start_parameter="inline"))
+        return
+    m = DATE_RE.search(text)
+    if not m:
+        return  # ввод ещё не дописан — ждём следующего запроса
+    d, mth, yr = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    try:
+        datetime(year=yr, month=mth, day=d)
+    except ValueError:
+        await q.answer([], cache_time=INLINE_CACHE_TIME, button=InlineQueryResultsButton(
+            "Ungültiges Datum – Format TT.MM.JJJJ", start_parameter="inline"))
+        return
+    now = datetime.now(TAGES_TZ)
+    mx = matrix(d, mth, yr)
+    results = _inline_results(mx.day, mx.geld, now.day, now.month, now.year, context.bot.username or "",
+                              LOCALES.pick(q.from_user.language_code))
+    await q.answer(results, cache_time=_inline_cache_time(now))
+
+# ---- Suche ----
+SEARCH_LIMIT = 5
+
+async def suche(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _touch_user(update, context)
+    query = " ".join(context.args or ()).strip()
+    lang = user_lang(update)
+    pack = LOCALES[lang]
+    if not query:
+        await reply_html(update.message, pack.t("suche_usage"))
+        return
+    hits = SEARCH.query(query, SEARCH_LIMIT)
+    if not hits:
+        await reply_html(update.message, pack.t("suche_none", q=html_escape(query)), reply_markup=back_kb(lang))
+        return
+    parts = ["🔎 " + pack.t("suche_head", q=html_escape(query))]
+    parts += [f"📖 <b>{section_ref(h.kind, h.n, h.day)}</b>\n{h.snippet}" for h in hits]
+    await send_long_html(update, "\n\n".join(parts), with_back=True)
+
+# ---- KI-Modus ----
+# Бэкенд — async-генератор кусков HTML-текста: backend(вопрос, профиль) → AsyncIterator[str].
+# Регистрируются через @ki_backend("имя"), выбирается KI_BACKEND. Встроенный «lokal» —
+# детерминированный поиск по книге (SEARCH) с приоритетом разделов по числам пользователя.
+# Один и тот же вопрос (нормализованные термины + профиль) генерируется один раз: остальные
+# подписываются на тот же KiAnswer; готовые ответы лежат в LRU. Ответ виден по мере
+# генерации — сообщение редактируется не чаще KI_EDIT_INTERVAL. На пользователя — не больше
+# KI_USER_LIMIT вопросов одновременно: ChatSerialUpdateProcessor ведёт по одному апдейту на
+# чат, а не на человека (личка + группы). Счётчик — в процессе воркера.
+KI_BACKEND       = os.getenv("KI_BACKEND", "lokal").strip()
+KI_EDIT_INTERVAL = float(os.getenv("KI_EDIT_INTERVAL", "1.0"))
+KI_CACHE_SIZE    = int(os.getenv("KI_CACHE_SIZE", "256"))
+KI_GLOBAL_LIMIT  = int(os.getenv("KI_GLOBAL_LIMIT", "4"))
+KI_USER_LIMIT    = 1
+KI_HITS          = 3
+
+KiProfile = Tuple[int, int, int] | None  # (Geisteszahl, Handlungszahl, Verwirklichungszahl)
+KI_BACKENDS: Dict[str, Callable[[str, KiProfile], AsyncIterator[str]]] = {}
+KI_STATS: Dict[str, int] = {"fragen": 0, "cache": 0, "gebündelt": 0, "abgewiesen": 0, "fehler": 0}
+
+def ki_backend(name: str):
+    def register(fn):
+        KI_BACKENDS[name] = fn
+        return fn
+    return register
+
+@ki_backend("lokal")
+async def _ki_lokal(question: str, profile: KiProfile) -> AsyncIterator[str]:
+    """Абзацы книги по BM25; разделы, совпадающие с числами пользователя, — выше."""
+    own = {("geistes", profile[0]), ("handlungs", profile[1]), ("verwirk", profile[2])} if profile else set()
+    ranked = sorted(((score * (1.5 if SEARCH.docs[doc][:2] in own else 1.0), doc)
+                     for score, doc in SEARCH.search(question, 20)), reverse=True)[:KI_HITS]
+    yield "🤖 <b>KI-Modus</b> (lokal, Antworten aus dem Buch)\n\n"
+    if profile:
+        yield (f"Ihr Profil: Geisteszahl {profile[0]}, Handlungszahl {profile[1]}, "
+               f"Verwirklichungszahl {profile[2]}.\n\n")
+    if not ranked:
+        yield "Dazu habe ich im Buch nichts gefunden. Versuchen Sie andere Begriffe, z. B. Beruf, Beziehungen oder Geld."
+        return
+    for _, doc in ranked:
+        kind, n, day, start, end = SEARCH.docs[doc]
+        yield f"📖 <b>{section_ref(kind, n, day)}</b>\n"
+        text = " ".join(SEARCH.text(kind, n)[start:end].split())
+        for sentence in re.split(r"(?<=[.!?])\s+", text):
+            yield html_escape(sentence) + " "
+            await asyncio.sleep(0)  # отдаём loop между предложениями
+        yield "\n\n"
+
+class KiAnswer:
+    """Общий для всех подписчиков ответ: растущий текст + признак завершения."""
+    __slots__ = ("text", "done", "task")
+
+    def __init__(self, text: str = ""):
+        self.text = text
+        self.done = asyncio.Event()
+        self.task = None
+
+_KI_CACHE: "OrderedDict[tuple, str]" = OrderedDict()
+_KI_INFLIGHT: Dict[tuple, KiAnswer] = {}
+_KI_USERS: Dict[int, int] = {}
+_KI_SEM = asyncio.Semaphore(KI_GLOBAL_LIMIT)
+
+def ki_key(question: str, profile: KiProfile) -> tuple:
+    terms = " ".join(t for t in map(search_term, WORD_RE.findall(question)) if t)
+    return terms or " ".join(question.lower().split()), profile
+
+async def _ki_generate(key: tuple, question: str, profile: KiProfile, ans: KiAnswer):
+    backend = KI_BACKENDS.get(KI_BACKEND) or KI_BACKENDS["lokal"]
+    try:
+        async with _KI_SEM:
+            async for piece in backend(question, profile):
+                ans.text += piece
+        _KI_CACHE[key] = ans.text
+        while len(_KI_CACHE) > KI_CACHE_SIZE:
+            _KI_CACHE.popitem(last=False)
+    except Exception as e:
+        KI_STATS["fehler"] += 1
+        print(f"[WARN] KI backend {KI_BACKEND}: {e!r}")
+        ans.text += "\n\n❌ Die Antwort konnte nicht vollständig erstellt werden."
+    finally:
+        _KI_INFLIGHT.pop(key, None)
+        ans.done.set()
+
+def ki_answer(question: str, profile: KiProfile) -> KiAnswer:
+    KI_STATS["fragen"] += 1
+    key = ki_key(question, profile)
+    cached = _KI_CACHE.get(key)
+    if cached is not None:
+        _KI_CACHE.move_to_end(key)
+        KI_STATS["cache"] += 1
+        ans = KiAnswer(cached)
+        ans.done.set()
+        return ans
+    ans = _KI_INFLIGHT.get(key)
+    if ans is not None:
+        KI_STATS["gebündelt"] += 1
+        return ans
+    ans = _KI_INFLIGHT[key] = KiAnswer()
+    ans.task = asyncio.create_task(_ki_generate(key, question, profile, ans))
+    return ans
+
+async def stream_ki_reply(message: Message, ans: KiAnswer, lang: str = DEFAULT_LANG):
+    """Плейсхолдер, затем правки по мере роста текста; хвост длиннее лимита — отдельными сообщениями."""
+    placeholder = await reply_html(message, "🤖 …")
+    shown = ""
+    while not ans.done.is_set():
+        try:
+            await asyncio.wait_for(ans.done.wait(), KI_EDIT_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        if ans.done.is_set():
+            break
+        part = split_html_chunks(ans.text)[:1]
+        if part and part[0] != shown:
+            shown = part[0]
+            try:
+                await OUTBOUND.call(message.chat_id, lambda: placeholder.edit_text(shown + " ▌", parse_mode="HTML"))
+            except BadRequest:
+                pass
+    chunks = split_html_chunks(ans.text) or ["🤖 (keine Antwort)"]
+    markup = back_kb(lang) if len(chunks) == 1 else None
+    try:
+        await OUTBOUND.call(message.chat_id, lambda: placeholder.edit_text(chunks[0], parse_mode="HTML", reply_markup=markup))
+    except BadRequest:
+        pass
+    for i, c in enumerate(chunks[1:], 2):
+        await reply_html(message, c, reply_markup=back_kb(lang) if i == len(chunks) else None)
+
+def ki_stats_line() -> str:
+    return (", ".join(f"{k} {v}" for k, v in KI_STATS.items())
+            + f", Cache {len(_KI_CACHE)}/{KI_CACHE_SIZE}, aktiv {len(_KI_INFLIGHT)}")
+
+async def ask_ki(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _touch_user(update, context)
+    question = (update.message.text or "").strip()
+    uid = update.effective_user.id
+    if _KI_USERS.get(uid, 0) >= KI_USER_LIMIT:
+        KI_STATS["abgewiesen"] += 1
+        await reply_html(update.message, user_pack(update).t("ki_busy"))
+        return ASK_KI
+    mx = context.user_data.matrix
+    profile = (mx.g, mx.h, mx.v) if mx else None
+    _KI_USERS[uid] = _KI_USERS.get(uid, 0) + 1
+    try:
+        await stream_ki_reply(update.message, ki_answer(question, profile), user_lang(update))
+    finally:
+        _KI_USERS[uid] -= 1
+        if not _KI_USERS[uid]:
+            del _KI_USERS[uid]
+    return ASK_KI
+
+# ---- Профилирование по команде админа ----
+# /profil [N] — cProfile на N секунд на живом процессе (поток event loop) плюс замер
+# задержки loop: задача спит PROFILE_TICK и меряет, насколько проснулась позже.
+# Пока команду не вызвали, ничего не установлено — цена в обычной работе нулевая.
+PROFILE_DEFAULT_SEC = 30
+PROFILE_MAX_SEC     = 300
+PROFILE_TICK        = 0.05
+PROFILE_TOP         = 25
+_PROFILE_TASK: asyncio.Task | None = None
+
+async def _loop_lag(stop: asyncio.Event) -> List[float]:
+    lags = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(PROFILE_TICK)
+        lags.append(max(0.0, time.perf_counter() - t0 - PROFILE_TICK))
+    return lags
+
+def _profile_report(prof: cProfile.Profile, secs: float, lags: List[float]) -> str:
+    out = io.StringIO()
+    stats = pstats.Stats(prof, stream=out).strip_dirs().sort_stats("cumulative")
+    stats.print_stats(PROFILE_TOP)
+    table = out.getvalue()
+    table = table[table.find("   ncalls"):] if "   ncalls" in table else table
+    lags = sorted(lags) or [0.0]
+    p95 = lags[min(len(lags) - 1, int(0.95 * len(lags)))]
+    head = (f"🔬 <b>Profil {secs:.0f} s</b>: {stats.total_calls} Funktionsaufrufe im Loop-Thread\n"
+            f"⏳ Loop-Lag: Ø {1000 * sum(lags) / len(lags):.1f} ms, p95 {1000 * p95:.1f} ms, "
+            f"max {1000 * lags[-1]:.1f} ms ({len(lags)} Messungen)\n\n")
+    lines = [html_escape(line) for line in table.rstrip().splitlines()]
+    while lines and len(head) + sum(len(x) + 1 for x in lines) > 3900:
+        lines.pop()  # в одно сообщение, не разрывая HTML
+    return head + "<pre>" + "\n".join(lines) + "</pre>"
+
+async def _run_profile(message: Message, secs: int):
+    global _PROFILE_TASK
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(_loop_lag(stop))
+    prof = cProfile.Profile()
+    t0 = time.perf_counter()
+    prof.enable()
+    try:
+        await asyncio.sleep(secs)
+    finally:
+        prof.disable()
+        stop.set()
+        lags = await lag_task
+        _PROFILE_TASK = None
+    elapsed = time.perf_counter() - t0
+    text = _profile_report(prof, elapsed, lags)
+    await reply_html(message, text)
+    prof.create_stats()
+    name = f"keytofate-{datetime.now():%Y%m%d-%H%M%S}.prof"
+    await reply_document(message, InputFile(marshal.dumps(prof.stats), filename=name),
+                         caption="pstats-Datei: python -m pstats " + name)
+
+async def profil(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    global _PROFILE_TASK
+    if update.effective_user.id != ADMIN_ID:
+        return
+    if _PROFILE_TASK is not None:
+        await reply_html(update.message, "🔬 Profiler läuft bereits.")
+        return
+    try:
+        secs = int(context.args[0]) if context.args else PROFILE_DEFAULT_SEC
+    except ValueError:
+        secs = PROFILE_DEFAULT_SEC
+    secs = max(1, min(PROFILE_MAX_SEC, secs))
+    # в фоне, чтобы очередь чата админа не стояла N секунд
+    _PROFILE_TASK = context.application.create_task(_run_profile(update.message, secs))
+    await reply_html(update.message, f"🔬 Profiler an für {secs} s …")
+
+# ============================ Хранилище (SQLite) =============================
+PERSISTENCE_DB    = os.getenv("PERSISTENCE_DB", "keytofate.db").strip()
+PERSIST_BATCH     = int(os.getenv("PERSIST_BATCH", "50"))
+PERSIST_FLUSH_SEC = float(os.getenv("PERSIST_FLUSH_SEC", "10"))
+# WORKERS>1: супервизор и N процессов-воркеров с общим файлом PERSISTENCE_DB (см. «Шардирование»).
+WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+SHARD: Tuple[int, int] = (0, 1)   # (номер воркера, всего) — задаётся в процессе воркера
+SHARED_STORE = None               # SqlitePersistence воркера, если воркеров больше одного
+
+def shard_of(key: int, shards: int) -> int:
+    """Воркер для user/chat id — одинаковый в супервизоре и во всех воркерах."""
+    return zlib.crc32(key.to_bytes(8, "little", signed=True)) % shards if shards > 1 else 0
+
+def user_total() -> int:
+    """Пользователи всех воркеров: при шардировании — из общей БД, иначе реестр USERS."""
+    return SHARED_STORE.count_users() if SHARED_STORE is not None else len(USERS)
+
+class SqlitePersistence(BasePersistence):
+    """
+    user_data, bot_data (вкл. реестр USERS) и состояния диалогов в SQLite (WAL).
+    Application сам вызывает update_* раз в update_interval; здесь изменения ещё копятся
+    в буфере (повторные записи одного ключа схлопываются) и уходят одной транзакцией,
+    когда набралось `batch` ключей или прошло `flush_sec` секунд. Запись — в отдельном
+    потоке, так что обработчики на диск не ждут.
+    Словари в bot_data хранятся по элементу (таблица bot_items): строка на chat id
+    или другой ключ, пишутся только изменившиеся элементы. Значения элементов — неизменяемые
+    (int, str, tuple): изменения ищем сравнением со снимком.
+    shard=(i, n): воркер i из n делит файл с остальными — читает только своих пользователей,
+    диалоги (по chat id, как маршрутизирует супервизор) и элементы bot_data с int-ключом
+    (chat id) по shard_of; элементы со строковым ключом (file_id документов) и реестр users
+    общие. От n хранение не зависит: при смене WORKERS чаты просто достаются другим воркерам.
+    В группах пользователя обслуживает воркер чата, поэтому профиль перед каждым апдейтом
+    сверяется с базой (refresh_user_data): берётся версия с более поздним seen.
+    Чтения на event loop — через отдельное соединение только для чтения.
+    """
+
+    def __init__(self, path: str, batch: int = PERSIST_BATCH, flush_sec: float = PERSIST_FLUSH_SEC,
+                 shard: Tuple[int, int] = (0, 1)):
+        super().__init__(store_data=PersistenceInput(chat_data=False, callback_data=False),
+                         update_interval=flush_sec)
+        self.path, self.batch, self.flush_sec, self.shard = path, max(1, batch), flush_sec, shard
+        # timeout — ожидание блокировки, когда в тот же файл пишут другие воркеры
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS bot_data (key TEXT PRIMARY KEY, data BLOB)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS bot_items (key TEXT, item, data BLOB, PRIMARY KEY (key, item))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS conversations "
+                             "(name TEXT, key TEXT, state BLOB, PRIMARY KEY (name, key))")
+        self._migrate_bot_data()
+        self._read = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True, timeout=30)
+        self._pending: Dict[tuple, object] = {}
+        self._writing: Dict[tuple, object] = {}  # пачка, которую сейчас пишет поток
+        self._bot_blobs: Dict[str, bytes] = {}
+        self._bot_items: Dict[str, dict] = {}  # снимок словарей bot_data на момент последней записи
+        self._known_users: Set[int] = set()
+        self._last_flush = time.monotonic()
+        self._write_lock = asyncio.Lock()
+        self.transactions = 0
+
+    def _mine(self, key: int) -> bool:
+        return shard_of(key, self.shard[1]) == self.shard[0]
+
+    def _mine_item(self, item) -> bool:
+        return not isinstance(item, int) or self._mine(item)
+
+    def _migrate_bot_data(self):
+        """Старый формат: словарь целиком в bot_data, при шардах — по ключу "key@i/n".
+        Раскладываем по элементам один раз (первый стартовавший воркер, под записью)."""
+        with self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            for key, blob in self._db.execute("SELECT key, data FROM bot_data").fetchall():
+                value = pickle.loads(blob)
+                if not isinstance(value, dict):
+                    continue
+                if isinstance(value.get("date"), str) and key.split("@")[0] == "tages_push":
+                    value = {}  # прогресс рассылки старого вида — не по чатам, просто начинаем день заново
+                self._db.executemany("INSERT OR REPLACE INTO bot_items VALUES (?, ?, ?)",
+                                     [(key.split("@")[0], item, pickle.dumps(v)) for item, v in value.items()])
+                self._db.execute("DELETE FROM bot_data WHERE key = ?", (key,))
+
+    def count_users(self) -> int:
+        """Все пользователи всех воркеров, включая ещё не записанных этим воркером (буфер и
+        пачку в записи) — без двойного счёта тех, кого уже записал кто-то другой."""
+        fresh = list({key[1] for ops in (self._pending, self._writing) for key in ops if key[0] == "users"})
+        self._read.execute("BEGIN")  # один снимок WAL на оба запроса
+        try:
+            (total,) = self._read.execute("SELECT COUNT(*) FROM users").fetchone()
+            for i in range(0, len(fresh), 500):
+                part = fresh[i:i + 500]
+                (known,) = self._read.execute(
+                    f"SELECT COUNT(*) FROM users WHERE user_id IN ({','.join('?' * len(part))})", part).fetchone()
+                total += len(part) - known
+        finally:
+            self._read.execute("COMMIT")
+        return total
+
+    # ---- чтение (один раз при старте) ----
+    async def get_user_data(self) -> Dict[int, "UserProfile"]:
+        rows = self._db.execute("SELECT user_id, data FROM user_data").fetchall()
+        out = {}
+        for uid, blob in rows:
+            if not self._mine(uid):
+                continue
+            data = pickle.loads(blob)
+            out[uid] = UserProfile.from_dict(data) if isinstance(data, dict) else data
+        return out
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        rows = self._db.execute("SELECT key, data FROM bot_data").fetchall()
+        data = {key: pickle.loads(blob) for key, blob in rows}
+        self._bot_blobs = dict(rows)
+        for key, item, blob in self._db.execute("SELECT key, item, data FROM bot_items"):
+            if self._mine_item(item):
+                data.setdefault(key, {})[item] = pickle.loads(blob)
+        self._bot_items = {key: dict(v) for key, v in data.items() if isinstance(v, dict)}
+        self._known_users = {uid for (uid,) in self._db.execute("SELECT user_id FROM users")}
+        data["users"] = set(self._known_users)
+        return data
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        """Ключ диалога — (chat, user); владелец — воркер чата (в личке chat == user)."""
+        rows = self._db.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        convs = {tuple(json.loads(key)): state for key, state in rows}
+        return {key: pickle.loads(state) for key, state in convs.items() if self._mine(key[0])}
+
+    # ---- запись (через буфер) ----
+    async def update_user_data(self, user_id: int, data: "UserProfile") -> None:
+        self._pending[("user", user_id)] = pickle.dumps(data)
+        await self._maybe_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if self._mine(user_id):  # чужой профиль (зашёл через группу) забываем только в памяти
+            self._pending[("user", user_id)] = None
+            await self._maybe_flush()
+
+    async def update_bot_data(self, data: dict) -> None:
+        for key, value in data.items():
+            if key == "users":
+                for uid in value - self._known_users:
+                    self._pending[("users", uid)] = True
+                self._known_users |= value
+                continue
+            if isinstance(value, dict):
+                old = self._bot_items.get(key, {})
+                if value == old:
+                    continue
+                for item, v in value.items():
+                    if item not in old or old[item] != v:
+                        self._pending[("item", key, item)] = pickle.dumps(v)
+                for item in old.keys() - value.keys():
+                    self._pending[("item", key, item)] = None
+                self._bot_items[key] = dict(value)
+                continue
+            blob = pickle.dumps(value)
+            if self._bot_blobs.get(key) != blob:
+                self._bot_blobs[key] = blob
+                self._pending[("bot", key)] = blob
+        await self._maybe_flush()
+
+    async def update_conversation(self, name: str, key: tuple, new_state: object) -> None:
+        self._pending[("conv", name, json.dumps(list(key)))] = None if new_state is None else pickle.dumps(new_state)
+        await self._maybe_flush()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None: pass
+    async def drop_chat_data(self, chat_id: int) -> None: pass
+    async def update_callback_data(self, data) -> None: pass
+    async def refresh_user_data(self, user_id: int, user_data: "UserProfile") -> None:
+        if self.shard[1] == 1 or ("user", user_id) in self._pending or ("user", user_id) in self._writing:
+            return  # один воркер — память и так новее базы; своя незаписанная версия новее
+        row = self._read.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return
+        data = pickle.loads(row[0])
+        stored = UserProfile.from_dict(data) if isinstance(data, dict) else data
+        if stored.seen > user_data.seen:
+            user_data.__setstate__(stored.__getstate__())
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None: pass
+    async def refresh_bot_data(self, bot_data: dict) -> None: pass
+
+    async def sync(self) -> None:
+        """Записать буфер сейчас, не закрывая базу."""
+        await self._maybe_flush(force=True)
+
+    async def flush(self) -> None:
+        await self.sync()
+        self._read.close()
+        self._db.close()
+
+    async def _maybe_flush(self, force: bool = False):
+        if not self._pending:
+            return
+        if not force and len(self._pending) < self.batch and time.monotonic() - self._last_flush < self.flush_sec:
+            return
+        async with self._write_lock:
+            ops, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            if ops:
+                self._writing = ops
+                try:
+                    await asyncio.to_thread(self._write, ops)
+                finally:
+                    self._writing = {}
+
+    def _write(self, ops: Dict[tuple, object]):
+        with self._db:
+            for key, blob in ops.items():
+                kind = key[0]
+                if kind == "user":
+                    if blob is None:
+                        self._db.execute("DELETE FROM user_data WHERE user_id = ?", (key[1],))
+                    else:
+                        self._db.execute("INSERT OR REPLACE INTO user_data VALUES (?, ?)", (key[1], blob))
+                elif kind == "bot":
+                    self._db.execute("INSERT OR REPLACE INTO bot_data VALUES (?, ?)", (key[1], blob))
+                elif kind == "item":
+                    if blob is None:
+                        self._db.execute("DELETE FROM bot_items WHERE key = ? AND item = ?", key[1:])
+                    else:
+                        self._db.execute("INSERT OR REPLACE INTO bot_items VALUES (?, ?, ?)", (*key[1:], blob))
+                elif kind == "users":
+                    self._db.execute("INSERT OR IGNORE INTO users VALUES (?)", (key[1],))
+                elif kind == "conv":
+                    if blob is None:
+                        self._db.execute("DELETE FROM conversations WHERE name = ? AND key = ?", key[1:])
+                    else:
+                        self._db.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)", (*key[1:], blob))
+        self.transactions += 1
+
+# ======================= Очистка устаревших состояний ========================
+# Незавершённые вводы (Partnerschaft Person 1, списки Gruppenenergie) живут не дольше
+# PENDING_TTL_SEC; «пустые» профили без сохранённой даты удаляются после USER_IDLE_SEC.
+# Зависшие диалоги ConversationHandler завершает сам (conversation_timeout).
+PENDING_TTL_SEC = int(os.getenv("PENDING_TTL_SEC", "1800"))
+USER_IDLE_SEC   = int(os.getenv("USER_IDLE_SEC", str(7 * 24 * 3600)))
+SWEEP_EVERY_SEC = int(os.getenv("SWEEP_EVERY_SEC", "600"))
+
+async def sweep_idle_state(context: ContextTypes.DEFAULT_TYPE):
+    app = context.application
+    now = int(time.time())
+    drop = []
+    for uid, profile in app.user_data.items():
+        idle = now - profile.seen
+        if profile.pending is not None and idle > PENDING_TTL_SEC:
+            profile.pending = None
+        if not profile.dob and idle > USER_IDLE_SEC:
+            drop.append(uid)
+    for uid in drop:
+        app.drop_user_data(uid)
+    FLOOD.sweep()
+    if drop:
+        print(f"[INFO] sweep: {len(drop)} idle profiles dropped, {len(app.user_data)} left")
+
+# ===================== Горячая перезагрузка книги (K2_PATH) ====================
+# Раз в CORPUS_WATCH_SEC сверяем mtime/размер файла. Новый Corpus (приватная копия),
+# проверка, поисковый индекс и фрагменты изменённых дней строятся в потоке; затем на
+# event loop одним синхронным блоком подменяем глобальные ссылки — рендеры, уже
+# взявшие старый CORPUS, дорабатывают на нём. Инкрементально: разбивка по дням и
+# фрагменты Vollanalyse пересчитываются только для разделов с новым хешем.
+class CorpusReload(NamedTuple):
+    corpus: Corpus
+    search: "SearchIndex"
+    changed: Set[Tuple[str, int]]
+    fragments: Dict[int, str]
+    problems: List[str]
+    seconds: float
+
+def validate_corpus(new: Corpus, old: Corpus) -> List[str]:
+    problems = []
+    missing = set(range(1, 10)) - set(new.sections["geistes"])
+    if missing:
+        problems.append(f"Geisteszahl fehlt: {sorted(missing)}")
+    for kind, spans in old.sections.items():
+        lost = set(spans) - set(new.sections[kind])
+        if lost:
+            problems.append(f"{SECTION_TITLES[kind]} verloren: {sorted(lost)}")
+    for gap in corpus_gaps(new):  # бывшие и в старой книге — не повод отклонять, но видно в логе
+        print(f"[WARN] corpus reload: {gap}")
+    return problems
+
+def prepare_corpus_reload(path: str, old: Corpus, old_search: "SearchIndex") -> CorpusReload:
+    """Всё тяжёлое — вне event loop (asyncio.to_thread)."""
+    t0 = time.perf_counter()
+    new = Corpus(path, snapshot=True, previous=old)
+    problems = validate_corpus(new, old)
+    changed = {key for key in old.hashes.keys() | new.hashes.keys() if old.hashes.get(key) != new.hashes.get(key)}
+    search, fragments = old_search, {}
+    if changed and not problems:
+        search = SearchIndex(new)
+        geistes = {n for kind, n in changed if kind == "geistes"}
+        fragments = {d: _render_full_fragment(d, new) for d in range(1, 32) if geisteszahl(d) in geistes}
+    return CorpusReload(new, search, changed, fragments, problems, time.perf_counter() - t0)
+
+def swap_corpus(plan: CorpusReload):
+    """Атомарно для корутин: без await внутри."""
+    global CORPUS, SEARCH, GEISTES_FULL, HANDLUNGS_FULL, VERWIRK_FULL, ERGEBNIS_FULL, PARTNER_FULL
+    global _FULL_FRAGMENTS, _INLINE_FULL_FRAGMENTS
+    CORPUS, SEARCH = plan.corpus, plan.search
+    GEISTES_FULL, HANDLUNGS_FULL = _SectionView(CORPUS, "geistes"), _SectionView(CORPUS, "handlungs")
+    VERWIRK_FULL, ERGEBNIS_FULL = _SectionView(CORPUS, "verwirk"), _SectionView(CORPUS, "ergebnis")
+    PARTNER_FULL = _SectionView(CORPUS, "partner")
+    if plan.fragments:
+        _FULL_FRAGMENTS = {**_FULL_FRAGMENTS, **plan.fragments}
+        _INLINE_FULL_FRAGMENTS = {**_INLINE_FULL_FRAGMENTS, **{d: _inline_cut(f) for d, f in plan.fragments.items()}}
+    if plan.changed:
+        _lang_fragment.cache_clear()
+        _matrix_sections.cache_clear()
+        _fullanalyse_body.cache_clear()
+        _fullanalyse_document.cache_clear()
+        _inline_results.cache_clear()
+        _KI_CACHE.clear()
+
+def reload_locales():
+    """Изменённые locales/*.json: сначала проверяем все, затем сбрасываем пакеты (перечитаются
+    лениво) и кэши рендера; куски DEFAULT_LANG пересобираем сразу. Ошибка — старые пакеты остаются."""
+    global _FULL_FRAGMENTS, _PFAD_FRAGMENTS, _INLINE_FULL_FRAGMENTS
+    stale = LOCALES.stale()
+    if not stale:
+        return
+    try:
+        for lang in stale:
+            if os.path.exists(os.path.join(LOCALES.path, lang + ".json")):
+                _compile_pack(os.path.join(LOCALES.path, lang + ".json"))
+    except (ValueError, TypeError, AttributeError, OSError) as e:
+        LOCALES.reject(stale)
+        print(f"[WARN] locale reload rejected ({', '.join(stale)}): {e}")
+        return
+    LOCALES.reset()
+    if DEFAULT_LANG in stale:
+        _FULL_FRAGMENTS = {d: _render_full_fragment(d) for d in range(1, 32)}
+        _PFAD_FRAGMENTS = {d: _render_entwicklungspfad(d) for d in range(1, 32)}
+        _INLINE_FULL_FRAGMENTS = {d: _inline_cut(f) for d, f in _FULL_FRAGMENTS.items()}
+    for cached in (_lang_fragment, _matrix_sections, _fullanalyse_body, _fullanalyse_document, _tagesenergie_text, _inline_results):
+        cached.cache_clear()
+    print(f"[INFO] locales reloaded: {', '.join(stale)}")
+
+_CORPUS_RELOADING = False
+_CORPUS_REJECTED: Tuple[int, int] | None = None
+
+async def corpus_watch(context: ContextTypes.DEFAULT_TYPE):
+    global _CORPUS_RELOADING, _CORPUS_REJECTED
+    reload_locales()
+    try:
+        st = os.stat(CORPUS.path)
+    except OSError:
+        return
+    stamp = (st.st_mtime_ns, st.st_size)
+    if stamp == CORPUS.stamp or stamp == _CORPUS_REJECTED or _CORPUS_RELOADING:
+        return
+    _CORPUS_RELOADING = True
+    try:
+        plan = await asyncio.to_thread(prepare_corpus_reload, CORPUS.path, CORPUS, SEARCH)
+    finally:
+        _CORPUS_RELOADING = False
+    if plan.problems:
+        _CORPUS_REJECTED = stamp
+        print(f"[WARN] corpus reload rejected ({CORPUS.path}): {'; '.join(plan.problems)}")
+        return
+    t0 = time.perf_counter()
+    swap_corpus(plan)
+    changed = ", ".join(f"{SECTION_TITLES[k]} {n}" for k, n in sorted(plan.changed)[:12]) or "keine"
+    print(f"[INFO] corpus reloaded: {len(plan.changed)} sections changed ({changed}), "
+          f"day splits reused {plan.corpus.reused}, fragments {len(plan.fragments)}, "
+          f"build {1000 * plan.seconds:.0f} ms (thread), swap {1000 * (time.perf_counter() - t0):.2f} ms")
+
+_METRICS_SERVER = None
+
+async def _post_init(app: Application):
+    # USERS и bot_data["users"] — один и тот же set, чтобы реестр попадал в хранилище
+    USERS.update(app.bot_data.get("users", ()))
+    app.bot_data["users"] = USERS
+    global _METRICS_SERVER
+    if METRICS_PORT and _METRICS_SERVER is None:
+        _METRICS_SERVER = MiniHttpServer(metrics_handler, METRICS_LISTEN, METRICS_PORT)
+        await _METRICS_SERVER.start()
+        print(f"[INFO] metrics on http://{METRICS_LISTEN}:{_METRICS_SERVER.port}/metrics")
+
+async def _post_shutdown(app: Application):
+    global _METRICS_SERVER
+    if _METRICS_SERVER is not None:
+        await _METRICS_SERVER.stop(timeout=1.0)
+        _METRICS_SERVER = None
+
+# ================= Параллельная обработка с очередью на чат ==================
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+
+def _serial_key(update: object) -> int | None:
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "effective_user", None)
+    return user.id if user is not None else None
+
+class ChatSerialUpdateProcessor(BaseUpdateProcessor):
+    """
+    Апдейты разных чатов обрабатываются параллельно (не больше max_concurrent_updates),
+    апдейты одного чата — строго по очереди, поэтому состояния ConversationHandler
+    (ASK_FULL, ASK_COMPAT_2, ASK_GROUP …) каждого пользователя не перемешиваются.
+    Если у чата уже есть исполнитель, новый апдейт встаёт в его очередь и слот
+    параллельности не занимает.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._queues: Dict[int, deque] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        key = _serial_key(update)
+        if key is None:
+            await coroutine
+            return
+        queue = self._queues.get(key)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+        queue = self._queues[key] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue[0]
+                except Exception as e:
+                    print(f"[WARN] update for chat {key} failed: {e!r}")
+                queue.popleft()
+        finally:
+            del self._queues[key]
+            for rest in queue:
+                rest.close()
+
+    @property
+    def queued_chats(self) -> int:
+        return len(self._queues)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+# ===================== Встроенный HTTP-сервер (asyncio) =====================
+class HttpRequest(NamedTuple):
+    method: str
+    path: str
+    query: str
+    headers: Dict[str, str]
+    body: bytes
+
+HttpResponse = Tuple[int, str, bytes]  # (status, content-type, body)
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+                405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+HTTP_MAX_BODY = 1 << 20
+
+class MiniHttpServer:
+    """
+    Минимальный HTTP/1.1 сервер на asyncio.start_server: keep-alive, тело по Content-Length.
+    Все запросы уходят в один обработчик handler(HttpRequest) -> (status, content-type, body).
+    """
+
+    def __init__(self, handler: Callable[[HttpRequest], Awaitable[HttpResponse]], host: str, port: int):
+        self.handler, self.host, self.port = handler, host, port
+        self._server = None
+        self._idle: Set[asyncio.StreamWriter] = set()
+        self._busy = 0
+        self._closing = False
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self, timeout: float = 10.0):
+        """Перестаёт принимать соединения, закрывает простаивающие и ждёт текущие запросы."""
+        self._closing = True
+        self._server.close()
+        for w in list(self._idle):
+            w.close()
+        deadline = time.monotonic() + timeout
+        while self._busy and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while not self._closing:
+                self._idle.add(writer)
+                line = await reader.readline()
+                self._idle.discard(writer)
+                if not line:
+                    break
+                self._busy += 1
+                try:
+                    keep = await self._one(line, reader, writer)
+                finally:
+                    self._busy -= 1
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._idle.discard(writer)
+            writer.close()
+
+    async def _one(self, line: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+        headers: Dict[str, str] = {}
+        while True:
+            h = await reader.readline()
+            if h in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = h.decode("latin-1").partition(":")
+            headers[k.strip().lower()] = v.strip()
+        size = int(headers.get("content-length") or 0)
+        if size > HTTP_MAX_BODY:
+            await self._respond(writer, (413, "text/plain", b"too large"), keep=False)
+            return False
+        body = await reader.readexactly(size) if size else b""
+        path, _, query = target.partition("?")
+        try:
+            resp = await self.handler(HttpRequest(method.upper(), path, query, headers, body))
+        except Exception as e:
+            print(f"[WARN] http handler error: {e!r}")
+            resp = (503, "text/plain", b"error")
+        keep = headers.get("connection", "").lower() != "close" and not self._closing
+        await self._respond(writer, resp, keep)
+        return keep
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, resp: HttpResponse, keep: bool):
+        status, ctype, payload = resp
+        head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                f"Content-Type: {ctype}\r\nContent-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
+
+def _json_response(data: dict, status: int = 200) -> HttpResponse:
+    return status, "application/json", json.dumps(data).encode("utf-8")
+
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+async def metrics_handler(req: HttpRequest) -> HttpResponse:
+    """Отдельный локальный сервер METRICS_PORT: только GET /metrics."""
+    if req.path != "/metrics":
+        return 404, "text/plain", b"not found"
+    return 200, PROMETHEUS_TYPE, METRICS.prometheus().encode("utf-8")
+
+# =============================== Webhook =====================================
+# BOT_MODE=webhook: Telegram шлёт апдейты POST-запросом на WEBHOOK_URL + WEBHOOK_PATH.
+# Без WEBHOOK_URL вебхук в Telegram не регистрируется — так сервер удобно проверять
+# локально, отправляя сохранённый Update JSON:
+#   curl -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" -d @update.json localhost:8080/telegram
+BOT_MODE       = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL    = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")
+WEBHOOK_PATH   = os.getenv("WEBHOOK_PATH", "/telegram").strip()
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0").strip()
+WEBHOOK_PORT   = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip() or (secrets.token_urlsafe(32) if WEBHOOK_URL else "")
+
+def webhook_handler(app: Application) -> Callable[[HttpRequest], Awaitable[HttpResponse]]:
+    async def handle(req: HttpRequest) -> HttpResponse:
+        if req.path == "/health":
+            return _json_response({"status": "ok" if app.running else "stopping",
+                                   "queue": app.update_queue.qsize(), "users": user_total()})
+        if req.path == "/metrics" and METRICS_TOKEN:
+            auth = req.headers.get("authorization", "")
+            if not hmac.compare_digest(auth.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+                return 403, "text/plain", b"bad token"
+            return 200, PROMETHEUS_TYPE, METRICS.prometheus().encode("utf-8")
+        if req.path != WEBHOOK_PATH:
+            return 404, "text/plain", b"not found"
+        if req.method != "POST":
+            return 405, "text/plain", b"POST only"
+        token = req.headers.get("x-telegram-bot-api-secret-token", "")
+        if WEBHOOK_SECRET and not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+            return 403, "text/plain", b"bad secret"
+        if not app.running:
+            return 503, "text/plain", b"stopping"
+        try:
+            update = Update.de_json(json.loads(req.body), app.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, "text/plain", b"bad update"
+        await app.update_queue.put(update)
+        return 200, "text/plain", b"ok"
+    return handle
+
+def _stop_on_signals(stop: asyncio.Event, signals=(signal.SIGINT, signal.SIGTERM)):
+    loop = asyncio.get_running_loop()
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+async def _serve_app(app: Application, start_source: Callable[[asyncio.Event], Awaitable[None]],
+                     stop_source: Callable[[], Awaitable[None]] | None = None,
+                     signals=(signal.SIGINT, signal.SIGTERM)):
+    """Жизненный цикл Application с внешним источником апдейтов (вебхук, канал от супервизора)."""
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    stop = asyncio.Event()
+    await start_source(stop)
+    _stop_on_signals(stop, signals)
+    await stop.wait()
+
+    # сначала перестаём принимать апдейты, затем app.stop() обрабатывает всё, что уже в очереди
+    if stop_source:
+        await stop_source()
+    await app.stop()
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+async def run_webhook(app: Application):
+    """Вебхук-режим: свой HTTP-сервер, проверка секрета, /health и мягкая остановка."""
+    server = MiniHttpServer(webhook_handler(app), WEBHOOK_LISTEN, WEBHOOK_PORT)
+
+    async def start(stop: asyncio.Event):
+        await server.start()
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                      allowed_updates=Update.ALL_TYPES)
+        print(f"🤖 KeyToFate läuft (Webhook) auf {WEBHOOK_LISTEN}:{server.port}{WEBHOOK_PATH}.")
+    await _serve_app(app, start, server.stop)
+
+# ============================= Шардирование ==================================
+# WORKERS=N (N>1): главный процесс — супервизор. Он сам получает апдейты (getUpdates или
+# вебхук), ничего не разбирает дальше id пользователя и отправляет сырой JSON воркеру
+# shard_of(user id, N) через multiprocessing.Pipe. Каждый воркер — обычный Application
+# со своим циклом asyncio, поэтому диалоги (ConversationHandler) и user_data пользователя
+# всегда живут в одном процессе. Общие данные — файл PERSISTENCE_DB (WAL): профили с
+# датами, реестр пользователей (Statistik считает по нему), bot_data по элементам (чаты — по shard_of).
+# METRICS_PORT у воркера i — METRICS_PORT + i.
+SUPERVISOR_POLL_TIMEOUT = int(os.getenv("SUPERVISOR_POLL_TIMEOUT", "30"))
+
+def _route_key(update: dict) -> int:
+    """id группы для апдейтов из групп и каналов, иначе user id отправителя (личка — chat == user,
+    inline_query …). Так у чата один воркер и для диалогов, и для bot_data по chat id (tages_abo)."""
+    for key, obj in update.items():
+        if key != "update_id" and isinstance(obj, dict):
+            chat = obj.get("chat") or (obj.get("message") or {}).get("chat")
+            if chat and chat.get("type") != "private":
+                return chat["id"]
+            user = obj.get("from") or obj.get("user")
+            if user:
+                return user["id"]
+            if chat:
+                return chat["id"]
+    return 0
+
+async def run_shard(app: Application, conn):
+    """Воркер: апдейты приходят из канала супервизора; пустое сообщение или EOF — остановка."""
+    async def start(stop: asyncio.Event):
+        loop = asyncio.get_running_loop()
+
+        def on_data():
+            try:
+                while conn.poll():
+                    raw = conn.recv_bytes()
+                    if not raw:
+                        raise EOFError
+                    try:
+                        app.update_queue.put_nowait(Update.de_json(json.loads(raw), app.bot))
+                    except (ValueError, TypeError, KeyError) as e:
+                        print(f"[WARN] shard {SHARD[0]}: bad update: {e!r}")
+            except (EOFError, OSError):
+                loop.remove_reader(conn.fileno())
+                stop.set()
+        loop.add_reader(conn.fileno(), on_data)
+        print(f"🤖 KeyToFate Worker {SHARD[0] + 1}/{SHARD[1]} (pid {os.getpid()}) bereit.")
+    # Ctrl+C получает вся группа процессов — воркер ждёт, пока супервизор закроет канал
+    await _serve_app(app, start, signals=(signal.SIGTERM,))
+
+def _shard_main(index: int, shards: int, conn):
+    global SHARD, METRICS_PORT, OUTBOUND
+    SHARD = (index, shards)
+    if METRICS_PORT:
+        METRICS_PORT += index
+    # лимит Telegram общий на токен: каждому воркеру — своя доля OUT_GLOBAL_RATE
+    OUTBOUND = OutboundScheduler(global_rate=OUT_GLOBAL_RATE / shards)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(run_shard(build_application(), conn))
+
+class ShardLink:
+    """Канал к одному воркеру. Запись в Pipe — в своём потоке: медленный воркер не тормозит приём."""
+
+    def __init__(self, ctx, index: int, shards: int):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_shard_main, args=(index, shards, child), name=f"keytofate-worker-{index}")
+        self.proc.start()
+        child.close()
+        self.queue: "queue.SimpleQueue[bytes]" = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._pump, name=f"shard-pipe-{index}", daemon=True)
+        self.routed = 0
+
+    def _pump(self):
+        while True:
+            raw = self.queue.get()
+            try:
+                self.conn.send_bytes(raw)
+            except OSError:
+                return
+            if not raw:
+                return
+
+    def send(self, raw: bytes):
+        self.routed += 1
+        self.queue.put(raw)
+
+    def close(self, timeout: float):
+        self.queue.put(b"")
+        self.thread.join(timeout)
+        self.proc.join(timeout)
+        if self.proc.is_alive():
+            self.proc.terminate()
+            self.proc.join(1.0)
+
+class Supervisor:
+    """Приём апдейтов и раздача по воркерам; если воркер упал — останавливается целиком (перезапуск — Procfile)."""
+
+    def __init__(self, shards: int):
+        # все fork — до запуска потоков и цикла asyncio
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        ctx = multiprocessing.get_context(method)
+        self.links = [ShardLink(ctx, i, shards) for i in range(shards)]
+        for link in self.links:
+            link.thread.start()
+        self.api = f"{TELEGRAM_API_URL or 'https://api.telegram.org'}/bot{API_TOKEN}"
+        self.offset = 0
+
+    def dispatch(self, update: dict, raw: bytes | None = None):
+        link = self.links[shard_of(_route_key(update), len(self.links))]
+        link.send(raw if raw is not None else json.dumps(update, ensure_ascii=False).encode("utf-8"))
+
+    async def poll(self, client: httpx.AsyncClient, stop: asyncio.Event):
+        """getUpdates по кругу. Ошибки ({"ok": false}: 409 — второй поллер/вебхук, 429 — флуд,
+        5xx) не считаем пустой пачкой: пауза retry_after или растущая до 60 с; 401 — стоп."""
+        backoff = 1.0
+        while True:
+            resp = None
+            try:
+                resp = await client.post(f"{self.api}/getUpdates", json={
+                    "offset": self.offset, "timeout": SUPERVISOR_POLL_TIMEOUT, "allowed_updates": Update.ALL_TYPES})
+                body = resp.json()
+            except (httpx.HTTPError, ValueError) as e:
+                body = {"description": repr(e)}
+            if not body.get("ok"):
+                status = resp.status_code if resp is not None else 0
+                if status == 401:
+                    print(f"[ERROR] getUpdates 401: {body.get('description')} — Token ungültig, Supervisor stoppt")
+                    stop.set()
+                    return
+                retry_after = (body.get("parameters") or {}).get("retry_after")
+                delay = float(retry_after) if retry_after else backoff
+                backoff = min(backoff * 2, 60.0)
+                print(f"[WARN] getUpdates {status or '-'}: {body.get('description')} — Pause {delay:.0f} s")
+                await asyncio.sleep(delay)
+                continue
+            backoff = 1.0
+            for update in body.get("result") or []:
+                self.offset = update["update_id"] + 1
+                self.dispatch(update)
+
+    def webhook_handler(self) -> Callable[[HttpRequest], Awaitable[HttpResponse]]:
+        async def handle(req: HttpRequest) -> HttpResponse:
+            if req.path == "/health":
+                alive = sum(link.proc.is_alive() for link in self.links)
+                return _json_response({"status": "ok" if alive == len(self.links) else "degraded",
+                                       "workers": alive, "routed": [link.routed for link in self.links]})
+            if req.path != WEBHOOK_PATH:
+                return 404, "text/plain", b"not found"
+            if req.method != "POST":
+                return 405, "text/plain", b"POST only"
+            token = req.headers.get("x-telegram-bot-api-secret-token", "")
+            if WEBHOOK_SECRET and not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+                return 403, "text/plain", b"bad secret"
+            try:
+                self.dispatch(json.loads(req.body), req.body)
+            except (ValueError, TypeError, KeyError, AttributeError):
+                return 400, "text/plain", b"bad update"
+            return 200, "text/plain", b"ok"
+        return handle
+
+    async def _watch(self, stop: asyncio.Event):
+        while not stop.is_set():
+            dead = [link.proc.name for link in self.links if not link.proc.is_alive()]
+            if dead:
+                print(f"[ERROR] worker beendet: {', '.join(dead)} — Supervisor stoppt")
+                stop.set()
+            await asyncio.sleep(1.0)
+
+    async def run(self):
+        stop = asyncio.Event()
+        _stop_on_signals(stop)
+        watcher = asyncio.create_task(self._watch(stop))
+        async with httpx.AsyncClient(timeout=SUPERVISOR_POLL_TIMEOUT + 10) as client:
+            if BOT_MODE == "webhook":
+                server = MiniHttpServer(self.webhook_handler(), WEBHOOK_LISTEN, WEBHOOK_PORT)
+                await server.start()
+                if WEBHOOK_URL:
+                    await client.post(f"{self.api}/setWebhook", json={
+                        "url": WEBHOOK_URL + WEBHOOK_PATH, "secret_token": WEBHOOK_SECRET,
+                        "allowed_updates": Update.ALL_TYPES})
+                print(f"🤖 KeyToFate läuft (Webhook, {len(self.links)} Worker) auf {WEBHOOK_LISTEN}:{server.port}{WEBHOOK_PATH}.")
+                await stop.wait()
+                await server.stop()
+            else:
+                await client.post(f"{self.api}/deleteWebhook")
+                poller = asyncio.create_task(self.poll(client, stop))
+                print(f"🤖 KeyToFate läuft ({len(self.links)} Worker). /start → Menü.")
+                await stop.wait()
+                poller.cancel()
+                if self.offset:  # подтверждаем уже разосланные апдейты
+                    try:
+                        await client.post(f"{self.api}/getUpdates", json={"offset": self.offset, "timeout": 0})
+                    except httpx.HTTPError:
+                        pass
+        watcher.cancel()
+        # воркеры дорабатывают очереди и сбрасывают хранилище
+        await asyncio.gather(*(asyncio.to_thread(link.close, 30.0) for link in self.links))
 
 # =============================== Bootstrap ==================================
-def main():
-    app = Application.builder().token(API_TOKEN).build()
+def build_application(request: HTTPXRequest | None = None) -> Application:
+    """request — свой транспорт Bot API (bench.py гоняет настоящие обработчики без сети)."""
+    builder = (Application.builder().token(API_TOKEN).context_types(CONTEXT_TYPES)
+               .post_init(_post_init).post_shutdown(_post_shutdown)
+               .request(request or CountingRequest(connection_pool_size=256))
+               .get_updates_request(request or CountingRequest())
+               .concurrent_updates(ChatSerialUpdateProcessor(MAX_CONCURRENT_UPDATES)))
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    persistence = SqlitePersistence(PERSISTENCE_DB, shard=SHARD) if PERSISTENCE_DB else None
+    if persistence:
+        builder = builder.persistence(persistence)
+    global SHARED_STORE
+    SHARED_STORE = persistence if SHARD[1] > 1 else None
+    app = builder.build()
+    app.add_handler(TypeHandler(Update, flood_guard), group=-1)
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("profil", profil))
+    app.add_handler(CommandHandler("suche", suche))
     app.add_handler(CallbackQueryHandler(back_to_menu, pattern="^open_menu$"))
     # Важно: ловим и full_use_saved/full_enter_new
     conv = ConversationHandler(
@@ -698,13 +3319,40 @@ def main():
             ASK_COMPAT_1:  [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_compat1)],
             ASK_COMPAT_2:  [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_compat2)],
             ASK_NAME:      [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_name)],
-            ASK_GROUP:     [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_group)],
-            ASK_PATH:      [MessageHandler(filters.TEXT & ~filters.COMMAND, build_entwicklungspfad_text)],
+            ASK_GROUP:     [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_group),
+                            MessageHandler(filters.Document.ALL, ask_group_file)],
+            ASK_PATH:      [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_path)],
+            ASK_KI:        [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_ki)],
+            ASK_CAL:       [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_cal)],
         },
         fallbacks=[CommandHandler("start", start)],
-        allow_reentry=True
+        allow_reentry=True,
+        conversation_timeout=PENDING_TTL_SEC,
+        name="menu",
+        persistent=persistence is not None
     )
     app.add_handler(conv)
+    app.add_handler(InlineQueryHandler(inline_query))
+    app.add_handler(CallbackQueryHandler(on_abo_click, pattern="^abo_"))
+    app.add_handler(CallbackQueryHandler(on_cal_click, pattern="^calx?:"))
+    instrument_handlers(app)
+    hh, mm = map(int, TAGES_PUSH_TIME.split(":"))
+    app.job_queue.run_daily(tages_push, time=dtime(hh, mm, tzinfo=TAGES_TZ), name="tages_push")
+    app.job_queue.run_once(tages_push, when=30, name="tages_push_resume")
+    app.job_queue.run_repeating(sweep_idle_state, interval=SWEEP_EVERY_SEC, first=SWEEP_EVERY_SEC)
+    if CORPUS_WATCH_SEC > 0:
+        app.job_queue.run_repeating(corpus_watch, interval=CORPUS_WATCH_SEC, first=CORPUS_WATCH_SEC, name="corpus_watch")
+    return app
+
+def main():
+    if WORKERS > 1:
+        supervisor = Supervisor(WORKERS)
+        asyncio.run(supervisor.run())
+        return
+    app = build_application()
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(app))
+        return
     print("🤖 KeyToFate läuft. /start → Menü.")
     app.run_polling()
 
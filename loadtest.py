@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест KeyToFate: настоящий Application из bot.py против локальной
+заглушки Bot API (MiniHttpServer в том же процессе, без сети и токена).
+
+  python loadtest.py --users 2000 --iterations 2          — виртуальные пользователи
+  python loadtest.py --users 500 --mode webhook           — апдейты через вебхук-сервер
+  python loadtest.py --users 200 --record run.jsonl       — записать поток апдейтов
+  python loadtest.py --replay run.jsonl --speed 0         — проиграть запись (0 = без пауз)
+  python loadtest.py --users 400 --shards 1,2,4,8         — WORKERS=N отдельным процессом
+
+Задержка = от отправки апдейта в «Telegram» до первого ответа бота в этот чат.
+По умолчанию лимиты OUTBOUND и FLOOD сняты (меряем сам воркер); --real-limits оставляет
+лимиты Telegram, тогда упираемся в OUT_GLOBAL_RATE.
+"""
+import os, re, sys, json, time, random, signal, sqlite3, asyncio, argparse, tempfile
+from collections import deque
+from email.parser import BytesParser
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "KeyToFate", "username": "keytofate_bot"}
+
+def _bootstrap(args):
+    """Окружение до import bot: токен, без лимитов OUTBOUND, временная БД."""
+    os.environ.setdefault("API_TOKEN", "1:loadtest")
+    if not args.real_limits:
+        for key in ("OUT_CHAT_RATE", "OUT_CHAT_BURST", "OUT_GLOBAL_RATE", "FLOOD_RATE", "FLOOD_BURST"):
+            os.environ[key] = "1e9"
+    if args.db is None:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="k2load"), "load.db")
+    os.environ["PERSISTENCE_DB"] = args.db
+    import bot
+    return bot
+
+def _percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))]
+
+# ----------------------------- Заглушка Bot API ------------------------------
+class _Chat:
+    __slots__ = ("pending", "inbox", "texts")
+
+    def __init__(self):
+        self.pending = deque()        # (время отправки апдейта, метка шага)
+        self.inbox = asyncio.Queue()  # ответы бота: есть ли у сообщения клавиатура
+        self.texts = deque(maxlen=8)  # последние тексты бота в этот чат
+
+class FakeBotAPI:
+    """getMe/getUpdates/sendMessage/answerCallbackQuery/… — ровно столько, сколько нужно боту."""
+
+    def __init__(self, bot_module, record=None):
+        self.bot = bot_module
+        self.server = bot_module.MiniHttpServer(self.handle, "127.0.0.1", 0)
+        self.updates = deque()
+        self.arrived = asyncio.Event()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.chats = {}
+        self.latency = {}             # метка шага → [секунды]
+        self.calls = {}
+        self.bytes = {}               # метод → байт в телах запросов (трафик бота к API)
+        self.doc_uploads = self.doc_by_id = 0
+        self.replies = 0
+        self.record = record
+        self.t_start = time.perf_counter()
+        self.deliver = None           # вебхук: корутина, отправляющая апдейт боту
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.port}"
+
+    def chat(self, chat_id: int) -> _Chat:
+        c = self.chats.get(chat_id)
+        if c is None:
+            c = self.chats[chat_id] = _Chat()
+        return c
+
+    # --- входящие апдейты (как будто от пользователей) ---
+    async def inject(self, chat_id: int, update: dict, label: str = "update"):
+        update["update_id"] = self.next_update_id
+        self.next_update_id += 1
+        if self.record:
+            self.record.write(json.dumps({"t": round(time.perf_counter() - self.t_start, 4),
+                                          "label": label, "update": update}, ensure_ascii=False) + "\n")
+        self.chat(chat_id).pending.append((time.perf_counter(), label))
+        if self.deliver is not None:
+            await self.deliver(update)
+        else:
+            self.updates.append(update)
+            self.arrived.set()
+
+    # --- HTTP ---
+    @staticmethod
+    def _params(req) -> dict:
+        ctype = req.headers.get("content-type", "")
+        if ctype.startswith("multipart/"):
+            msg = BytesParser().parsebytes(b"Content-Type: " + ctype.encode() + b"\r\n\r\n" + req.body)
+            raw = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                   for part in msg.get_payload()}
+            raw = {k: (v if k in ("document", "photo") else v.decode("utf-8")) for k, v in raw.items()}
+        elif ctype.startswith("application/json"):
+            return json.loads(req.body or b"{}")
+        else:
+            raw = dict(parse_qsl(req.body.decode("utf-8"), keep_blank_values=True))
+        params = {}
+        for k, v in raw.items():
+            try:
+                params[k] = json.loads(v) if isinstance(v, str) and v[:1] in "[{0123456789-" else v
+            except ValueError:
+                params[k] = v
+        return params
+
+    async def handle(self, req):
+        method = req.path.rsplit("/", 1)[-1]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        self.bytes[method] = self.bytes.get(method, 0) + len(req.body)
+        fn = getattr(self, "api_" + method, None)
+        result = await fn(self._params(req)) if fn else True
+        return self.bot._json_response({"ok": True, "result": result})
+
+    async def api_getMe(self, p):
+        return BOT_USER
+
+    async def api_getUpdates(self, p):
+        offset, timeout = int(p.get("offset") or 0), float(p.get("timeout") or 0)
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout:
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(p.get("limit") or 100)
+        return [u for _, u in zip(range(limit), self.updates)]
+
+    def _message(self, p, **extra) -> dict:
+        self.next_message_id += 1
+        chat_id = int(p["chat_id"])
+        msg = {"message_id": self.next_message_id, "date": int(time.time()), "from": BOT_USER,
+               "chat": {"id": chat_id, "type": "private"}, **extra}
+        now = time.perf_counter()
+        c = self.chat(chat_id)
+        if c.pending:
+            t0, label = c.pending.popleft()
+            self.latency.setdefault(label, []).append(now - t0)
+        self.replies += 1
+        c.texts.append(p.get("text", ""))
+        c.inbox.put_nowait(bool(p.get("reply_markup")))
+        return msg
+
+    async def api_sendMessage(self, p):
+        return self._message(p, text=p.get("text", ""))
+
+    async def api_editMessageText(self, p):
+        return self._message(p, text=p.get("text", ""))
+
+    async def api_sendDocument(self, p):
+        doc = p.get("document")
+        if isinstance(doc, (bytes, bytearray)):
+            self.doc_uploads += 1
+            file_id, size = f"doc{self.next_message_id}", len(doc)
+        else:                         # повторная отправка по file_id — без загрузки
+            self.doc_by_id += 1
+            file_id, size = str(doc), 0
+        return self._message(p, document={"file_id": file_id, "file_unique_id": "u" + file_id, "file_size": size},
+                             caption=p.get("caption", ""))
+
+# ----------------------------- Виртуальные пользователи ----------------------
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"U{uid}", "language_code": ("de", "en", "ru")[uid % 3]}
+
+def _text(uid: int, text: str) -> dict:
+    msg = {"message_id": random.randint(1, 1 << 30), "date": int(time.time()),
+           "chat": {"id": uid, "type": "private"}, "from": _user(uid), "text": text}
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": msg}
+
+def _click(uid: int, data: str) -> dict:
+    msg = {"message_id": random.randint(1, 1 << 30), "date": int(time.time()), "from": BOT_USER,
+           "chat": {"id": uid, "type": "private"}, "text": "Menü"}
+    return {"callback_query": {"id": str(random.getrandbits(48)), "from": _user(uid),
+                               "chat_instance": str(uid), "data": data, "message": msg}}
+
+def _in_group(update: dict, gid: int) -> dict:
+    """Тот же апдейт, но из группы gid (вместо личного чата)."""
+    msg = update.get("message") or update["callback_query"]["message"]
+    msg["chat"] = {"id": gid, "type": "group", "title": "Team"}
+    return update
+
+def _date() -> str:
+    return f"{random.randint(1, 28):02d}.{random.randint(1, 12):02d}.{random.randint(1950, 2005)}"
+
+class VirtualUser:
+    """Шаг = (апдейт, метка, ждать ли сообщения с клавиатурой — конец ответа)."""
+
+    def __init__(self, api: FakeBotAPI, uid: int, think: float, timeout: float):
+        self.api, self.uid, self.think, self.timeout = api, uid, think, timeout
+        self.has_dob = False
+        self.errors = 0
+
+    async def step(self, update: dict, label: str, until_markup: bool):
+        inbox = self.api.chat(self.uid).inbox
+        while not inbox.empty():
+            inbox.get_nowait()
+        await self.api.inject(self.uid, update, label)
+        try:
+            while True:
+                has_markup = await asyncio.wait_for(inbox.get(), self.timeout)
+                if has_markup or not until_markup:
+                    break
+        except asyncio.TimeoutError:
+            self.errors += 1
+        if self.think:
+            await asyncio.sleep(random.random() * self.think)
+
+    async def flow_full(self):
+        await self.step(_click(self.uid, "calc_full"), "calc_full", False)
+        if self.has_dob:
+            await self.step(_click(self.uid, "full_enter_new"), "full_enter_new", False)
+        await self.step(_text(self.uid, _date()), "Vollanalyse", True)
+        self.has_dob = True
+        await self.step(_click(self.uid, "open_menu"), "open_menu", True)
+
+    async def flow_doc(self):
+        if not self.has_dob:          # документ — только по сохранённой дате
+            return await self.flow_full()
+        await self.step(_click(self.uid, "calc_full"), "calc_full", True)
+        await self.step(_click(self.uid, "full_doc"), "Dokument", True)
+        await self.step(_click(self.uid, "open_menu"), "open_menu", True)
+
+    async def flow_compat(self):
+        await self.step(_click(self.uid, "calc_compat"), "calc_compat", False)
+        if not self.has_dob:
+            await self.step(_text(self.uid, _date()), "Person 1", True)
+            self.has_dob = True
+        await self.step(_text(self.uid, _date()), "Partnerschaft", True)
+        await self.step(_click(self.uid, "open_menu"), "open_menu", True)
+
+    async def flow_group(self):
+        await self.step(_click(self.uid, "calc_group"), "calc_group", False)
+        await self.step(_text(self.uid, ", ".join(_date() for _ in range(3))), "Gruppe: Daten", True)
+        await self.step(_text(self.uid, "fertig"), "Gruppenenergie", True)
+        await self.step(_click(self.uid, "open_menu"), "open_menu", True)
+
+    async def flow_cal(self):
+        await self.step(_click(self.uid, "calc_cal"), "calc_cal", self.has_dob)
+        if not self.has_dob:
+            await self.step(_text(self.uid, _date()), "Kalender: Datum", True)
+            self.has_dob = True
+        year = random.randint(2024, 2027)
+        await self.step(_text(self.uid, f"{random.randint(1, 12)}.{year}"), "Kalender", True)
+        energy = random.randint(1, 9)
+        await self.step(_click(self.uid, f"cal:{year}:{energy}"), "Kalender: Jahr", True)
+        await self.step(_click(self.uid, f"calx:{random.choice(('csv', 'ics'))}:{year}:{energy}"), "Kalender: Export", True)
+        await self.step(_click(self.uid, "open_menu"), "open_menu", True)
+
+    async def run(self, iterations: int):
+        await self.step(_text(self.uid, "/start"), "start", True)
+        flows = (self.flow_full, self.flow_doc, self.flow_compat, self.flow_group, self.flow_cal)
+        for _ in range(iterations):
+            await random.choice(flows)()
+
+async def _replay(api: FakeBotAPI, path: str, speed: float):
+    """Апдейты из JSONL в исходном темпе (speed=2 — вдвое быстрее, 0 — без пауз)."""
+    t0 = time.perf_counter()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            if speed:
+                delay = rec["t"] / speed - (time.perf_counter() - t0)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            upd = rec["update"]
+            chat = (upd.get("message") or upd["callback_query"]["message"])["chat"]["id"]
+            await api.inject(chat, upd, rec.get("label", "update"))
+    deadline = time.perf_counter() + 30
+    while any(c.pending for c in api.chats.values()) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+# ------------------------------------ Запуск ----------------------------------
+async def run(args, bot):
+    record = open(args.record, "w", encoding="utf-8") if args.record else None
+    api = FakeBotAPI(bot, record)
+    await api.server.start()
+    bot.TELEGRAM_API_URL = api.url
+    app = bot.build_application()
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+
+    webhook = client = None
+    if args.mode == "webhook":
+        import httpx
+        webhook = bot.MiniHttpServer(bot.webhook_handler(app), "127.0.0.1", 0)
+        await webhook.start()
+        client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{webhook.port}",
+                                   limits=httpx.Limits(max_connections=256))
+
+        async def deliver(update: dict):
+            await client.post(bot.WEBHOOK_PATH, json=update)
+        api.deliver = deliver
+    else:
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+    await app.start()
+
+    t0 = time.perf_counter()
+    errors = 0
+    if args.replay:
+        await _replay(api, args.replay, args.speed)
+        errors = sum(len(c.pending) for c in api.chats.values())
+    else:
+        users = [VirtualUser(api, 100000 + i, args.think, args.timeout) for i in range(args.users)]
+        await asyncio.gather(*(u.run(args.iterations) for u in users))
+        errors = sum(u.errors for u in users)
+    secs = time.perf_counter() - t0
+
+    if app.updater.running:
+        await app.updater.stop()
+    await app.stop()
+    if webhook:
+        await webhook.stop()
+        await client.aclose()
+    await app.shutdown()
+    await api.server.stop()
+    if record:
+        record.close()
+
+    every = [x for xs in api.latency.values() for x in xs]
+    updates = api.next_update_id - 1
+    print(f"{args.mode}: {updates} Updates, {api.replies} Antworten in {secs:.1f} s — "
+          f"{updates / secs:.0f} Updates/s, {api.replies / secs:.0f} Nachrichten/s, Timeouts: {errors}")
+    print(f"  {'Schritt':<18} {'n':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for label, xs in sorted(api.latency.items()) + [("GESAMT", every)]:
+        print(f"  {label:<18} {len(xs):>7} " + " ".join(f"{1000 * _percentile(xs, p):>9.1f}" for p in (50, 95, 99)))
+    print("  API: " + ", ".join(f"{k} {v}" for k, v in sorted(api.calls.items())))
+    print("  Bytes: " + ", ".join(f"{k} {v // 1024} KB" for k, v in sorted(api.bytes.items()) if v))
+    print(f"  Dokumente: {api.doc_uploads} Uploads, {api.doc_by_id} per file_id")
+    print(f"  Versand: {bot.OUTBOUND.stats_line()}")
+    print("  " + re.sub(r"</?b>", "", bot.METRICS.summary_html()).replace("\n", "\n  "))
+    return errors
+
+async def run_sharded(args, bot, shards: int) -> dict:
+    """`python bot.py` с WORKERS=shards против той же заглушки; меряем только пропускную способность."""
+    api = FakeBotAPI(bot)
+    await api.server.start()
+    env = dict(os.environ, WORKERS=str(shards), TELEGRAM_API_URL=api.url, BOT_MODE="polling",
+               PERSISTENCE_DB=os.path.join(tempfile.mkdtemp(prefix="k2shard"), "shard.db"),
+               CORPUS_WATCH_SEC="0", METRICS_PORT="0", SUPERVISOR_POLL_TIMEOUT="10")
+    proc = await asyncio.create_subprocess_exec(sys.executable, bot.__file__, env=env,
+                                                stdout=asyncio.subprocess.DEVNULL)
+    deadline = time.perf_counter() + 60
+    while api.calls.get("getMe", 0) < shards or not api.calls.get("getUpdates"):
+        if proc.returncode is not None or time.perf_counter() > deadline:
+            raise SystemExit(f"WORKERS={shards}: Bot startet nicht")
+        await asyncio.sleep(0.05)
+
+    t0 = time.perf_counter()
+    users = [VirtualUser(api, 100000 + i, args.think, args.timeout) for i in range(args.users)]
+    await asyncio.gather(*(u.run(args.iterations) for u in users))
+    secs = time.perf_counter() - t0
+    updates = api.next_update_id - 1
+    gid = await _group_abo(api, bot, shards, args.timeout)
+    proc.send_signal(signal.SIGTERM)
+    await proc.wait()
+    await api.server.stop()
+    with sqlite3.connect(env["PERSISTENCE_DB"]) as db:  # после остановки всё записано
+        left = db.execute("SELECT COUNT(*) FROM bot_items WHERE key = 'tages_abo' AND item = ?", (gid,)).fetchone()[0]
+    if left:
+        print(f"  WORKERS={shards}: Gruppe {gid} nach Abbestellung durch ein anderes Mitglied noch abonniert")
+    every = [x for xs in api.latency.values() for x in xs]
+    return {"shards": shards, "updates": updates, "secs": secs,
+            "p50": _percentile(every, 50), "p95": _percentile(every, 95), "p99": _percentile(every, 99),
+            "errors": sum(u.errors for u in users) + left}
+
+async def _group_abo(api: FakeBotAPI, bot, shards: int, timeout: float) -> int:
+    """Группа: A считает Tagesenergie и подписывает чат, B (по user id — другой воркер) отписывает.
+    Остаться подписанной группа не должна — это проверяет run_sharded по базе."""
+    gid = -100777
+    de = range(900000, 903000, 3)  # _user: uid % 3 == 0 — language_code "de", ответы сверяем по немецкому тексту
+    a = next(uid for uid in de if shards == 1 or bot.shard_of(uid, shards) != bot.shard_of(gid, shards))
+    b = next(uid for uid in de if uid > a and (shards == 1 or bot.shard_of(uid, shards) != bot.shard_of(a, shards)))
+    chat = api.chat(gid)
+    for update, expect in ((_click(a, "calc_day"), "TT.MM.JJJJ"), (_text(a, "14.03.1985"), "Tagesenergie"),
+                           (_click(a, "abo_day"), "Abonniert"), (_click(b, "abo_off"), "abbestellt")):
+        await api.inject(gid, _in_group(update, gid), "gruppe")
+        await asyncio.wait_for(chat.inbox.get(), timeout)
+        await asyncio.sleep(0.2)  # хвост ответа (несколько сообщений)
+        while not chat.inbox.empty():
+            chat.inbox.get_nowait()
+        if not any(expect in t for t in chat.texts):
+            raise SystemExit(f"WORKERS={shards}: Gruppe — keine Antwort mit {expect!r}: {list(chat.texts)[-1:]}")
+        chat.texts.clear()
+    return gid
+
+async def run_shards(args, bot) -> int:
+    rows = [await run_sharded(args, bot, n) for n in args.shards]
+    print(f"Shards ({os.cpu_count()} CPU): {args.users} Benutzer × {args.iterations} Abläufe")
+    print(f"  {'Worker':>6} {'Updates/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'Timeouts':>9}")
+    for r in rows:
+        print(f"  {r['shards']:>6} {r['updates'] / r['secs']:>10.0f} " +
+              " ".join(f"{1000 * r[k]:>9.1f}" for k in ("p50", "p95", "p99")) + f" {r['errors']:>9}")
+    return sum(r["errors"] for r in rows)
+
+def main():
+    ap = argparse.ArgumentParser(description="KeyToFate Lasttest gegen eine lokale Bot-API")
+    ap.add_argument("--users", type=int, default=1000, help="virtuelle Benutzer (gleichzeitig)")
+    ap.add_argument("--iterations", type=int, default=3, help="Abläufe pro Benutzer")
+    ap.add_argument("--think", type=float, default=0.0, help="max. Denkpause zwischen Schritten, s")
+    ap.add_argument("--timeout", type=float, default=30.0, help="max. Wartezeit auf eine Antwort, s")
+    ap.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    ap.add_argument("--record", help="Update-Strom als JSONL aufzeichnen")
+    ap.add_argument("--replay", help="aufgezeichneten JSONL-Strom abspielen")
+    ap.add_argument("--speed", type=float, default=1.0, help="Tempo beim Abspielen (0 = ohne Pausen)")
+    ap.add_argument("--real-limits", action="store_true", help="Telegram-Limits in OUTBOUND beibehalten")
+    ap.add_argument("--db", help="SQLite-Datei (Standard: temporär)")
+    ap.add_argument("--shards", type=lambda v: [int(x) for x in v.split(",")],
+                    help="Worker-Zahlen vergleichen, z. B. 1,2,4,8 (Bot als eigener Prozess)")
+    args = ap.parse_args()
+    bot = _bootstrap(args)
+    errors = asyncio.run(run_shards(args, bot) if args.shards else run(args, bot))
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    main()